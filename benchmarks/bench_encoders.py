@@ -0,0 +1,63 @@
+"""
+利用可能な動画エンコーダごとに、サンプルクリップの速度変更にかかる時間を計測する。
+
+    python -m benchmarks.bench_encoders --sample sample/20221002_184909_0.ts
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_segment
+from ts_convertor import available_encoders, speed_up_ts_file
+
+
+def benchmark_encoders(sample_file: str, speed_factor: float = 10.0) -> dict:
+    """
+    :return: エンコーダ名 -> 処理時間[秒] (失敗した場合は None)
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for encoder in available_encoders():
+            output = os.path.join(work_dir, f"{encoder}.ts")
+            start = time.perf_counter()
+            speed_up_ts_file(
+                sample_file,
+                output,
+                speed_factor=speed_factor,
+                engine="reencode",
+                encoder=encoder,
+            )
+            elapsed = time.perf_counter() - start
+            results[encoder] = elapsed if os.path.exists(output) else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark available encoders.")
+    parser.add_argument(
+        "--sample",
+        default=None,
+        type=str,
+        help="Sample clip to encode (default: a generated 60 s testsrc clip).",
+    )
+    parser.add_argument("--speed_factor", default=10.0, type=float)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        sample = args.sample or generate_segment(
+            os.path.join(work_dir, "sample.ts"), duration=60.0
+        )
+        results = benchmark_encoders(sample, args.speed_factor)
+
+    print(f"{'encoder':<20} {'wall[s]':>8}")
+    for encoder, elapsed in sorted(
+        results.items(), key=lambda item: (item[1] is None, item[1])
+    ):
+        wall = "failed" if elapsed is None else f"{elapsed:.2f}"
+        print(f"{encoder:<20} {wall:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+speed_up_ts_file の再エンコード版とキーフレームのみ版を比較するベンチマーク。
+
+    python -m benchmarks.bench_speed_up --duration 300 --gop 30 --speed_factor 30
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_segment
+from ts_convertor import speed_up_ts_file
+
+
+def measure_ssim(reference_file: str, distorted_file: str) -> float | None:
+    """2つの動画のSSIM (All) をffmpegのssimフィルタで計測する"""
+    command = [
+        "ffmpeg",
+        "-i",
+        distorted_file,
+        "-i",
+        reference_file,
+        "-lavfi",
+        "[0:v][1:v]ssim",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    match = re.search(r"All:([\d.]+)", result.stderr)
+    return float(match.group(1)) if match else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speed-up engines.")
+    parser.add_argument("--duration", default=300.0, type=float)
+    parser.add_argument("--size", default="1280x720", type=str)
+    parser.add_argument("--fps", default=30, type=int)
+    parser.add_argument("--gop", default=30, type=int)
+    parser.add_argument("--speed_factor", default=30.0, type=float)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, "source.ts")
+        generate_segment(
+            source, duration=args.duration, size=args.size, fps=args.fps, gop=args.gop
+        )
+
+        outputs = {}
+        print(f"{'engine':<10} {'wall[s]':>8} {'size[MB]':>9}")
+        for engine in ("reencode", "keyframe"):
+            output = os.path.join(work_dir, f"{engine}.ts")
+            start = time.perf_counter()
+            speed_up_ts_file(
+                source, output, speed_factor=args.speed_factor, engine=engine
+            )
+            elapsed = time.perf_counter() - start
+            outputs[engine] = output
+            size = os.path.getsize(output) / 1e6 if os.path.exists(output) else 0
+            print(f"{engine:<10} {elapsed:>8.2f} {size:>9.2f}")
+
+        ssim = measure_ssim(outputs["reencode"], outputs["keyframe"])
+        print(f"SSIM(keyframe vs reencode): {ssim}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+aggregate_ts_files を多数同時に実行し、各出力が自分の入力だけを漏れなく連結しているかを検証する。
+スレッドとプロセスの両方で、同じ作業ディレクトリから実行する。
+
+    python -m benchmarks.stress_aggregate --jobs 32 --workers 8
+    python -m benchmarks.stress_aggregate --jobs 32 --workers 8 --processes
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmarks.synthetic import generate_segment
+from lib.probe import ProbeCache, probe_media
+from ts_convertor import aggregate_ts_files
+
+# 連結結果の長さの許容誤差 (秒)
+DURATION_TOLERANCE = 0.5
+
+
+def _aggregate(job: tuple[list[str], str]) -> bool:
+    ts_files, output_file = job
+    return aggregate_ts_files(ts_files, output_file)
+
+
+def run_stress(
+    jobs: int = 32,
+    workers: int = 8,
+    segments_per_job: int = 3,
+    use_processes: bool = False,
+) -> list[str]:
+    """
+    ジョブごとに長さの異なるセグメントの組を用意して同時に連結し、出力の長さを検証する。
+    先頭セグメントをジョブ固有の長さ (i+1 秒) にして合計の長さを全ジョブで別々にするので、
+    他のジョブの入力が混ざったり欠けたりすれば長さの違いとして検出できる。
+
+    :return: 検証に失敗したジョブの説明のリスト (空なら成功)
+    """
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 先頭はジョブ番号で決まる目印の長さ、残りは (1..5) 秒を順に並べる
+        plans = [
+            [i + 1] + [k % 5 + 1 for k in range(1, segments_per_job)]
+            for i in range(jobs)
+        ]
+        templates = {}
+        for seconds in sorted({s for durations in plans for s in durations}):
+            templates[seconds] = generate_segment(
+                os.path.join(work_dir, f"template_{seconds}s.ts"),
+                duration=seconds,
+                size="320x240",
+            )
+
+        plan = []
+        for i, durations in enumerate(plans):
+            job_dir = os.path.join(work_dir, f"job{i:03d}")
+            os.makedirs(job_dir)
+            ts_files = []
+            for k, seconds in enumerate(durations):
+                path = os.path.join(job_dir, f"20240101_{k:06d}_0.ts")
+                os.link(templates[seconds], path)
+                ts_files.append(path)
+            plan.append(
+                (ts_files, os.path.join(job_dir, "aggregated.ts"), sum(durations))
+            )
+
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            results = list(
+                executor.map(_aggregate, [(files, output) for files, output, _ in plan])
+            )
+
+        cache = ProbeCache(os.path.join(work_dir, "probe_cache.json"))
+        for (ts_files, output, expected), ok in zip(plan, results):
+            info = probe_media(output, cache) if ok else None
+            duration = info.get("duration") if info else None
+            if duration is None or abs(duration - expected) > DURATION_TOLERANCE:
+                failures.append(f"{output}: expected {expected}s, got {duration}")
+        leftovers = [name for name in os.listdir(".") if name == "file_list.txt"]
+        if leftovers:
+            failures.append("file_list.txt was left in the working directory")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress-test concurrent aggregation.")
+    parser.add_argument("--jobs", default=32, type=int)
+    parser.add_argument("--workers", default=8, type=int)
+    parser.add_argument("--segments_per_job", default=3, type=int)
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run the aggregations in separate processes instead of threads.",
+    )
+    args = parser.parse_args()
+
+    failures = run_stress(
+        args.jobs, args.workers, args.segments_per_job, args.processes
+    )
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{len(failures)} failures in {args.jobs} concurrent aggregations")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
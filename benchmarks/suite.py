@@ -0,0 +1,343 @@
+"""
+合成したドライブレコーダー風のカードで取り込み処理を計測するベンチマークスイート。
+各ケースを別プロセスで実行し、処理時間・ピークRSS (ffmpeg の子プロセスを含む)・
+ディスク書き込み量・出力サイズを記録する。結果はコミットごとのJSONに保存し、比較できる。
+
+    python -m benchmarks.suite --scenarios 1,10,60
+    python -m benchmarks.suite --scenarios 720 --cases process_ts_files
+    python -m benchmarks.suite --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import generate_card
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+USB_NAME = "BENCH"
+MOVIE_TARGET_PATH = "video"
+# カードの長さ (分)。1分から12時間まで
+DEFAULT_SCENARIOS = (1, 10, 60)
+CASES = (
+    "process_ts_files",
+    "aggregate_ts_files",
+    "speed_up_ts_file",
+    "render_speed_up_video",
+    "render_zoomed_video",
+    "render_graph",
+)
+# これ以上遅くなったら比較で警告する割合
+REGRESSION_THRESHOLD = 0.10
+
+
+def _clone_tree(src: str, dst: str):
+    """カードをハードリンクで複製する (process_ts_files はソースを削除するため、ケースごとに複製する)"""
+    shutil.copytree(src, dst, copy_function=os.link)
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss は Linux では KiB、macOS ではバイト
+    unit = 1 if sys.platform == "darwin" else 1024
+    return unit * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def _written_bytes() -> int:
+    # ブロックデバイスへの書き込み (512バイト単位)。tmpfs では 0 になる
+    return 512 * sum(
+        resource.getrusage(who).ru_oublock
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    )
+
+
+def _tree_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def run_case(case: str, card_dir: str, work_dir: str) -> dict:
+    """
+    1つのケースを実行する (--run_case で起動された子プロセスの中で呼ばれる)。
+    card_dir の下には generate_card で作った front/ と rear/ がある。
+    """
+    from lib.probe import use_shared_cache
+
+    use_shared_cache(os.path.join(work_dir, "probe_cache.json"))
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+    front_files = sorted(
+        os.path.join(card_dir, "front", name)
+        for name in os.listdir(os.path.join(card_dir, "front"))
+    )
+    aggregated = os.path.join(work_dir, "aggregated.ts")
+
+    def prepare_aggregated():
+        from ts_convertor import stream_aggregate_ts_files
+
+        stream_aggregate_ts_files(front_files, aggregated)
+
+    if case == "process_ts_files":
+        from monitor_device import process_ts_files
+
+        volume = os.path.join(work_dir, "volume")
+        _clone_tree(card_dir, os.path.join(volume, USB_NAME, MOVIE_TARGET_PATH))
+        run = lambda: process_ts_files(volume, USB_NAME, MOVIE_TARGET_PATH, output_dir)
+    elif case == "aggregate_ts_files":
+        from ts_convertor import aggregate_ts_files
+
+        run = lambda: aggregate_ts_files(
+            front_files, os.path.join(output_dir, "aggregated.ts")
+        )
+    elif case == "speed_up_ts_file":
+        from ts_convertor import speed_up_ts_file
+
+        prepare_aggregated()
+        run = lambda: speed_up_ts_file(
+            aggregated, os.path.join(output_dir, "speedup.ts")
+        )
+    elif case == "render_speed_up_video":
+        from lib.render import speed_up_video
+
+        prepare_aggregated()
+        run = lambda: speed_up_video(aggregated, os.path.join(output_dir, "speedup.ts"))
+    elif case == "render_zoomed_video":
+        from lib.render import render_zoomed_video
+
+        prepare_aggregated()
+        run = lambda: render_zoomed_video(
+            aggregated, os.path.join(output_dir, "zoomed.ts")
+        )
+    elif case == "render_graph":
+        from lib.render import RenderGraph
+
+        # 速度変更した動画とズーム版を1回のデコードで出力する
+        run = (
+            RenderGraph(front_files)
+            .speed_up(10)
+            .add_output(os.path.join(output_dir, "timelapse.ts"))
+            .add_output(os.path.join(output_dir, "zoomed.ts"), zoom_factor=0.84)
+            .run
+        )
+    else:
+        raise ValueError(f"Unknown case: {case}")
+
+    written_before = _written_bytes()
+    start = time.perf_counter()
+    run()
+    wall = time.perf_counter() - start
+    measured = {
+        "wall_seconds": wall,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "disk_written_bytes": _written_bytes() - written_before,
+        "output_bytes": _tree_size(output_dir),
+    }
+    # 失敗しても例外にならない関数が多いので、出力の有無で成否を判定する
+    if not any(name.endswith(".ts") for name in os.listdir(output_dir)):
+        measured["error"] = "no output produced"
+    return measured
+
+
+def _run_case_in_subprocess(case: str, card_dir: str, scratch_dir: str) -> dict:
+    """ピークRSSをケースごとに分けるため、新しいPythonプロセスで1ケースを実行する"""
+    work_dir = tempfile.mkdtemp(prefix=f"{case}_", dir=scratch_dir)
+    try:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.suite",
+                "--run_case",
+                case,
+                "--card_dir",
+                card_dir,
+                "--work_dir",
+                work_dir,
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        if result.returncode != 0:
+            return {"error": f"exit status {result.returncode}"}
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _ffmpeg_version() -> str:
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-version"], stdout=subprocess.PIPE, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return result.stdout.splitlines()[0]
+
+
+def run_suite(
+    scenarios: list[float],
+    cases: list[str],
+    segment_seconds: float = 60.0,
+    size: str = "1280x720",
+    scratch_dir: str | None = None,
+) -> dict:
+    """
+    各シナリオ (カードの長さ) ごとにカードを1回生成し、全ケースを実行する。
+
+    :return: メタデータと (シナリオ, ケース) ごとの計測結果
+    """
+    report = {
+        "revision": _git_revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": _ffmpeg_version(),
+        },
+        "params": {"segment_seconds": segment_seconds, "size": size},
+        "results": [],
+    }
+    for minutes in scenarios:
+        with tempfile.TemporaryDirectory(dir=scratch_dir) as scenario_dir:
+            card_dir = os.path.join(scenario_dir, "card")
+            generate_card(card_dir, minutes, segment_seconds=segment_seconds, size=size)
+            for case in cases:
+                measured = _run_case_in_subprocess(case, card_dir, scenario_dir)
+                report["results"].append({"minutes": minutes, "case": case, **measured})
+                _print_row(minutes, case, measured)
+    return report
+
+
+def _print_row(minutes: float, case: str, measured: dict):
+    if "error" in measured:
+        print(f"{minutes:>7g}m {case:<24} {measured['error']}")
+        return
+    print(
+        f"{minutes:>7g}m {case:<24} {measured['wall_seconds']:>9.2f}s "
+        f"{measured['peak_rss_bytes'] / 2**20:>8.1f}MiB "
+        f"{measured['disk_written_bytes'] / 1e6:>9.1f}MB written "
+        f"{measured['output_bytes'] / 1e6:>8.1f}MB out"
+    )
+
+
+def compare_reports(baseline: dict, current: dict) -> bool:
+    """
+    2つの結果を比較して表示する。
+    :return: REGRESSION_THRESHOLD を超えて遅くなったケースが無ければ True
+    """
+    key = lambda r: (r["minutes"], r["case"])
+    base = {key(r): r for r in baseline["results"] if "error" not in r}
+    ok = True
+    print(f"{baseline['revision']} -> {current['revision']}")
+    for result in current["results"]:
+        before = base.get(key(result))
+        if before is None or "error" in result:
+            continue
+        ratio = result["wall_seconds"] / max(before["wall_seconds"], 1e-9)
+        rss_ratio = result["peak_rss_bytes"] / max(before["peak_rss_bytes"], 1)
+        regressed = ratio > 1 + REGRESSION_THRESHOLD
+        ok = ok and not regressed
+        print(
+            f"{result['minutes']:>7g}m {result['case']:<24} "
+            f"wall x{ratio:.2f}  rss x{rss_ratio:.2f}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest path.")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(map(str, DEFAULT_SCENARIOS)),
+        type=str,
+        help="Comma-separated card lengths in minutes (e.g. 1,60,720).",
+    )
+    parser.add_argument(
+        "--cases",
+        default=",".join(CASES),
+        type=str,
+        help=f"Comma-separated cases to run ({', '.join(CASES)}).",
+    )
+    parser.add_argument("--segment_seconds", default=60.0, type=float)
+    parser.add_argument("--size", default="1280x720", type=str)
+    parser.add_argument(
+        "--scratch_dir",
+        default=None,
+        type=str,
+        help="Where to generate the cards (use a real disk to measure writes).",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        type=str,
+        help="Result file (default: benchmarks/results/<revision>.json).",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="Compare two result files and exit non-zero on a regression.",
+    )
+    # 子プロセス用
+    parser.add_argument("--run_case", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--card_dir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--work_dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        # ログは stderr に出るので、stdout の最終行だけを結果として返す
+        print(json.dumps(run_case(args.run_case, args.card_dir, args.work_dir)))
+        return
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(0 if compare_reports(baseline, current) else 1)
+
+    report = run_suite(
+        [float(m) for m in args.scenarios.split(",")],
+        [case.strip() for case in args.cases.split(",")],
+        segment_seconds=args.segment_seconds,
+        size=args.size,
+        scratch_dir=args.scratch_dir,
+    )
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['revision']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import subprocess
+from datetime import datetime, timedelta
+
+
+def generate_segment(
+    output_file: str,
+    duration: float = 60.0,
+    size: str = "1280x720",
+    fps: int = 30,
+    gop: int = 30,
+):
+    """
+    ffmpegのtestsrcでドライブレコーダー風のTSセグメントを生成する。
+    """
+    command = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=size={size}:rate={fps}:duration={duration}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-g",
+        str(gop),
+        "-pix_fmt",
+        "yuv420p",
+        "-f",
+        "mpegts",
+        output_file,
+    ]
+    subprocess.run(command, check=True)
+    return output_file
+
+
+def generate_card(
+    root_dir: str,
+    total_minutes: float,
+    segment_seconds: float = 60.0,
+    start: datetime = datetime(2024, 1, 1, 9, 0, 0),
+    cameras: tuple = ("front", "rear"),
+    **segment_kwargs,
+) -> dict[str, list[str]]:
+    """
+    MovieFilename形式 (yyyymmdd_hhmmss_<camera>.ts) のセグメントを
+    root_dir/front, root_dir/rear に生成する。同じ内容の1セグメントを
+    コピーして増やすことで、長時間のカードでも生成時間を抑える。
+
+    :return: カメラ名 -> 生成したファイルパスのリスト
+    """
+    camera_ids = {"front": "0", "rear": "1"}
+    segment_count = max(1, int(total_minutes * 60 // segment_seconds))
+
+    template = os.path.join(root_dir, "template.ts")
+    os.makedirs(root_dir, exist_ok=True)
+    generate_segment(template, duration=segment_seconds, **segment_kwargs)
+
+    files = {}
+    for camera in cameras:
+        camera_dir = os.path.join(root_dir, camera)
+        os.makedirs(camera_dir, exist_ok=True)
+        files[camera] = []
+        for i in range(segment_count):
+            timestamp = start + timedelta(seconds=i * segment_seconds)
+            name = f"{timestamp:%Y%m%d_%H%M%S}_{camera_ids[camera]}.ts"
+            path = os.path.join(camera_dir, name)
+            # 同じファイルシステム上ならハードリンクで容量を使わずに複製
+            try:
+                os.link(template, path)
+            except OSError:
+                with open(template, "rb") as src, open(path, "wb") as dst:
+                    dst.write(src.read())
+            files[camera].append(path)
+    os.remove(template)
+    return files
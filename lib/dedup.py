@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+# 内容の一部から指紋を作るときに読むブロックの大きさ (先頭・中央・末尾)
+SAMPLE_BLOCK_SIZE = 64 * 1024
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+KIND_SEGMENT = "segment"  # 取り込み済みのSDカードのセグメント
+KIND_UPLOAD = "upload"  # アップロード済みの出力ファイル
+
+
+def sampled_fingerprint(path: str) -> str:
+    """
+    サイズと先頭・中央・末尾のブロックから指紋を作る。ファイル全体は読まない。
+    小さいファイルは全体を読む。
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= 3 * SAMPLE_BLOCK_SIZE:
+            digest.update(f.read())
+        else:
+            for offset in (
+                0,
+                (size - SAMPLE_BLOCK_SIZE) // 2,
+                size - SAMPLE_BLOCK_SIZE,
+            ):
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    """ファイル全体の sha256 (ts_convertor がストリーミング中に計算するチェックサムと同じ)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(FULL_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    内容が同じファイル (別名でコピーされたセグメントや、作り直された出力) を見つけるための索引 (SQLite)。
+
+    まずサイズで索引を引き、同じサイズのものがあれば sampled_fingerprint を比べる。
+    ほとんどのファイルはここまでで (セグメントはファイルを読まずに) 判定できる。
+    指紋まで一致した場合だけ sha256 を比べて確定する。記録時に sha256 が分かっていれば
+    (取り込みのチェックサム) 保存し、分からなければ照合が必要になったときに元のファイルから計算する。
+    元のファイルが消えていて照合できない場合は重複とみなさない。
+    複数のスレッドから同時に利用できる。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # (パス, サイズ, 更新時刻) -> sha256。ジョブのスレッドから同時に使うため _hashes_lock で守る
+        self._hashes = {}
+        self._hashes_lock = threading.Lock()
+        # 取り込みとアップロードの別プロセスから同じファイルを開くことがある
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sample TEXT NOT NULL,
+                    sha256 TEXT,
+                    path TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (kind, path)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS fingerprints_by_size "
+                "ON fingerprints (kind, size)"
+            )
+
+    def _full_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._hashes_lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            # ファイル全体を読む間はロックを持たない (同じファイルを2回読むことはあり得る)
+            digest = full_hash(path)
+            with self._hashes_lock:
+                self._hashes[key] = digest
+        return digest
+
+    def find_duplicate(self, kind: str, path: str) -> str | None:
+        """
+        path と同じ内容のファイルが記録済みなら、記録されたパスを返す。
+        """
+        try:
+            size = os.path.getsize(path)
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT sample, sha256, path FROM fingerprints "
+                    "WHERE kind = ? AND size = ?",
+                    (kind, size),
+                ).fetchall()
+            if not rows:
+                return None
+            sample = sampled_fingerprint(path)
+            rows = [row for row in rows if row[0] == sample]
+            if not rows:
+                return None
+
+            # 指紋が一致した場合だけファイル全体を比べる
+            digest = self._full_hash(path)
+            for _, stored, original in rows:
+                if stored is None:
+                    if not os.path.exists(original):
+                        continue
+                    stored = self._full_hash(original)
+                    with self._lock, self._conn:
+                        self._conn.execute(
+                            "UPDATE fingerprints SET sha256 = ? WHERE kind = ? AND path = ?",
+                            (stored, kind, original),
+                        )
+                if stored == digest:
+                    return original
+        except OSError as e:
+            logger.warning(f"Cannot check {path} for duplicates: {e}")
+        return None
+
+    def find_duplicates(self, kind: str, paths: list[str]) -> dict[str, str]:
+        """:return: 重複しているパス -> 記録済みのパス"""
+        found = {}
+        for path in paths:
+            original = self.find_duplicate(kind, path)
+            if original is not None:
+                found[path] = original
+        return found
+
+    def record(self, kind: str, paths: list[str], checksums: dict = None):
+        """
+        paths を記録する。checksums (パス -> sha256) があれば一緒に保存する。
+        """
+        now = time.time()
+        rows = []
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                sample = sampled_fingerprint(path)
+            except OSError as e:
+                logger.warning(f"Cannot record {path} in the dedup index: {e}")
+                continue
+            checksum = (checksums or {}).get(path)
+            rows.append((kind, size, sample, checksum, os.path.abspath(path), now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(kind, size, sample, sha256, path, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,93 @@
+import csv
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class Gazetteer:
+    """
+    ローカルの地名辞書 (CSV: name, latitude, longitude) を使ったオフラインの逆ジオコーダ。
+    地点を cell_deg 度四方のグリッドに振り分けておき、問い合わせ点の周囲のセルだけを
+    NumPy で距離計算するため、数十万件の辞書でも1回の検索は軽い。
+
+    GeoNames の cities500.txt などを name, latitude, longitude 列のCSVに変換して使う。
+    """
+
+    def __init__(self, gazetteer_path: str, cell_deg: float = 0.1):
+        self.cell_deg = cell_deg
+        names, lats, lons = [], [], []
+        with open(gazetteer_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                names.append(row["name"])
+                lats.append(float(row["latitude"]))
+                lons.append(float(row["longitude"]))
+
+        self.names = names
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+
+        cells = {}
+        cell_x = np.floor(self.lons / cell_deg).astype(np.int64)
+        cell_y = np.floor(self.lats / cell_deg).astype(np.int64)
+        for index, cell in enumerate(zip(cell_x.tolist(), cell_y.tolist())):
+            cells.setdefault(cell, []).append(index)
+        self._cells = {cell: np.asarray(idx) for cell, idx in cells.items()}
+
+    def _candidates(self, latitude: float, longitude: float, radius: int) -> list:
+        cx = math.floor(longitude / self.cell_deg)
+        cy = math.floor(latitude / self.cell_deg)
+        return [
+            self._cells[(x, y)]
+            for x in range(cx - radius, cx + radius + 1)
+            for y in range(cy - radius, cy + radius + 1)
+            if (x, y) in self._cells
+        ]
+
+    def nearest(
+        self, latitude: float, longitude: float, max_distance_km: float = 10.0
+    ) -> tuple[str, float] | None:
+        """
+        :return: (地名, 距離km)。max_distance_km 以内に無ければ None
+        """
+        # max_distance_km を覆うのに必要なセル数まで範囲を広げる
+        km_per_cell = (
+            self.cell_deg * 111.0 * max(math.cos(math.radians(latitude)), 0.01)
+        )
+        max_radius = max(1, math.ceil(max_distance_km / km_per_cell))
+
+        radius = 1
+        while True:
+            best = self._nearest_within(latitude, longitude, radius)
+            # リングの外側の点は radius セル分以上離れているので、それより近ければ確定
+            if radius >= max_radius or (
+                best is not None and best[1] <= radius * km_per_cell
+            ):
+                break
+            radius = min(radius * 2, max_radius)
+
+        if best is None or best[1] > max_distance_km:
+            return None
+        return best
+
+    def _nearest_within(
+        self, latitude: float, longitude: float, radius: int
+    ) -> tuple[str, float] | None:
+        candidates = self._candidates(latitude, longitude, radius)
+        if not candidates:
+            return None
+
+        indexes = np.concatenate(candidates)
+        lat1 = math.radians(latitude)
+        lat2 = np.radians(self.lats[indexes])
+        dlat = lat2 - lat1
+        dlon = np.radians(self.lons[indexes] - longitude)
+        a = (
+            np.sin(dlat / 2) ** 2
+            + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        )
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+        best = int(np.argmin(distances))
+        return self.names[indexes[best]], float(distances[best])
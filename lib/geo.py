@@ -1,8 +1,27 @@
+import queue
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
 import pytesseract
 from PIL import Image
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 from loguru import logger
 
+from lib.gazetteer import Gazetteer
+from lib.geocode_cache import GeocodeCache
+from lib.motion import PTS_TIME_PATTERN
+from lib.probe import probe_media
+
+# 映像に焼き込まれた日時・GPS情報の領域 (x, y, 幅, 高さ)。フレームに対する割合で指定
+DEFAULT_OVERLAY_BOX = (0.0, 0.8, 0.35, 0.2)
+
+# GPSトラックの1点 (動画先頭からの秒数, 緯度, 経度)
+GPS_TRACK_DTYPE = np.dtype([("t", "f8"), ("lat", "f8"), ("lon", "f8")])
+
 
 def extract_text_from_image(image_path: str) -> str:
     return pytesseract.image_to_string(Image.open(image_path))
@@ -19,13 +38,222 @@ def extract_coordinates(text: str) -> tuple[float, float] or None:
     return None, None
 
 
-def get_address(latitude: float, longitude: float) -> str | None:
-    geolocator = Nominatim(user_agent="test")
-    location = geolocator.reverse((latitude, longitude), language="ja")
-    if location is None or location.address is None:
-        return None
+def sample_overlay_frames(
+    ts_file: str,
+    interval: float = 10.0,
+    overlay_box: tuple = DEFAULT_OVERLAY_BOX,
+) -> Iterator[tuple[float, np.ndarray]]:
+    """
+    動画から interval 秒ごとにフレームを取り出し、オーバーレイ領域だけを
+    グレースケールの NumPy 配列として返す。
+    フレームはキーフレームのみデコードし、ffmpeg のフィルタで切り出してから rawvideo で
+    直接受け取る (画像ファイルは書き出さない)。
+    時刻は showinfo が出力するデコード後のタイムスタンプから取るため、キーフレームの間隔が
+    interval の倍数でなくても実際の時刻になる。
+
+    :return: (動画先頭からの秒数, 切り出した配列) のイテレータ
+    """
+    info = probe_media(ts_file)
+    if not info or not info.get("width") or not info.get("height"):
+        logger.warning(f"Cannot sample overlay frames of {ts_file}: probe failed")
+        return
+    width = info["width"]
+    height = info["height"]
+
+    x0 = int(width * overlay_box[0])
+    y0 = int(height * overlay_box[1])
+    crop_width = min(width, x0 + int(width * overlay_box[2])) - x0
+    crop_height = min(height, y0 + int(height * overlay_box[3])) - y0
+    if crop_width <= 0 or crop_height <= 0:
+        logger.warning(f"Overlay box {overlay_box} is outside of {ts_file}")
+        return
+
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        # showinfo の出力は info レベル
+        "-loglevel",
+        "info",
+        "-skip_frame",
+        "nokey",
+        "-i",
+        ts_file,
+        "-an",
+        "-vf",
+        # 前に選んだフレームから interval 秒以上離れたキーフレームを選ぶ
+        f"select=isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval}),"
+        f"crop={crop_width}:{crop_height}:{x0}:{y0},format=gray,showinfo",
+        # 選んだフレームの間を複製で埋めない (-fps_mode の旧名で、古い ffmpeg でも使える)
+        "-vsync",
+        "passthrough",
+        "-f",
+        "rawvideo",
+        "pipe:1",
+    ]
+    frame_size = crop_width * crop_height
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr を読まないと info レベルの出力でパイプが詰まるため、別スレッドで時刻を集める
+    times = queue.Queue()
+
+    def read_times():
+        for line in process.stderr:
+            match = PTS_TIME_PATTERN.search(line)
+            if match:
+                times.put(float(match.group(1)))
+        times.put(None)
+
+    reader = threading.Thread(target=read_times, daemon=True)
+    reader.start()
+    try:
+        while True:
+            raw = process.stdout.read(frame_size)
+            if len(raw) < frame_size:
+                break
+            # showinfo はフレームを書き出す前に出力するので、時刻は先に届いている
+            t = times.get()
+            if t is None:
+                break
+            frame = np.frombuffer(raw, dtype=np.uint8).reshape(crop_height, crop_width)
+            yield t, frame
+    finally:
+        process.stdout.close()
+        process.wait()
+        reader.join()
+        process.stderr.close()
+
+
+def _ocr_coordinates(frame: np.ndarray) -> tuple[float, float] | tuple[None, None]:
+    """ワーカープロセスで1フレーム分のOCRを行い、緯度・経度を返す"""
+    try:
+        text = pytesseract.image_to_string(Image.fromarray(frame))
+        return extract_coordinates(text)
+    except (ValueError, IndexError, pytesseract.TesseractError):
+        return None, None
+
+
+def extract_gps_track(
+    ts_file: str,
+    interval: float = 10.0,
+    overlay_box: tuple = DEFAULT_OVERLAY_BOX,
+    workers: int | None = None,
+    batch_size: int = 256,
+) -> np.ndarray:
+    """
+    動画全体から一定間隔でGPS座標を読み取り、GPSトラックを作成する。
+    OCRはプロセスプールで並列に実行し、メモリ使用量を抑えるため
+    batch_size フレームずつ処理する。
+
+    :param ts_file: 入力動画
+    :param interval: サンプリング間隔（秒）
+    :param overlay_box: GPS情報の領域 (x, y, 幅, 高さ) の割合
+    :param workers: OCRのプロセス数（Noneの場合はCPU数）
+    :return: GPS_TRACK_DTYPE の構造化配列。読み取れなかったフレームは含まない
+    """
+    track = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        batch = []
+
+        def flush():
+            times = [t for t, _ in batch]
+            frames = [frame for _, frame in batch]
+            for t, (lat, lon) in zip(times, executor.map(_ocr_coordinates, frames)):
+                if lat is not None and lon is not None:
+                    track.append((t, lat, lon))
+            batch.clear()
+
+        for sample in sample_overlay_frames(ts_file, interval, overlay_box):
+            batch.append(sample)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    logger.info(f"Extracted {len(track)} GPS points from {ts_file}")
+    return np.array(track, dtype=GPS_TRACK_DTYPE)
+
+
+_reverse = None
+_reverse_lock = threading.Lock()
+
+
+def _nominatim_reverse():
+    """
+    Nominatim クライアントをプロセス内で1つだけ作り、利用規約 (1リクエスト/秒) を
+    守るように RateLimiter で包んで共有する。
+    """
+    global _reverse
+    with _reverse_lock:
+        if _reverse is None:
+            geolocator = Nominatim(user_agent="test")
+            _reverse = RateLimiter(geolocator.reverse, min_delay_seconds=1.0)
+    return _reverse
+
+
+def get_address(
+    latitude: float,
+    longitude: float,
+    cache: GeocodeCache | None = None,
+    gazetteer: Gazetteer | None = None,
+) -> str | None:
+    """
+    緯度・経度から住所を取得する。
+
+    :param cache: 指定した場合、同じジオハッシュのセルは以前の結果を再利用する
+    :param gazetteer: 指定した場合、Nominatim の代わりにローカルの地名辞書で検索する
+    """
+    key = cache.key(latitude, longitude) if cache else None
+    if cache:
+        hit, address = cache.get(key)
+        if hit:
+            return address
+
+    address = _lookup_address(latitude, longitude, gazetteer)
+    if cache:
+        cache.put(key, address)
+    return address
+
+
+def _lookup_address(
+    latitude: float, longitude: float, gazetteer: Gazetteer | None
+) -> str | None:
+    if gazetteer is not None:
+        nearest = gazetteer.nearest(latitude, longitude)
+        return nearest[0] if nearest else None
+    location = _nominatim_reverse()((latitude, longitude), language="ja")
+    return None if location is None else location.address
+
+
+def reverse_geocode_track(
+    track: np.ndarray,
+    cache: GeocodeCache,
+    gazetteer: Gazetteer | None = None,
+) -> list[str | None]:
+    """
+    GPSトラック全体をまとめて逆ジオコーディングする。
+    同じジオハッシュのセルに入る点は1回だけ問い合わせ、キャッシュ済みのセルは
+    ネットワークにアクセスしない。
+
+    :param track: GPS_TRACK_DTYPE の構造化配列
+    :return: トラックの各点に対応する住所のリスト
+    """
+    keys = [cache.key(lat, lon) for lat, lon in zip(track["lat"], track["lon"])]
+
+    addresses = {}
+    misses = 0
+    for key, lat, lon in zip(keys, track["lat"], track["lon"]):
+        if key in addresses:
+            continue
+        hit, address = cache.get(key)
+        if not hit:
+            misses += 1
+            address = _lookup_address(float(lat), float(lon), gazetteer)
+            cache.put(key, address)
+        addresses[key] = address
 
-    return location.address
+    logger.info(
+        f"Geocoded {len(track)} points ({len(addresses)} cells, {misses} lookups)"
+    )
+    return [addresses[key] for key in keys]
 
 
 def get_address_from_image(image_path: str) -> str | None:
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# 上限を超えたときに max_entries のこの割合だけ余分に削除し、削除の頻度を下げる
+EVICTION_FRACTION = 0.1
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    """
+    緯度・経度をジオハッシュに変換する。precision=7 でおよそ 150m 四方のセルになる。
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits <<= 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+class GeocodeCache:
+    """
+    逆ジオコーディング結果の永続キャッシュ (SQLite)。
+    座標はジオハッシュのセルに量子化してキーにするため、近くの点は同じ結果を共有する。
+    max_entries を超えたら、最後に使われたのが古いものから削除する (LRU)。
+    件数は開いたときに1回だけ数えて以降は手元で数え、上限を超えたときにまとめて削除する。
+    住所が見つからなかった結果 (None) もキャッシュし、同じ問い合わせを繰り返さない。
+    """
+
+    def __init__(
+        self,
+        db_path: str = "geocode_cache.sqlite3",
+        precision: int = 7,
+        max_entries: int = 100_000,
+    ):
+        self.precision = precision
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS geocode (
+                    geohash TEXT PRIMARY KEY,
+                    address TEXT,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)"
+            )
+            self._count = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[
+                0
+            ]
+
+    def key(self, latitude: float, longitude: float) -> str:
+        return geohash_encode(latitude, longitude, self.precision)
+
+    def get(self, geohash: str) -> tuple[bool, str | None]:
+        """
+        :return: (キャッシュにあったか, 住所)
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT address FROM geocode WHERE geohash = ?", (geohash,)
+            ).fetchone()
+            if row is None:
+                return False, None
+            self._conn.execute(
+                "UPDATE geocode SET last_used = ? WHERE geohash = ?",
+                (time.time(), geohash),
+            )
+            return True, row[0]
+
+    def put(self, geohash: str, address: str | None):
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE geocode SET address = ?, last_used = ? WHERE geohash = ?",
+                (address, time.time(), geohash),
+            ).rowcount
+            if updated:
+                return
+            self._conn.execute(
+                "INSERT INTO geocode (geohash, address, last_used) VALUES (?, ?, ?)",
+                (geohash, address, time.time()),
+            )
+            self._count += 1
+            if self._count > self.max_entries:
+                evict = self._count - self.max_entries
+                evict += int(self.max_entries * EVICTION_FRACTION)
+                deleted = self._conn.execute(
+                    "DELETE FROM geocode WHERE geohash IN ("
+                    "SELECT geohash FROM geocode ORDER BY last_used LIMIT ?)",
+                    (evict,),
+                ).rowcount
+                self._count -= deleted
+                logger.debug(f"Evicted {deleted} geocode entries")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+# パイプラインの段階
+STAGE_AGGREGATED = "aggregated"  # 中間の集約ファイルに取り込み済み（速度変更前）
+# 速度変更済みファイルが完成し、最終出力ファイルへの置き換えを待っている
+# (置き換えの直後に中断しても、次回は置き換えを済ませて done にする)
+STAGE_PENDING = "pending"
+STAGE_DONE = "done"  # 最終出力ファイルに取り込み済み
+
+
+class IngestManifest:
+    """
+    取り込み済みのセグメントを記録する永続マニフェスト (SQLite)。
+    セグメントはパス・サイズ・更新時刻で識別するため、同名で中身が
+    差し替わったファイルは別のセグメントとして扱われる。
+    複数のジョブスレッドから同時に利用できる。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    output TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    checksum TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (path, size, mtime_ns)
+                )
+                """
+            )
+
+    @staticmethod
+    def _key(path: str) -> tuple[str, int, int]:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, paths: list[str]) -> dict[str, tuple[str, str]]:
+        """
+        :return: パス -> (stage, output) 。未記録のセグメントは含まれない
+        """
+        found = {}
+        with self._lock:
+            for path in paths:
+                try:
+                    key = self._key(path)
+                except FileNotFoundError:
+                    continue
+                row = self._conn.execute(
+                    "SELECT stage, output FROM segments "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    key,
+                ).fetchone()
+                if row:
+                    found[path] = (row[0], row[1])
+        return found
+
+    def checksums(self, paths: list[str]) -> dict[str, str]:
+        """
+        :return: パス -> 記録済みの sha256 。チェックサムのないセグメントは含まれない
+        """
+        found = {}
+        with self._lock:
+            for path in paths:
+                try:
+                    key = self._key(path)
+                except FileNotFoundError:
+                    continue
+                row = self._conn.execute(
+                    "SELECT checksum FROM segments "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    key,
+                ).fetchone()
+                if row and row[0]:
+                    found[path] = row[0]
+        return found
+
+    def record(self, paths: list[str], output: str, stage: str, checksums: dict = None):
+        """セグメントが output の stage まで処理されたことを記録する"""
+        now = time.time()
+        rows = []
+        for path in paths:
+            try:
+                key = self._key(path)
+            except FileNotFoundError:
+                logger.warning(f"Cannot record missing segment in manifest: {path}")
+                continue
+            checksum = (checksums or {}).get(path)
+            rows.append((*key, os.path.abspath(output), stage, checksum, now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO segments "
+                "(path, size, mtime_ns, output, stage, checksum, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
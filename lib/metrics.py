@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "drive_recorder"
+
+
+class MetricsRecorder:
+    """
+    処理段階 (concat, speed_up, upload など) ごとの計測値を記録する。
+    1件ごとに JSON Lines ファイルへ追記し、同時に Prometheus 形式で公開する集計値を更新する。
+
+    jsonl_path: 追記する JSON Lines ファイル (None なら書き出さない)
+    """
+
+    def __init__(self, jsonl_path: str | None = None):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        # (メトリクス名, stage) -> 値
+        self._counters: dict[tuple[str, str], float] = {}
+        self._gauges: dict[tuple[str, str], float] = {}
+        self._server = None
+
+    def record(self, stage: str, **fields):
+        """
+        1件の計測値を記録する。
+        fields の seconds / bytes_in / bytes_out / frames は累計に、fps / speed は最新値に反映する。
+        """
+        event = {"time": time.time(), "stage": stage, **fields}
+        with self._lock:
+            self._add("runs_total", stage, 1)
+            for name in ("seconds", "bytes_in", "bytes_out", "frames"):
+                if isinstance(fields.get(name), (int, float)):
+                    self._add(f"{name}_total", stage, fields[name])
+            if fields.get("status") == "error":
+                self._add("errors_total", stage, 1)
+            for name in ("fps", "speed"):
+                if isinstance(fields.get(name), (int, float)):
+                    self._gauges[(name, stage)] = fields[name]
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a") as f:
+                        f.write(json.dumps(event, default=str) + "\n")
+                except OSError as e:
+                    logger.warning(f"Could not write metrics to {self.jsonl_path}: {e}")
+
+    def progress(self, stage: str, block: dict):
+        """ffmpeg の -progress 出力の1ブロックで、実行中の fps / speed を更新する"""
+        values = {
+            "fps": _to_float(block.get("fps")),
+            "speed": parse_speed(block.get("speed")),
+            "out_time_seconds": _to_float(block.get("out_time_us")),
+        }
+        if values["out_time_seconds"] is not None:
+            values["out_time_seconds"] /= 1e6
+        with self._lock:
+            for name, value in values.items():
+                if value is not None:
+                    self._gauges[(f"progress_{name}", stage)] = value
+
+    @contextmanager
+    def stage(self, stage: str, **fields):
+        """
+        with ブロックの実行時間を計測して記録する。
+        ブロック内で返された dict に bytes_in などを追加すると一緒に記録される。
+        """
+        fields = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException:
+            fields["status"] = "error"
+            raise
+        finally:
+            fields.setdefault("status", "ok")
+            fields["seconds"] = time.perf_counter() - start
+            self.record(stage, **fields)
+
+    def _add(self, name: str, stage: str, value: float):
+        key = (name, stage)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self) -> str:
+        """現在の集計値を Prometheus のテキスト形式で返す"""
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    metric = f"{METRIC_PREFIX}_{name}"
+                    lines.append(f"# TYPE {metric} {kind}")
+                    for (key, stage), value in sorted(values.items()):
+                        if key == name:
+                            lines.append(f'{metric}{{stage="{stage}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Prometheus 形式のエンドポイント (/metrics) をバックグラウンドで起動する"""
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {host}:{port}: {e}")
+            return
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _to_float(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_speed(value: str | None) -> float | None:
+    """ffmpeg の speed 表記 (例: " 12.3x") を数値にする"""
+    return _to_float((value or "").strip().rstrip("x"))
+
+
+# 設定されるまでは何も書き出さない (集計だけ行う)
+_recorder = MetricsRecorder()
+
+
+def configure(
+    jsonl_path: str | None = None, prometheus_port: int | None = None
+) -> MetricsRecorder:
+    """プロセス全体で使う記録先を設定する"""
+    global _recorder
+    _recorder.close()
+    _recorder = MetricsRecorder(jsonl_path)
+    if prometheus_port:
+        _recorder.serve(prometheus_port)
+    return _recorder
+
+
+def get_recorder() -> MetricsRecorder:
+    return _recorder
+
+
+def record(stage: str, **fields):
+    _recorder.record(stage, **fields)
+
+
+def progress(stage: str, block: dict):
+    _recorder.progress(stage, block)
+
+
+def stage(stage: str, **fields):
+    return _recorder.stage(stage, **fields)
@@ -0,0 +1,255 @@
+import math
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from loguru import logger
+
+from lib.probe import MAX_PROBE_WORKERS, probe_files
+
+# 動きを調べる単位 (秒)
+WINDOW_SECONDS = 10.0
+# 動きの判定に使う縮小画像の大きさ (グレースケール)
+ANALYSIS_WIDTH = 64
+ANALYSIS_HEIGHT = 36
+# キーフレーム間の平均輝度差 (0〜1) がこれ以下なら静止 (駐車中)、これ以上なら走行中とみなす
+STATIC_MOTION = 0.01
+MOVING_MOTION = 0.04
+# 静止に近い区間を基本の倍率の何倍まで速くするか
+MAX_SPEED_MULTIPLIER = 8
+# select の式が長くなりすぎないよう、区間がこれより多ければまとめる
+MAX_SPANS = 400
+# showinfo フィルタが出力するフレームの時刻
+PTS_TIME_PATTERN = re.compile(rb"pts_time:(-?[0-9.]+)")
+
+
+@dataclass
+class SpeedSpan:
+    """
+    結合したストリームの時刻 start (秒) から次の区間までを、基本の倍率の
+    multiplier 倍で再生する区間。multiplier が 0 の区間は出力しない。
+    """
+
+    start: float
+    multiplier: int
+
+
+def keyframe_motion(input_file: str) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    キーフレームだけを低解像度のグレースケールでデコードし、隣り合うキーフレームの差を返す。
+    露出の変化で誤判定しないよう、各フレームの平均輝度を引いてから比べる。
+    キーフレームの時刻は showinfo が出力するデコード後のタイムスタンプから取る。
+
+    :return: (先頭のキーフレームからの各キーフレームの時刻 (秒), キーフレーム数 - 1 個の差 (0〜1))。
+        デコードできなければ None
+    """
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        # showinfo の出力は info レベル
+        "-loglevel",
+        "info",
+        "-skip_frame",
+        "nokey",
+        "-i",
+        input_file,
+        "-an",
+        "-vf",
+        f"scale={ANALYSIS_WIDTH}:{ANALYSIS_HEIGHT},format=gray,showinfo",
+        # キーフレームの間を複製で埋めない (-fps_mode の旧名で、古い ffmpeg でも使える)
+        "-vsync",
+        "passthrough",
+        "-f",
+        "rawvideo",
+        "pipe:1",
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        logger.warning(f"Could not run ffmpeg to analyse motion of {input_file}: {e}")
+        return None
+    frame_size = ANALYSIS_WIDTH * ANALYSIS_HEIGHT
+    count = len(result.stdout) // frame_size
+    times = [float(t) for t in PTS_TIME_PATTERN.findall(result.stderr)]
+    if result.returncode != 0 or count < 2 or len(times) != count:
+        # info レベルの出力はフレームごとの showinfo の行を除いた最後の行だけを残す
+        lines = [
+            line.strip()
+            for line in result.stderr.decode(errors="replace").splitlines()
+            if "showinfo" not in line
+        ]
+        reason = lines[-1] if result.returncode != 0 and lines else None
+        logger.warning(
+            f"Motion analysis failed for {input_file}: "
+            f"{reason or f'{count} frames, {len(times)} timestamps'}"
+        )
+        return None
+
+    frames = np.frombuffer(result.stdout[: count * frame_size], dtype=np.uint8)
+    frames = frames.reshape(count, frame_size).astype(np.float32) / 255
+    frames -= frames.mean(axis=1, keepdims=True)
+    times = np.array(times)
+    return times - times[0], np.abs(np.diff(frames, axis=0)).mean(axis=1)
+
+
+def window_scores(
+    times: np.ndarray,
+    diffs: np.ndarray,
+    duration: float,
+    window_seconds: float = WINDOW_SECONDS,
+) -> list[float | None]:
+    """
+    キーフレーム間の差を window_seconds ごとの最大値にまとめる。差が無い区間は None。
+
+    :param times: keyframe_motion が返す各キーフレームの時刻 (秒)
+    """
+    windows = max(1, math.ceil(duration / window_seconds))
+    # i 番目の差は i+1 番目のキーフレームの時刻に割り当てる
+    indexes = np.clip((times[1:] // window_seconds).astype(int), 0, windows - 1)
+    scores = [None] * windows
+    for index, diff in zip(indexes, diffs):
+        scores[index] = max(scores[index] or 0.0, float(diff))
+    return scores
+
+
+def speed_multiplier(score: float | None, drop_static: bool = True) -> int:
+    """
+    動きの大きさから倍率を決める。走行中は 1 (基本の倍率)、静止していれば 0 (出力しない)、
+    その間は動きが小さいほど MAX_SPEED_MULTIPLIER に近づける。判定できない区間は 1。
+    """
+    if score is None or score >= MOVING_MOTION:
+        return 1
+    if score <= STATIC_MOTION:
+        return 0 if drop_static else MAX_SPEED_MULTIPLIER
+    ratio = (MOVING_MOTION - score) / (MOVING_MOTION - STATIC_MOTION)
+    return max(1, round(MAX_SPEED_MULTIPLIER**ratio))
+
+
+def _keep_rank(multiplier: int) -> float:
+    # 小さいほど多くのフレームを残す (0 は出力しないので最後)
+    return multiplier or math.inf
+
+
+def _dilate(multipliers: list[int]) -> list[int]:
+    """動きのある区間の前後1区間も同じ倍率にして、出来事の前後を残す"""
+    return [
+        min(multipliers[max(0, i - 1) : i + 2], key=_keep_rank)
+        for i in range(len(multipliers))
+    ]
+
+
+def _merge(spans: list[SpeedSpan]) -> list[SpeedSpan]:
+    merged = []
+    for span in spans:
+        if merged and merged[-1].multiplier == span.multiplier:
+            continue
+        merged.append(span)
+    return merged
+
+
+def _coarsen(spans: list[SpeedSpan], max_spans: int) -> list[SpeedSpan]:
+    """隣り合う区間を2つずつ (多くのフレームを残す方の倍率で) まとめ、max_spans 以下にする"""
+    while len(spans) > max_spans:
+        spans = _merge(
+            [
+                SpeedSpan(
+                    pair[0].start,
+                    min((s.multiplier for s in pair), key=_keep_rank),
+                )
+                for pair in (spans[i : i + 2] for i in range(0, len(spans), 2))
+            ]
+        )
+    return spans
+
+
+def score_files(ts_files: list[str], workers: int | None = None) -> dict:
+    """複数のファイルの動きを並列に調べる。:return: パス -> (キーフレームの時刻, 差) (失敗したものは含まない)"""
+    workers = workers or min(MAX_PROBE_WORKERS, (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(ts_files)))) as pool:
+        return {
+            path: motion
+            for path, motion in zip(ts_files, pool.map(keyframe_motion, ts_files))
+            if motion is not None
+        }
+
+
+def plan_speed_spans(
+    ts_files: list[str],
+    drop_static: bool = True,
+    window_seconds: float = WINDOW_SECONDS,
+) -> tuple[list[str], list[SpeedSpan]] | None:
+    """
+    セグメントごとに動きを調べ、結合したストリームの区間ごとの倍率を決める。
+    全体が静止しているセグメントはストリームに含めない。
+    区間の境界は秒で持つ。各セグメントの長さ (秒) をそのまま足していくので、
+    フレーム数に丸めたときのような誤差が長いカードで積み重ならない。
+
+    :return: (ストリームに流すファイル, 区間の一覧)。長さが分からないファイルがあれば None
+    """
+    infos = probe_files(ts_files)
+    if any(not infos.get(path, {}).get("duration") for path in ts_files):
+        logger.warning("Cannot plan an adaptive speed-up without segment durations")
+        return None
+    motion = score_files(ts_files)
+
+    # (ファイルの番号, ファイル内の開始秒, 倍率) を全セグメント通しで並べてから前後を広げる
+    windows = []
+    for index, path in enumerate(ts_files):
+        duration = infos[path]["duration"]
+        if path in motion:
+            scores = window_scores(*motion[path], duration, window_seconds)
+        else:
+            scores = [None] * max(1, math.ceil(duration / window_seconds))
+        windows += [
+            (index, i * window_seconds, speed_multiplier(score, drop_static))
+            for i, score in enumerate(scores)
+        ]
+    multipliers = _dilate([multiplier for _, _, multiplier in windows])
+    if not any(multipliers):
+        # 一日中駐車していた場合も何も出力しないのではなく、最大の倍率で残す
+        multipliers = [MAX_SPEED_MULTIPLIER] * len(multipliers)
+
+    kept = sorted({index for (index, _, _), m in zip(windows, multipliers) if m})
+    kept_files = [ts_files[index] for index in kept]
+    # 残したファイルがストリームの何秒目から始まるか
+    offsets = {}
+    position = 0.0
+    for index in kept:
+        offsets[index] = position
+        position += infos[ts_files[index]]["duration"]
+    spans = [
+        SpeedSpan(offsets[index] + start, multiplier)
+        for (index, start, _), multiplier in zip(windows, multipliers)
+        if index in offsets
+    ]
+    spans = _coarsen(_merge(spans), MAX_SPANS)
+
+    dropped = len(ts_files) - len(kept_files)
+    logger.info(
+        f"Adaptive speed-up: {len(spans)} spans, "
+        f"{sum(not m for m in multipliers)}/{len(multipliers)} windows and "
+        f"{dropped} whole segments dropped as static"
+    )
+    return kept_files, spans
+
+
+def select_expression(spans: list[SpeedSpan], base_step: int) -> str:
+    """
+    区間ごとに base_step × multiplier フレームに1枚を残す select フィルタの式 (カンマはエスケープ済み)。
+    区間はストリームの先頭を 0 としたフレームの時刻 t で判定するので、select の前で
+    setpts=PTS-STARTPTS により時刻を詰め直しておくこと。区間の終わりは次の区間に含める。
+    どの項にも当てはまらないフレーム (multiplier が 0 の区間) は捨てられる。
+    """
+    terms = []
+    for span, following in zip(spans, spans[1:] + [None]):
+        if not span.multiplier:
+            continue
+        term = f"gte(t\\,{span.start:.3f})"
+        # 最後の区間はセグメントの長さの誤差を吸収するため終わりを決めない
+        if following:
+            term += f"*lt(t\\,{following.start:.3f})"
+        terms.append(f"{term}*not(mod(n\\,{base_step * span.multiplier}))")
+    return "+".join(terms) or "0"
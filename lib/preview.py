@@ -0,0 +1,183 @@
+import glob
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from lib.probe import probe_files
+from model.movie_filename import MovieFilename
+
+# サムネイルを取り出す間隔 (秒)
+PREVIEW_INTERVAL_SECONDS = 10.0
+THUMBNAIL_WIDTH = 160
+# 1枚のスプライト画像に並べるサムネイルの数 (列 × 行)
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+PROXY_WIDTH = 320
+PROXY_ENCODER_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "32"]
+
+
+class PreviewOutputs:
+    """
+    速度変更と同じデコードから作る、出力ファイルごとのプレビュー。
+    previews/<出力名>/ に、縮小したプロキシ動画 (速度変更後)、一定間隔のサムネイルを並べた
+    スプライト画像、サムネイルの位置とソースのセグメント・撮影時刻を対応付ける index.json を書き出す。
+    出力に追記するたびに番号 (piece) を増やして別のファイルにし、索引にまとめる。
+
+    :param preview_dir: プレビューを保存するディレクトリ
+    :param name: 出力名 (例: 20240101_front)
+    :param source_files: このジョブで処理するセグメント (時刻順)
+    :param interval: サムネイルを取り出す間隔 (秒)
+    """
+
+    def __init__(
+        self,
+        preview_dir: str,
+        name: str,
+        source_files: list[str],
+        interval: float = PREVIEW_INTERVAL_SECONDS,
+    ):
+        self.directory = os.path.join(preview_dir, name)
+        self.name = name
+        self.source_files = list(source_files)
+        self.interval = interval
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.index = {"name": name, "pieces": [], "thumbnails": []}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(
+                    f"Ignoring unreadable preview index {self.index_path}: {e}"
+                )
+        self.piece = len(self.index["pieces"])
+
+    @property
+    def proxy_file(self) -> str:
+        return os.path.join(self.directory, f"proxy_{self.piece:03d}.mp4")
+
+    @property
+    def sprite_pattern(self) -> str:
+        return os.path.join(self.directory, f"thumbs_{self.piece:03d}_%03d.jpg")
+
+    def thumbnail_filter(self) -> str:
+        """デコードした映像 (速度変更前) からスプライト画像を作るフィルタ"""
+        return (
+            f"fps=1/{self.interval:g},scale={THUMBNAIL_WIDTH}:-2,"
+            f"tile={SPRITE_COLUMNS}x{SPRITE_ROWS}"
+        )
+
+    @staticmethod
+    def proxy_filter() -> str:
+        """速度変更後の映像からプロキシ動画を作るフィルタ"""
+        return f"scale={PROXY_WIDTH}:-2"
+
+    def output_args(self, proxy_label: str, sprite_label: str) -> list:
+        """メインの出力ファイルの後ろに置く、プロキシとスプライトの出力"""
+        os.makedirs(self.directory, exist_ok=True)
+        # 前回失敗したときに同じ番号で書かれたスプライトが残らないようにする
+        for stale in glob.glob(self.sprite_pattern.replace("%03d", "*")):
+            os.remove(stale)
+        return (
+            ["-map", proxy_label]
+            + PROXY_ENCODER_ARGS
+            + ["-an", self.proxy_file]
+            + ["-map", sprite_label, "-q:v", "5"]
+            + ["-f", "image2", self.sprite_pattern]
+        )
+
+    def write_index(self, streamed_files: list[str] | None = None):
+        """
+        ffmpeg が終わった後に、このピースのサムネイルを索引に加えて保存する。
+        サムネイル k はストリームの先頭から k × interval 秒の位置なので、
+        セグメントの長さを積み上げてセグメントとその中の位置を求め、
+        撮影時刻はファイル名 (MovieFilename) の開始時刻に足して求める。
+
+        :param streamed_files: ffmpeg に流したセグメント (省略時は source_files)
+        """
+        streamed_files = streamed_files or self.source_files
+        infos = probe_files(streamed_files)
+        sprites = sorted(glob.glob(self.sprite_pattern.replace("%03d", "*")))
+        per_sprite = SPRITE_COLUMNS * SPRITE_ROWS
+        total = sum((infos.get(f) or {}).get("duration") or 0 for f in streamed_files)
+        count = min(math.ceil(total / self.interval), len(sprites) * per_sprite)
+
+        first = infos.get(streamed_files[0]) or {}
+        height = None
+        if first.get("width") and first.get("height"):
+            # scale=<幅>:-2 と同じく偶数に丸める
+            height = 2 * round(THUMBNAIL_WIDTH * first["height"] / first["width"] / 2)
+
+        thumbnails = []
+        segment_index = 0
+        segment_start = 0.0
+        for k in range(count):
+            position = k * self.interval
+            # position を含むセグメントまで進める
+            while segment_index < len(streamed_files) - 1:
+                duration = (infos.get(streamed_files[segment_index]) or {}).get(
+                    "duration"
+                ) or 0
+                if position < segment_start + duration:
+                    break
+                segment_start += duration
+                segment_index += 1
+            segment = streamed_files[segment_index]
+            offset = position - segment_start
+            cell = k % per_sprite
+            thumbnails.append(
+                {
+                    "sprite": os.path.basename(sprites[k // per_sprite]),
+                    "x": (cell % SPRITE_COLUMNS) * THUMBNAIL_WIDTH,
+                    "y": (cell // SPRITE_COLUMNS) * height if height else None,
+                    "segment": os.path.basename(segment),
+                    "offset": round(offset, 3),
+                    "time": _recorded_at(segment, offset),
+                }
+            )
+
+        # 同じセグメントを処理し直した場合は古いサムネイルを置き換える
+        names = {os.path.basename(f) for f in streamed_files}
+        self.index["thumbnails"] = [
+            thumb for thumb in self.index["thumbnails"] if thumb["segment"] not in names
+        ] + thumbnails
+        self.index["pieces"].append(
+            {
+                "proxy": os.path.basename(self.proxy_file),
+                "sprites": [os.path.basename(s) for s in sprites],
+                "segments": sorted(names),
+            }
+        )
+        self.index.update(
+            {
+                "interval": self.interval,
+                "thumbnail_size": [THUMBNAIL_WIDTH, height],
+                "columns": SPRITE_COLUMNS,
+                "rows": SPRITE_ROWS,
+            }
+        )
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.index, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            # プレビューが書けなくても本体の出力は成功として扱う
+            logger.error(f"Could not write preview index {self.index_path}: {e}")
+            return
+        logger.info(
+            f"Wrote {len(thumbnails)} thumbnails and {self.proxy_file} to {self.directory}"
+        )
+
+
+def _recorded_at(segment: str, offset: float) -> str | None:
+    """セグメントのファイル名の開始時刻に offset 秒を足した撮影時刻 (ISO 8601)"""
+    try:
+        movie = MovieFilename(segment)
+        start = datetime.strptime(movie.date + movie.time, "%Y%m%d%H%M%S")
+    except (MovieFilename.MovieFilenameError, ValueError):
+        return None
+    return (start + timedelta(seconds=offset)).isoformat(timespec="seconds")
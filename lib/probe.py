@@ -0,0 +1,239 @@
+import json
+import os
+import subprocess
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+# キャッシュの形式を変えたら上げる (古いエントリは probe し直す)
+PROBE_SCHEMA_VERSION = 2
+DEFAULT_CACHE_PATH = ".cache/probe_cache.json"
+# GOP 推定のために読むビデオパケット数の既定値
+KEYFRAME_PROBE_PACKETS = 600
+MAX_PROBE_WORKERS = 8
+
+
+class ProbeCache:
+    """
+    ffprobe の結果をJSONファイルに保存するキャッシュ。
+    ファイルはパス・サイズ・更新時刻で識別し、変更されたファイルは再度 probe する。
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable probe cache {cache_path}: {e}")
+
+    @staticmethod
+    def _identity(path: str) -> tuple[str, dict]:
+        stat = os.stat(path)
+        return os.path.abspath(path), {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "version": PROBE_SCHEMA_VERSION,
+        }
+
+    def get(self, path: str) -> dict | None:
+        key, identity = self._identity(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.get("identity") != identity:
+            return None
+        return entry["info"]
+
+    def put(self, path: str, info: dict):
+        key, identity = self._identity(path)
+        with self._lock:
+            self._entries[key] = {"identity": identity, "info": info}
+            self._dirty = True
+
+    def save(self):
+        """変更があればキャッシュを書き出す。削除済みのファイルのエントリは捨てる"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if os.path.exists(key)
+            }
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache() -> ProbeCache:
+    """プロセス内で共有するキャッシュを返す。未設定なら DEFAULT_CACHE_PATH を使う"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ProbeCache(DEFAULT_CACHE_PATH)
+        return _shared_cache
+
+
+def use_shared_cache(cache_path: str) -> ProbeCache:
+    """
+    共有キャッシュの保存先を切り替える。
+    monitor_device はこれで出力ディレクトリのキャッシュを ts_convertor や lib.render と共有する。
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None or _shared_cache.cache_path != cache_path:
+            if _shared_cache is not None:
+                _shared_cache.save()
+            _shared_cache = ProbeCache(cache_path)
+        return _shared_cache
+
+
+def _parse_rate(rate: str | None) -> float | None:
+    try:
+        num, _, den = (rate or "").partition("/")
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value or None
+
+
+def _estimate_gop(keyframe_indexes: list[int]) -> int | None:
+    intervals = [b - a for a, b in zip(keyframe_indexes, keyframe_indexes[1:])]
+    if not intervals:
+        return None
+    return Counter(intervals).most_common(1)[0][0]
+
+
+def _run_ffprobe(path: str, keyframe_packets: int | None = 0) -> dict | None:
+    """
+    1回の ffprobe でコンテナとビデオストリームの情報を取得する。
+
+    :param keyframe_packets: キーフレームを探すパケット数。0 なら読まない、None ならファイル全体
+    """
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0"]
+    entries = "format=duration:stream=codec_name,width,height,avg_frame_rate"
+    if keyframe_packets != 0:
+        entries += ":packet=pts_time,flags"
+        if keyframe_packets is not None:
+            command += ["-read_intervals", f"%+#{keyframe_packets}"]
+    command += ["-show_entries", entries, "-of", "json", path]
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+    except Exception as e:
+        logger.warning(f"Could not run ffprobe for {path}: {e}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"ffprobe failed for {path}: {result.stderr.strip()}")
+        return None
+
+    try:
+        data = json.loads(result.stdout or "{}")
+    except ValueError as e:
+        logger.warning(f"Unreadable ffprobe output for {path}: {e}")
+        return None
+    duration = data.get("format", {}).get("duration")
+    stream = next(iter(data.get("streams") or []), {})
+    info = {
+        "duration": _parse_rate(duration),
+        "codec": stream.get("codec_name"),
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "fps": _parse_rate(stream.get("avg_frame_rate")),
+    }
+    if keyframe_packets != 0:
+        packets = data.get("packets") or []
+        keyframe_indexes = [
+            i for i, packet in enumerate(packets) if packet.get("flags", "")[:1] == "K"
+        ]
+        info["gop"] = _estimate_gop(keyframe_indexes)
+        info["keyframes"] = [
+            float(packets[i]["pts_time"])
+            for i in keyframe_indexes
+            if packets[i].get("pts_time") not in (None, "N/A")
+        ]
+        info["keyframe_packets"] = keyframe_packets
+    return info
+
+
+def _covers(info: dict, keyframe_packets: int | None) -> bool:
+    """キャッシュ済みの情報が要求されたキーフレーム範囲を含むか"""
+    if keyframe_packets == 0:
+        return True
+    if "keyframe_packets" not in info:
+        return False
+    cached = info["keyframe_packets"]
+    return cached is None or (
+        keyframe_packets is not None and cached >= keyframe_packets
+    )
+
+
+def probe_files(
+    paths: list[str],
+    cache: ProbeCache | None = None,
+    keyframe_packets: int | None = 0,
+    workers: int | None = None,
+) -> dict[str, dict]:
+    """
+    複数のファイルを並列に probe する。キャッシュにあるものは ffprobe を起動しない。
+
+    :param cache: 結果のキャッシュ。None なら共有キャッシュを使う
+    :param keyframe_packets: キーフレーム位置と GOP を調べるパケット数 (0: 調べない, None: 全体)
+    :param workers: 同時に起動する ffprobe の数
+    :return: パス -> {"duration", "codec", "width", "height", "fps"[, "gop", "keyframes"]}。
+             probe に失敗したファイルは含まない
+    """
+    cache = cache or shared_cache()
+    results = {}
+    missing = []
+    for path in paths:
+        try:
+            info = cache.get(path)
+        except OSError as e:
+            logger.warning(f"Cannot probe {path}: {e}")
+            continue
+        if info is not None and _covers(info, keyframe_packets):
+            results[path] = info
+        else:
+            missing.append(path)
+
+    if missing:
+        # ffprobe は子プロセスなのでスレッドで十分に並列化できる
+        workers = workers or min(MAX_PROBE_WORKERS, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            probed = executor.map(
+                lambda path: _run_ffprobe(path, keyframe_packets), missing
+            )
+            for path, info in zip(missing, probed):
+                if info is None:
+                    continue
+                cache.put(path, info)
+                results[path] = info
+        logger.debug(
+            f"Probed {len(missing)} files ({len(paths) - len(missing)} cached)"
+        )
+        cache.save()
+    return results
+
+
+def probe_media(
+    path: str, cache: ProbeCache | None = None, keyframe_packets: int | None = 0
+) -> dict | None:
+    """1つのファイルを probe する。失敗した場合は None を返す"""
+    return probe_files([path], cache, keyframe_packets).get(path)
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+try:
+    from zoneinfo import ZoneInfo
+
+    # YouTube Data API のクォータは太平洋時間の0時にリセットされる
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except Exception:  # pragma: no cover - tzdata が無い環境では標準時で近似する
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+# YouTube Data API の1日あたりの既定のクォータ
+DEFAULT_DAILY_BUDGET = 10000
+# videos.insert 1回の消費ユニット数
+UPLOAD_QUOTA_COST = 1600
+
+
+class QuotaTracker:
+    """
+    YouTube Data API のクォータの消費量を日ごとに記録し、残りを見積もる。
+    状態は JSON ファイルに保存するため、再起動しても同じ日の消費量を引き継ぐ。
+    アップロードを始める前に reserve で予約し、API が videos.insert を受け付けたら commit、
+    受け付けられる前に失敗したら release する。予約中の分も残りから差し引く。
+
+    :param state_path: 状態を保存するファイル
+    :param daily_budget: 1日に使ってよいユニット数
+    """
+
+    def __init__(
+        self,
+        state_path: str = "quota_state.json",
+        daily_budget: int = DEFAULT_DAILY_BUDGET,
+    ):
+        self.state_path = state_path
+        self.daily_budget = daily_budget
+        self._lock = threading.Lock()
+        self._state = {"day": None, "spent": 0}
+        # 予約済みでまだ消費が確定していないユニット数 (保存しない)
+        self._reserved = 0
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable quota state {state_path}: {e}")
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    def _current(self) -> dict:
+        # 日付が変わっていれば消費量をリセットする (ロックを取った状態で呼ぶ)
+        if self._state.get("day") != self._today():
+            self._state = {"day": self._today(), "spent": 0}
+        return self._state
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def remaining(self) -> int:
+        with self._lock:
+            return max(0, self.daily_budget - self._current()["spent"] - self._reserved)
+
+    def reserve(self, units: int) -> bool:
+        """残りが units 以上あれば予約して True を返す"""
+        with self._lock:
+            if self._current()["spent"] + self._reserved + units > self.daily_budget:
+                return False
+            self._reserved += units
+            return True
+
+    def commit(self, units: int):
+        """予約した units の消費を確定して保存する"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - units)
+            self._current()["spent"] += units
+            self._save()
+
+    def release(self, units: int):
+        """予約した units を使わずに返す"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - units)
+
+    def exhaust(self):
+        """API からクォータ超過を返されたとき、今日の残りを0にする"""
+        with self._lock:
+            self._current()["spent"] = max(self._state["spent"], self.daily_budget)
+            self._save()
+
+    @staticmethod
+    def seconds_until_reset() -> float:
+        now = datetime.now(QUOTA_TIMEZONE)
+        tomorrow = datetime.combine(
+            now.date() + timedelta(days=1), datetime.min.time(), tzinfo=QUOTA_TIMEZONE
+        )
+        return max(0.0, (tomorrow - now).total_seconds())
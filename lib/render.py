@@ -1,7 +1,131 @@
 from typing import List
 import ffmpeg
+from loguru import logger
 
 from lib.log import time_elapsed
+from lib.probe import probe_media
+
+
+class RenderGraph:
+    """
+    concat → setpts → crop/scale を1つの ffmpeg フィルタグラフにまとめる。
+    出力を複数追加すると split で分岐し、1回のデコードで全ての出力をエンコードする。
+
+    例:
+        RenderGraph(input_files).speed_up(10).add_output("timelapse.mp4").add_output(
+            "zoomed.mp4", zoom_factor=0.84
+        ).run()
+    """
+
+    def __init__(self, input_files: List[str]):
+        if not input_files:
+            raise ValueError("RenderGraph needs at least one input file")
+        self.input_files = list(input_files)
+        self.speed_factor = None
+        self.outputs = []
+
+    def speed_up(self, speed_factor: float) -> "RenderGraph":
+        """結合後の映像を speed_factor 倍速にする"""
+        self.speed_factor = speed_factor
+        return self
+
+    def add_output(
+        self,
+        output_file: str,
+        zoom_factor: float | None = None,
+        center: bool = True,
+        width: int | None = None,
+        height: int | None = None,
+        **output_kwargs,
+    ) -> "RenderGraph":
+        """
+        出力を追加する。
+        zoom_factor: 指定した場合、その割合 (0.0 ~ 1.0) で切り抜く
+        center: True の場合、中央を切り抜く (False なら左上)
+        width, height: 指定した場合、その解像度に縮小する (-2 でアスペクト比を維持)
+        output_kwargs: ffmpeg.output に渡すエンコードオプション (例: vcodec="libx264")
+        """
+        self.outputs.append(
+            {
+                "output_file": output_file,
+                "zoom_factor": zoom_factor,
+                "center": center,
+                "width": width,
+                "height": height,
+                "kwargs": output_kwargs,
+            }
+        )
+        return self
+
+    def _crop_box(self, zoom_factor: float, center: bool) -> tuple | None:
+        # 結合する動画は同じ解像度なので、先頭のファイルの解像度を使う
+        video_info = probe_media(self.input_files[0])
+        if not video_info or not video_info.get("width"):
+            logger.error(f"Could not read the resolution of {self.input_files[0]}")
+            return None
+        width = video_info["width"]
+        height = video_info["height"]
+
+        new_width = int(width * zoom_factor)
+        new_height = int(height * zoom_factor)
+        x = (width - new_width) // 2 if center else 0
+        y = (height - new_height) // 2 if center else 0
+        return x, y, new_width, new_height
+
+    def build(self):
+        """フィルタグラフを組み立てる。失敗した場合は None を返す"""
+        if not self.outputs:
+            logger.error("RenderGraph has no outputs")
+            return None
+
+        inputs = [ffmpeg.input(file).video for file in self.input_files]
+        stream = inputs[0] if len(inputs) == 1 else ffmpeg.concat(*inputs, v=1, a=0)
+        if self.speed_factor:
+            stream = stream.filter("setpts", f"PTS/{self.speed_factor}")
+
+        # 出力ごとにデコード結果を分岐させる
+        if len(self.outputs) == 1:
+            branches = [stream]
+        else:
+            split = stream.filter_multi_output("split", len(self.outputs))
+            branches = [split.stream(i) for i in range(len(self.outputs))]
+
+        nodes = []
+        for branch, output in zip(branches, self.outputs):
+            if output["zoom_factor"] is not None:
+                box = self._crop_box(output["zoom_factor"], output["center"])
+                if box is None:
+                    return None
+                x, y, new_width, new_height = box
+                branch = ffmpeg.crop(branch, x, y, new_width, new_height)
+            if output["width"] or output["height"]:
+                branch = branch.filter(
+                    "scale", output["width"] or -2, output["height"] or -2
+                )
+            nodes.append(
+                ffmpeg.output(branch, output["output_file"], **output["kwargs"])
+            )
+        return ffmpeg.merge_outputs(*nodes)
+
+    def compile(self) -> list[str] | None:
+        """実行される ffmpeg コマンドを返す"""
+        graph = self.build()
+        return graph.overwrite_output().compile() if graph is not None else None
+
+    def run(self):
+        """
+        グラフを1回の ffmpeg で実行する。
+        グラフを組み立てられない場合や ffmpeg が失敗した場合は ffmpeg.Error を送出する
+        (ffmpeg.output(...).run と同じ)。
+        """
+        graph = self.build()
+        if graph is None:
+            raise ffmpeg.Error("ffmpeg", b"", b"Could not build the render graph")
+        try:
+            graph.run(overwrite_output=True, quiet=True)
+        except ffmpeg.Error as e:
+            logger.error(f"Render failed: {e.stderr.decode(errors='replace')}")
+            raise
 
 
 @time_elapsed
@@ -9,10 +133,7 @@ def combine_videos(input_files: List[str], output_file: str):
     """
     複数の動画ファイルを結合する。
     """
-    inputs = [ffmpeg.input(file) for file in input_files]
-    combined = ffmpeg.concat(*inputs)
-
-    ffmpeg.output(combined, output_file).run(overwrite_output=True, quiet=True)
+    RenderGraph(input_files).add_output(output_file).run()
 
 
 @time_elapsed
@@ -24,22 +145,9 @@ def render_zoomed_video(
     zoom_factor: ズームする割合 (0.0 ~ 1.0)
     center: True の場合、中央にズームする
     """
-    probe = ffmpeg.probe(input_file)
-    video_info = next(
-        stream for stream in probe["streams"] if stream["codec_type"] == "video"
-    )
-    width = video_info["width"]
-    height = video_info["height"]
-
-    new_width = int(width * zoom_factor)
-    new_height = int(height * zoom_factor)
-    x = (width - new_width) // 2 if center else 0
-    y = (height - new_height) // 2 if center else 0
-
-    stream = ffmpeg.input(input_file)
-    stream = ffmpeg.crop(stream, x, y, new_width, new_height)
-
-    ffmpeg.output(stream, output_file).run(overwrite_output=True, quiet=True)
+    RenderGraph([input_file]).add_output(
+        output_file, zoom_factor=zoom_factor, center=center
+    ).run()
 
 
 @time_elapsed
@@ -47,10 +155,7 @@ def speed_up_video(input_file: str, output_file: str, speed_factor: float = 10):
     """
     動画の速度を指定の倍率で上げる。
     """
-    stream = ffmpeg.input(input_file)
-    accelerated = ffmpeg.filter(stream, "setpts", f"PTS/{speed_factor}")
-
-    ffmpeg.output(accelerated, output_file).run(overwrite_output=True, quiet=True)
+    RenderGraph([input_file]).speed_up(speed_factor).add_output(output_file).run()
 
 
 # if __name__ == "__main__":
@@ -64,10 +169,7 @@ def speed_up_video(input_file: str, output_file: str, speed_factor: float = 10):
 #         "sample/20221002_195343_0.ts",
 #     ]
 #
-#     output_file = "output.mp4"
-#
-#     combine_videos(input_files, output_file)
-#     speed_up_video(output_file, "output_sppedup.mp4", 10)
-#     render_zoomed_video(
-#         "output_sppedup.mp4", "output_zoomed.mp4", zoom_factor=0.84, center=True
-#     )
+#     # 結合・速度変更・ズームを1回のデコードで行い、2つの動画を出力する
+#     RenderGraph(input_files).speed_up(10).add_output("output_sppedup.mp4").add_output(
+#         "output_zoomed.mp4", zoom_factor=0.84, center=True
+#     ).run()
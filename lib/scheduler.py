@@ -0,0 +1,178 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable
+
+from loguru import logger
+
+from lib import metrics
+
+
+class JobScheduler:
+    """
+    独立したジョブをスレッドプールで並列に実行する。
+    実際の処理はffmpegの子プロセスで行うため、GILの影響はほぼない。
+
+    max_workers: 同時実行数の上限 (CPU数を超えない)
+    io_slots: SDカードから同時に読み出す数の上限 (エンコードの並列数は max_workers で決まる)
+    disk_path: 出力先のディスク。指定した場合、必要な空き容量があるジョブだけを開始する
+    reserve_bytes: ジョブに割り当てずに常に残しておく空き容量
+    space_timeout: 空き容量を待つ最大秒数 (None なら無期限、0 なら待たない)。超えたジョブは実行しない
+    poll_interval: 空き容量を再確認する間隔 (秒)。アップロードなど外部で空く場合に備える
+    on_interrupt: run が中断された (Ctrl-C など) ときに、実行中のジョブを止めるために呼ぶ関数
+    on_start: run の開始時に呼ぶ関数。前の run の on_interrupt で止めたものを元に戻す
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        io_slots: int = 2,
+        disk_path: str | None = None,
+        reserve_bytes: int = 0,
+        space_timeout: float | None = None,
+        poll_interval: float = 30.0,
+        on_interrupt: Callable[[], None] | None = None,
+        on_start: Callable[[], None] | None = None,
+    ):
+        cpu_count = os.cpu_count() or 1
+        self.max_workers = max(1, min(max_workers or cpu_count, cpu_count))
+        self._io_semaphore = threading.BoundedSemaphore(max(1, io_slots))
+        self.disk_path = disk_path
+        self.reserve_bytes = reserve_bytes
+        self.space_timeout = space_timeout
+        self.poll_interval = poll_interval
+        self.on_interrupt = on_interrupt
+        self.on_start = on_start
+        # 実行中のジョブが予約している容量 (まだ書き込まれていない分も含めて多めに見積もる)
+        self._reserved_bytes = 0
+
+    @contextmanager
+    def io_slot(self):
+        """
+        ソースディスクからの1回の読み出しを囲み、同時読み出し数を制限する。
+        ffmpeg へのストリーミングでは読み出し (チャンク) ごとに取るため、エンコード中は保持しない。
+        待ち時間は呼び出し側 (ts_convertor) がまとめて io_wait として記録する。
+        """
+        with self._io_semaphore:
+            yield
+
+    def _available_bytes(self) -> int:
+        free = shutil.disk_usage(self.disk_path).free
+        return free - self._reserved_bytes - self.reserve_bytes
+
+    def _fits(self, required_bytes: int) -> bool:
+        if not self.disk_path or not required_bytes:
+            return True
+        return required_bytes <= self._available_bytes()
+
+    def run(
+        self, jobs: list, func: Callable, size_of: Callable | None = None
+    ) -> list[tuple]:
+        """
+        jobs の各要素に func(job) を並列に適用する。
+        例外はジョブ単位でログに記録し、他のジョブは継続する。
+        size_of を指定した場合、size_of(job) バイトの空きが出力ディスクにあるジョブだけを
+        ワーカーに渡す。空き容量の判定はワーカーを取る前に行うため、容量を待つ大きなジョブが
+        ワーカーを塞ぐことはなく、後ろの収まるジョブが先に始まる。
+        容量を待つ時間は run の開始から数え、space_timeout を過ぎたジョブは実行しない (0 なら待たない)。
+        KeyboardInterrupt などで中断された場合は、まだ始まっていないジョブを取り消し、
+        on_interrupt で実行中のジョブを止めてから、終了を待たずに例外を送出する。
+
+        :return: (job, result) のリスト。失敗した（または空き容量が足りなかった）ジョブの result は None
+        """
+        if not jobs:
+            return []
+        if self.on_start is not None:
+            self.on_start()
+
+        workers = min(self.max_workers, len(jobs))
+        logger.info(f"Running {len(jobs)} jobs with {workers} workers")
+
+        results = []
+        submitted = time.perf_counter()
+        pending = [(job, size_of(job) if size_of else 0) for job in jobs]
+        running = {}
+        logged_waits = set()
+        # with 文を使うと、中断されても __exit__ がキューに残った全ジョブの終了を待ってしまう
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        try:
+            while pending or running:
+                waiting = []
+                for job, required_bytes in pending:
+                    name = getattr(job, "name", str(job))
+                    waited = time.perf_counter() - submitted
+                    if len(running) >= workers:
+                        waiting.append((job, required_bytes))
+                    elif self._fits(required_bytes):
+                        self._reserved_bytes += required_bytes
+                        if required_bytes and self.disk_path:
+                            metrics.record("space_wait", job=name, seconds=waited)
+                        future = executor.submit(
+                            self._timed, func, job, submitted, required_bytes
+                        )
+                        running[future] = (job, required_bytes)
+                    elif (
+                        self.space_timeout is not None and waited >= self.space_timeout
+                    ):
+                        logger.error(
+                            f"Job {name} needs {required_bytes / 1e9:.1f} GB but only "
+                            f"{max(self._available_bytes(), 0) / 1e9:.1f} GB is available "
+                            f"after waiting {waited:.0f}s; skipping it."
+                        )
+                        results.append((job, None))
+                    else:
+                        if name not in logged_waits:
+                            logger.info(
+                                f"Job {name} is waiting for {required_bytes / 1e9:.1f} GB of free space"
+                            )
+                            logged_waits.add(name)
+                        waiting.append((job, required_bytes))
+                pending = waiting
+                # 容量を待つジョブがあれば、ジョブの終了を待つ間も poll_interval ごとに再確認する
+                waiting_for_space = bool(pending) and len(running) < workers
+                if not running:
+                    # 外部 (アップロードなど) で空くのを待って再確認する
+                    time.sleep(self._space_poll_timeout(submitted))
+                    continue
+
+                timeout = None
+                if waiting_for_space:
+                    timeout = self._space_poll_timeout(submitted)
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, required_bytes = running.pop(future)
+                    self._reserved_bytes -= required_bytes
+                    try:
+                        results.append((job, future.result()))
+                    except Exception as e:
+                        logger.exception(f"Job {getattr(job, 'name', job)} failed: {e}")
+                        results.append((job, None))
+        except BaseException:
+            logger.warning("Interrupted; cancelling queued and running jobs.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self.on_interrupt is not None:
+                self.on_interrupt()
+            raise
+        executor.shutdown()
+        return results
+
+    def _space_poll_timeout(self, submitted: float) -> float:
+        """容量を待つジョブを次に再確認するまでの秒数 (space_timeout を過ぎたらすぐ)"""
+        timeout = self.poll_interval
+        if self.space_timeout is not None:
+            remaining = self.space_timeout - (time.perf_counter() - submitted)
+            timeout = min(timeout, remaining)
+        return max(timeout, 0)
+
+    def _timed(self, func: Callable, job, submitted: float, required_bytes: int = 0):
+        """ジョブの待ち時間 (キューに入ってから開始まで) と実行時間を記録する"""
+        name = getattr(job, "name", str(job))
+        metrics.record("queue_wait", job=name, seconds=time.perf_counter() - submitted)
+        with metrics.stage("job", job=name, reserved_bytes=required_bytes) as fields:
+            result = func(job)
+            if result is False:
+                fields["status"] = "error"
+        return result
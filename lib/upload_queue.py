@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from googleapiclient.errors import HttpError
+from loguru import logger
+
+from lib.quota import UPLOAD_QUOTA_COST, QuotaTracker
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - watchdogが無い環境ではポーリングのみ
+    FileSystemEventHandler = object
+    Observer = None
+
+UPLOAD_ORDERS = ("oldest", "smallest")
+# 失敗したファイルを再試行するまでの待ち時間 (秒)。失敗するたびに倍にする
+BACKOFF_BASE_SECONDS = 60.0
+BACKOFF_MAX_SECONDS = 3600.0
+# この理由の 403 は1日のクォータを使い切ったことを表す
+QUOTA_EXCEEDED_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded")
+
+
+class _OutputEventHandler(FileSystemEventHandler):
+    """出力ディレクトリで .ts ファイルが作成・置換されたら通知する"""
+
+    def __init__(self, changed: threading.Event):
+        self.changed = changed
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        if any(os.fsdecode(p).endswith(".ts") for p in paths if p):
+            self.changed.set()
+
+
+def http_error_reason(error: HttpError) -> str | None:
+    """HttpError の本文から最初のエラー理由 (例: quotaExceeded) を取り出す"""
+    try:
+        content = json.loads(error.content.decode(errors="replace"))
+        return content["error"]["errors"][0]["reason"]
+    except (AttributeError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+class UploadQueue:
+    """
+    出力ディレクトリを監視し、確定した出力ファイルをすぐにアップロードするキュー。
+
+    ファイルは os.replace で確定されるので、一覧に現れたファイルは完成している。
+    ただし同じ日の出力に追記されることがあるため、min_age_seconds の間更新されていない
+    ファイルだけを対象にする。
+    アップロードを始める前にクォータを予約し、1日の予算を超える場合は太平洋時間の
+    0時 (クォータのリセット) まで待つ。予約は API が videos.insert を受け付けた時点で確定し、
+    その前に失敗した場合 (通信エラーなど) や重複としてアップロードしなかった場合は返す。
+    403/429/5xx で失敗したファイルは指数バックオフで再試行し、
+    API がクォータ超過を返した場合はリセットまで全体を止める。
+
+    :param watch_dir: 監視するディレクトリ
+    :param list_files: アップロード対象のファイル一覧を返す関数
+    :param upload: 1ファイルをアップロードする関数。ファイルと、videos.insert が受け付けられたときに
+        呼ぶ関数 (クォータの確定) を受け取り、失敗したら例外を送出する
+    :param quota: クォータの消費量を記録するトラッカー
+    :param cost_of: ファイルのアップロードに必要なユニット数を返す関数 (監視スレッドで呼ぶので軽い処理にする)
+    :param workers: 同時にアップロードするファイル数
+    :param order: "oldest" (更新時刻が古い順) または "smallest" (サイズが小さい順)
+    :param resume_first: True を返したファイル (中断したアップロードなど) を order より先にアップロードする
+    :param poll_interval: イベントが無くても一覧を確認する間隔 (秒)
+    :param min_age_seconds: 最後の更新からこの秒数が経ったファイルだけをアップロードする
+    :param use_polling: True の場合、inotify を使わずポーリングする
+    """
+
+    def __init__(
+        self,
+        watch_dir: str,
+        list_files: Callable[[], list[str]],
+        upload: Callable[[str, Callable[[], None]], None],
+        quota: QuotaTracker,
+        cost_of: Callable[[str], int] = lambda video_file: UPLOAD_QUOTA_COST,
+        workers: int = 1,
+        order: str = "oldest",
+        poll_interval: float = 60.0,
+        min_age_seconds: float = 60.0,
+        use_polling: bool = False,
+        resume_first: Callable[[str], bool] = lambda video_file: False,
+    ):
+        if order not in UPLOAD_ORDERS:
+            raise ValueError(f"Unknown upload order: {order}")
+        self.watch_dir = watch_dir
+        self.list_files = list_files
+        self.upload = upload
+        self.quota = quota
+        self.cost_of = cost_of
+        self.workers = max(1, workers)
+        self.order = order
+        self.resume_first = resume_first
+        self.poll_interval = poll_interval
+        self.min_age_seconds = min_age_seconds
+        self.use_polling = use_polling or Observer is None
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        # ファイル -> (失敗回数, 次に試せる時刻)
+        self._backoff = {}
+        # クォータ超過で止めている場合の再開時刻
+        self._paused_until = 0.0
+
+    def notify(self):
+        """新しい出力ができたことを知らせる (取り込み処理から直接渡す場合に使う)"""
+        self._changed.set()
+
+    def _start_observer(self):
+        if self.use_polling:
+            return None
+        try:
+            observer = Observer()
+            observer.schedule(
+                _OutputEventHandler(self._changed), self.watch_dir, recursive=False
+            )
+            observer.start()
+            return observer
+        except Exception as e:
+            logger.warning(f"Falling back to polling: cannot watch with inotify ({e})")
+            self.use_polling = True
+            return None
+
+    def _sort_key(self, video_file: str):
+        stat = os.stat(video_file)
+        first = not self.resume_first(video_file)
+        if self.order == "smallest":
+            return first, stat.st_size, stat.st_mtime
+        return first, stat.st_mtime, stat.st_size
+
+    def _ready_files(self, now: float) -> tuple[list[str], float | None]:
+        """
+        今アップロードできるファイルを優先順に返す。
+        :return: (ファイル一覧, まだ対象にならないファイルが対象になるまでの最短秒数)
+        """
+        ready = []
+        wait = None
+        for video_file in self.list_files():
+            with self._lock:
+                if video_file in self._in_flight:
+                    continue
+                _, retry_at = self._backoff.get(video_file, (0, 0.0))
+            try:
+                age = time.time() - os.path.getmtime(video_file)
+            except OSError:
+                continue
+            delay = max(retry_at - now, self.min_age_seconds - age)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            ready.append(video_file)
+        keyed = []
+        for video_file in ready:
+            try:
+                keyed.append((self._sort_key(video_file), video_file))
+            except OSError:
+                continue
+        return [video_file for _, video_file in sorted(keyed)], wait
+
+    def _dispatch(self, executor: ThreadPoolExecutor) -> float:
+        """
+        空いているワーカーにファイルを割り当てる。
+        :return: 次に一覧を確認するまでの秒数
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        files, wait = self._ready_files(now)
+        for video_file in files:
+            with self._lock:
+                if len(self._in_flight) >= self.workers:
+                    break
+            cost = self.cost_of(video_file)
+            if not self.quota.reserve(cost):
+                with self._lock:
+                    busy = bool(self._in_flight)
+                if busy:
+                    # 実行中のアップロードの予約が返されれば足りるかもしれないので、終わるのを待つ
+                    break
+                self._pause(
+                    f"Daily quota budget reached ({self.quota.remaining()} units left, "
+                    f"{cost} needed)"
+                )
+                return self._paused_until - now
+            with self._lock:
+                self._in_flight.add(video_file)
+            logger.info(
+                f"Queued {video_file} for upload "
+                f"({cost} units, {self.quota.remaining()} left today)"
+            )
+            executor.submit(self._upload_one, video_file, cost)
+        return min(self.poll_interval, wait) if wait is not None else self.poll_interval
+
+    def _pause(self, reason: str):
+        seconds = self.quota.seconds_until_reset()
+        self._paused_until = time.monotonic() + seconds
+        logger.warning(f"{reason}; pausing uploads for {seconds / 3600:.1f} hours")
+
+    def _upload_one(self, video_file: str, cost: int):
+        committed = False
+
+        def commit_quota():
+            nonlocal committed
+            if not committed:
+                committed = True
+                self.quota.commit(cost)
+
+        try:
+            self.upload(video_file, commit_quota)
+        except HttpError as e:
+            status = e.resp.status
+            reason = http_error_reason(e)
+            if status == 403 and reason in QUOTA_EXCEEDED_REASONS:
+                self.quota.exhaust()
+                self._pause(f"YouTube rejected {video_file} with {reason}")
+            else:
+                self._retry_later(video_file, f"HTTP {status} ({reason})")
+        except Exception as e:
+            self._retry_later(video_file, str(e))
+        else:
+            with self._lock:
+                self._backoff.pop(video_file, None)
+        finally:
+            if not committed:
+                # videos.insert まで届かなかった (または重複でアップロードしなかった) 分は返す
+                self.quota.release(cost)
+            with self._lock:
+                self._in_flight.discard(video_file)
+            # 空いたワーカーに次のファイルを割り当てる
+            self._changed.set()
+
+    def _retry_later(self, video_file: str, reason: str):
+        with self._lock:
+            failures, _ = self._backoff.get(video_file, (0, 0.0))
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**failures)
+            self._backoff[video_file] = (failures + 1, time.monotonic() + delay)
+        logger.error(
+            f"Upload of {video_file} failed: {reason}; retrying in {delay:.0f} seconds"
+        )
+
+    def run(self, stop_event: threading.Event | None = None):
+        """stop_event がセットされるまでアップロードを続ける"""
+        stop_event = stop_event or threading.Event()
+        os.makedirs(self.watch_dir, exist_ok=True)
+        observer = self._start_observer()
+        logger.info(
+            f"Upload queue watching {self.watch_dir} "
+            f"({'polling' if self.use_polling else 'inotify'}, "
+            f"{self.quota.remaining()} quota units left today)"
+        )
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="upload"
+            ) as executor:
+                while not stop_event.is_set():
+                    self._changed.clear()
+                    timeout = self._dispatch(executor)
+                    # stop_event でもすぐに抜けられるよう、短い間隔で待つ
+                    deadline = time.monotonic() + timeout
+                    while not stop_event.is_set() and not self._changed.wait(
+                        min(1.0, max(0.0, deadline - time.monotonic()))
+                    ):
+                        if time.monotonic() >= deadline:
+                            break
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        logger.info("Upload queue stopped.")
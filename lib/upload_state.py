@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+
+class UploadStateStore:
+    """
+    再開可能アップロードのセッションURIと、サーバーが受信を確認したバイト位置を
+    JSONファイルに保存する。プロセスを再起動しても途中から再開できる。
+    ファイルはパス・サイズ・更新時刻で識別し、内容が変わった場合は最初からやり直す。
+    """
+
+    def __init__(self, state_path: str = "upload_state.json"):
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable upload state {state_path}: {e}")
+
+    @staticmethod
+    def _identity(video_file: str) -> dict:
+        stat = os.stat(video_file)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def get(self, video_file: str) -> dict | None:
+        """保存済みのセッション {"resumable_uri", "progress"} を返す"""
+        key = os.path.abspath(video_file)
+        with self._lock:
+            entry = self._state.get(key)
+        if entry is None:
+            return None
+        if {k: entry.get(k) for k in ("size", "mtime_ns")} != self._identity(
+            video_file
+        ):
+            self.forget(video_file)
+            return None
+        return entry
+
+    def update(self, video_file: str, resumable_uri: str, progress: int):
+        key = os.path.abspath(video_file)
+        entry = {
+            **self._identity(video_file),
+            "resumable_uri": resumable_uri,
+            "progress": progress,
+            "updated_at": time.time(),
+        }
+        with self._lock:
+            self._state[key] = entry
+            self._save()
+
+    def forget(self, video_file: str):
+        key = os.path.abspath(video_file)
+        with self._lock:
+            if self._state.pop(key, None) is not None:
+                self._save()
@@ -0,0 +1,151 @@
+import os
+import threading
+from typing import Callable
+
+from loguru import logger
+
+try:
+    # Linux: inotify, macOS: FSEvents
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - watchdogが無い環境ではポーリングのみ
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _VolumeEventHandler(FileSystemEventHandler):
+    """監視ディレクトリ直下で対象ボリューム名に関するイベントがあれば通知する"""
+
+    def __init__(self, usb_name: str, changed: threading.Event):
+        self.usb_name = usb_name
+        self.changed = changed
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        if any(os.path.basename(os.fsdecode(p)) == self.usb_name for p in paths if p):
+            self.changed.set()
+
+
+class VolumeWatcher:
+    """
+    monitor_volume_path 直下に usb_name のボリュームがマウントされるのを待ち、
+    マウントされるたびに on_mount を1回呼び出す。
+
+    inotify (watchdog) が使える場合はイベントが来るまでブロックするため、
+    マウントにすぐ反応できる。使えない場合も poll_interval 秒ごとに
+    ディレクトリを1回確認するだけなので、待機中のCPU使用率はほぼゼロになる。
+    マウント直後やリマウント時はイベントが連続するため、settle_seconds の間
+    イベントが止まってから状態を判定する (デバウンス)。
+
+    :param monitor_volume_path: 外部デバイスがマウントされるディレクトリ
+    :param usb_name: USBドライブの名前
+    :param on_mount: ボリュームのパスを受け取るコールバック
+    :param settle_seconds: デバウンス時間
+    :param poll_interval: ポーリング時の確認間隔
+    :param use_polling: True の場合、inotify を使わずポーリングする
+    """
+
+    def __init__(
+        self,
+        monitor_volume_path: str,
+        usb_name: str,
+        on_mount: Callable[[str], None],
+        settle_seconds: float = 5.0,
+        poll_interval: float = 2.0,
+        use_polling: bool = False,
+    ):
+        self.monitor_volume_path = monitor_volume_path
+        self.usb_name = usb_name
+        self.volume_path = os.path.join(monitor_volume_path, usb_name)
+        self.on_mount = on_mount
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling or Observer is None
+        self._changed = threading.Event()
+        self._mounted = False
+
+    def _start_observer(self):
+        if self.use_polling:
+            return None
+        if not os.path.isdir(self.monitor_volume_path):
+            logger.warning(
+                f"{self.monitor_volume_path} does not exist yet; falling back to polling"
+            )
+            self.use_polling = True
+            return None
+        try:
+            observer = Observer()
+            observer.schedule(
+                _VolumeEventHandler(self.usb_name, self._changed),
+                self.monitor_volume_path,
+                recursive=False,
+            )
+            observer.start()
+            return observer
+        except Exception as e:
+            logger.warning(f"Falling back to polling: cannot watch with inotify ({e})")
+            self.use_polling = True
+            return None
+
+    def _is_present(self) -> bool:
+        """ボリュームのディレクトリが存在し、中身がある（マウント済み）か"""
+        try:
+            with os.scandir(self.volume_path) as entries:
+                return any(True for _ in entries)
+        except OSError:
+            return False
+
+    def _wait_for_change(self, stop_event: threading.Event) -> bool:
+        """
+        変化があるまで待機する。stop_event がセットされたら False を返す。
+        既存のマウントポイントへのマウントは親ディレクトリのイベントにならないため、
+        inotify 使用時も poll_interval ごとに状態を1回 stat で確認する。
+        """
+        while True:
+            if self._changed.wait(timeout=self.poll_interval):
+                break
+            if stop_event.is_set():
+                return False
+            if self._is_present() != self._mounted:
+                break
+
+        # デバウンス: イベントが settle_seconds の間止まるまで待つ
+        while True:
+            self._changed.clear()
+            if stop_event.wait(self.settle_seconds):
+                return False
+            if not self._changed.is_set():
+                return True
+
+    def check(self):
+        """現在の状態を確認し、未処理のマウントであれば on_mount を呼ぶ"""
+        mounted = self._is_present()
+        if mounted and not self._mounted:
+            logger.info(f"Volume mounted: {self.volume_path}")
+            self._mounted = True
+            try:
+                self.on_mount(self.volume_path)
+            except Exception as e:
+                logger.exception(f"Ingest failed for {self.volume_path}: {e}")
+        elif not mounted and self._mounted:
+            logger.info(f"Volume removed: {self.volume_path}")
+            self._mounted = False
+
+    def run(self, stop_event: threading.Event | None = None):
+        """stop_event がセットされるまで監視を続ける"""
+        stop_event = stop_event or threading.Event()
+        observer = self._start_observer()
+        logger.info(
+            f"Watching {self.volume_path} "
+            f"({'polling' if self.use_polling else 'inotify'})"
+        )
+        try:
+            # 起動時点で既にマウントされている場合もすぐに処理する
+            self.check()
+            while self._wait_for_change(stop_event):
+                self.check()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        logger.info("Volume watcher stopped.")
@@ -0,0 +1,30 @@
+from model.segment_catalog import Segment
+
+# フロントとリアのセグメントを同時刻とみなす開始時刻の差（秒）
+PAIR_TOLERANCE_SECONDS = 2.0
+
+
+def pair_segments(
+    front: list[Segment],
+    rear: list[Segment],
+    tolerance: float = PAIR_TOLERANCE_SECONDS,
+) -> list[tuple[Segment, Segment]]:
+    """
+    開始時刻順に並んだフロントとリアのセグメントを、ファイル名の録画開始時刻で対応付ける。
+    開始時刻の差が tolerance 秒以内のものを1組とし、相手のいないセグメントは含めない。
+
+    :return: (フロント, リア) の組を開始時刻順に並べたリスト
+    """
+    pairs = []
+    i = j = 0
+    while i < len(front) and j < len(rear):
+        delta = (rear[j].start - front[i].start).total_seconds()
+        if abs(delta) <= tolerance:
+            pairs.append((front[i], rear[j]))
+            i += 1
+            j += 1
+        elif delta < 0:
+            j += 1
+        else:
+            i += 1
+    return pairs
@@ -0,0 +1,101 @@
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from model.segment_catalog import Segment
+
+
+# 速度変更後の出力サイズの見積もり (入力サイズ / 倍率 × この係数)。
+# 高速なエンコード設定は元の映像よりビットレートが高くなりやすいため多めに見る
+OUTPUT_SIZE_MARGIN = 3.0
+
+# トリップ単位の出力 (と中間ファイル) の名前: yyyymmdd_hhmmss_<camera>[_...].ts
+TRIP_OUTPUT_PATTERN = re.compile(r"^(?P<start>\d{8}_\d{6})_(?P<camera>[a-z]+)[_.]")
+
+
+def trip_start_of(output_file: str, cameras: tuple[str, ...]) -> datetime | None:
+    """トリップ単位の出力ファイル名から、そのトリップの開始時刻を取り出す (cameras 以外は None)"""
+    match = TRIP_OUTPUT_PATTERN.match(os.path.basename(output_file))
+    if match is None or match["camera"] not in cameras:
+        return None
+    return datetime.strptime(match["start"], "%Y%m%d_%H%M%S")
+
+
+@dataclass
+class IngestJob:
+    """
+    1つの出力ファイル (日付またはトリップ × カメラ) を作るための処理単位。
+    ジョブ同士は入力・出力ファイルを共有しないため、並列に実行できる。
+    """
+
+    date: str
+    camera: str
+    source_files: list[str] = field(default_factory=list)
+    output_dir: str = "output"
+    segments: list[Segment] = field(default_factory=list)
+    # トリップ単位のジョブの場合、その開始時刻
+    trip_start: datetime | None = None
+    # 合成ジョブ (camera="composite") の場合、segments と同じ順に対応するリアカメラのセグメント
+    rear_segments: list[Segment] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        if self.trip_start is not None:
+            return f"{self.trip_start:%Y%m%d_%H%M%S}_{self.camera}"
+        return f"{self.date}_{self.camera}"
+
+    @property
+    def is_composite(self) -> bool:
+        return bool(self.rear_segments)
+
+    @property
+    def rear_offset(self) -> float:
+        """リアカメラの録画開始がフロントより何秒遅いか（ファイル名の時刻から求める）"""
+        if not self.segments or not self.rear_segments:
+            return 0.0
+        return (self.rear_segments[0].start - self.segments[0].start).total_seconds()
+
+    @property
+    def source_bytes(self) -> int:
+        """入力セグメントの合計サイズ（カタログ作成時に取得したサイズを使う）"""
+        segments = self.segments + self.rear_segments
+        if segments:
+            return sum(segment.size for segment in segments)
+        return sum(os.path.getsize(f) for f in self.source_files if os.path.exists(f))
+
+    def required_bytes(
+        self, pipeline: str = "fused", speed_factor: float = 10.0
+    ) -> int:
+        """
+        処理中に出力ディスク上で同時に必要になる容量の見積もり。
+        fused は速度変更済みファイルだけ、staged はさらに集約ファイル（入力と同じ大きさ）を使う。
+        既存の出力に追記する場合は、追記分と、既存の出力 + 追記分を連結し直したファイルも加える。
+        """
+        speedup_bytes = int(self.source_bytes / speed_factor * OUTPUT_SIZE_MARGIN)
+        required = speedup_bytes
+        if pipeline == "staged" and not self.is_composite:
+            required += self.source_bytes
+        if os.path.exists(self.output_file):
+            required += os.path.getsize(self.output_file) + speedup_bytes
+        return required
+
+    @property
+    def output_file(self) -> str:
+        # ファイル名のルール: yyyymmdd_front.ts または yyyymmdd_rear.ts
+        # (トリップ単位の場合は yyyymmdd_hhmmss_front.ts、合成の場合は yyyymmdd_composite.ts)
+        return os.path.join(self.output_dir, f"{self.name}.ts")
+
+    @property
+    def speedup_file(self) -> str:
+        return os.path.join(self.output_dir, f"{self.name}_speedup.ts")
+
+    @property
+    def aggregated_file(self) -> str:
+        # staged パイプラインの中間ファイル（速度変更前）
+        return os.path.join(self.output_dir, f"{self.name}_aggregated.ts")
+
+    @property
+    def part_file(self) -> str:
+        # 既存の出力に追記する新しいセグメント分（速度変更済み）
+        return os.path.join(self.output_dir, f"{self.name}_part.ts")
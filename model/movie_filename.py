@@ -1,31 +1,37 @@
 import re
 import os
 
+# yyyymmdd_<time>_<camera>[...].<type> を1回のマッチで分解する (segment_catalog も同じパターンを使う)
+MOVIE_FILENAME_PATTERN = re.compile(
+    r"^(?P<date>\d{8})_(?P<time>[^_.]*)_(?P<camera>[^_.]*)[^.]*\.(?P<type>[^.]*)"
+)
+
 
 class MovieFilename:
+    __slots__ = ("origin", "file_type", "date", "time", "datetime", "camera_type")
+
     class MovieFilenameError(Exception):
         pass
 
     def __init__(self, filepath: str):
         filename = os.path.basename(filepath)
-        _name = filename.split(".")[0]
-
-        if len(_name.split("_")) < 3:
-            raise MovieFilename.MovieFilenameError(f"Invalid filename: {filename}")
+        match = MOVIE_FILENAME_PATTERN.match(filename)
 
-        # 日付が正しいフォーマットかチェック（YYYYMMDD）
-        date_part = _name.split("_")[0]
-        if not re.match(r"^\d{8}$", date_part):
+        if match is None:
+            _name = filename.split(".")[0]
+            if len(_name.split("_")) < 3:
+                raise MovieFilename.MovieFilenameError(f"Invalid filename: {filename}")
+            # 日付が正しいフォーマットかチェック（YYYYMMDD）
             raise MovieFilename.MovieFilenameError(
                 f"Invalid date format in filename: {filename}"
             )
 
         self.origin = filename
-        self.file_type = filename.split(".")[1]
-        self.date: str = date_part
-        self.time: str = _name.split("_")[1]
+        self.file_type = match["type"]
+        self.date: str = match["date"]
+        self.time: str = match["time"]
         self.datetime: str = f"{self.date}_{self.time}"
-        self.camera_type: str = _name.split("_")[2]
+        self.camera_type: str = match["camera"]
 
     def is_file_type(self, check_type: str = "ts"):
         return self.file_type.lower() == check_type.lower()
@@ -0,0 +1,75 @@
+import os
+from datetime import date, datetime
+
+from loguru import logger
+
+from model.movie_filename import MOVIE_FILENAME_PATTERN
+
+
+class Segment:
+    """
+    SDカード上の1つのTSセグメント。大量に生成されるため __slots__ で軽量にしている。
+    """
+
+    __slots__ = ("path", "start", "camera_type", "size", "mtime_ns")
+
+    def __init__(
+        self, path: str, start: datetime, camera_type: str, size: int, mtime_ns: int
+    ):
+        self.path = path
+        self.start = start
+        self.camera_type = camera_type
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __repr__(self):
+        return f"Segment({self.path!r}, {self.start:%Y-%m-%d %H:%M:%S})"
+
+
+def build_catalog(
+    directory: str, camera: str | None = None
+) -> dict[tuple[date, str], list[Segment]]:
+    """
+    ディレクトリを os.scandir で1回だけ走査し、セグメントを (日付, カメラ) ごとに
+    開始時刻順に並べて返す。
+
+    :param directory: TSファイルが格納されているディレクトリ
+    :param camera: カメラ名（例: "front"）。None の場合はファイル名のカメラ番号を使う
+    :return: (日付, カメラ) -> 開始時刻順のセグメントのリスト
+    """
+    catalog: dict[tuple[date, str], list[Segment]] = {}
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        logger.warning(f"Input directory does not exist: {directory}")
+        return catalog
+
+    with entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".ts"):
+                continue
+            match = MOVIE_FILENAME_PATTERN.match(entry.name)
+            if match is None:
+                logger.error(f"Skipping file due to invalid name: {entry.name}")
+                continue
+            try:
+                # 時刻は hhmmss の6桁だけを受け付ける (strptime は桁の足りない値も読んでしまう)
+                if len(match["time"]) != 6 or not match["time"].isdigit():
+                    raise ValueError(f"invalid time {match['time']!r}")
+                start = datetime.strptime(match["date"] + match["time"], "%Y%m%d%H%M%S")
+                stat = entry.stat()
+            except (ValueError, OSError) as e:
+                logger.error(f"Skipping file {entry.name}: {e}")
+                continue
+
+            camera_type = match["camera"]
+            segment = Segment(
+                entry.path, start, camera_type, stat.st_size, stat.st_mtime_ns
+            )
+            catalog.setdefault((start.date(), camera or camera_type), []).append(
+                segment
+            )
+
+    for segments in catalog.values():
+        segments.sort(key=lambda s: s.start)
+    return dict(sorted(catalog.items()))
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+from model.segment_catalog import Segment
+
+# 長さが分からないセグメントの想定の長さ（ドライブレコーダーの一般的な分割単位）
+DEFAULT_SEGMENT_DURATION = 60.0
+
+
+def split_trips(
+    segments: list[Segment],
+    durations: dict[str, float],
+    max_gap: timedelta = timedelta(minutes=10),
+) -> list[list[Segment]]:
+    """
+    開始時刻順のセグメントを、録画の空白時間で区切ってトリップに分ける。
+    日付ではなく時刻の連続性で区切るため、日付をまたぐ走行は1つのトリップになり、
+    朝と夕方の別々の走行は別のトリップになる。
+
+    :param segments: 開始時刻順に並んだ1台のカメラのセグメント
+    :param durations: パス -> 長さ（秒）。無いものは DEFAULT_SEGMENT_DURATION とみなす
+    :param max_gap: これより長い空白があればトリップを区切る
+    """
+    trips: list[list[Segment]] = []
+    current_end: datetime | None = None
+    for segment in segments:
+        if current_end is None or segment.start - current_end > max_gap:
+            trips.append([])
+        trips[-1].append(segment)
+        duration = durations.get(segment.path) or DEFAULT_SEGMENT_DURATION
+        end = segment.start + timedelta(seconds=duration)
+        current_end = end if current_end is None else max(current_end, end)
+    return trips
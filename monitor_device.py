@@ -1,22 +1,80 @@
 import argparse
 import os
-import shutil
+from dataclasses import replace
+from datetime import datetime, timedelta
 from loguru import logger
-from ts_convertor import aggregate_ts_files, speed_up_ts_file
-from model.movie_filename import MovieFilename
-import tempfile
+from ts_convertor import (
+    COMPOSITE_LAYOUTS,
+    FFMPEG_STALL_SECONDS,
+    aggregate_ts_files,
+    composite_and_speed_up_ts_files,
+    concat_and_speed_up_ts_files,
+    resume_ffmpeg_runs,
+    select_encoder,
+    set_ffmpeg_timeouts,
+    shutdown_ffmpeg_runs,
+    stream_aggregate_ts_files,
+    speed_up_ts_file,
+)
+from lib import metrics
+from lib.dedup import KIND_SEGMENT, DedupIndex
+from lib.manifest import (
+    STAGE_AGGREGATED,
+    STAGE_DONE,
+    STAGE_PENDING,
+    IngestManifest,
+)
+from lib.preview import PreviewOutputs
+from lib.probe import ProbeCache, probe_files, use_shared_cache
+from lib.scheduler import JobScheduler
+from lib.watcher import VolumeWatcher
+from model.camera_pair import pair_segments
+from model.ingest_job import IngestJob, trip_start_of
+from model.segment_catalog import build_catalog
+from model.trip import split_trips
 
 
 def process_ts_files(
-    monitor_volume_path: str, usb_name: str, movie_target_path: str, output_dir: str
+    monitor_volume_path: str,
+    usb_name: str,
+    movie_target_path: str,
+    output_dir: str,
+    pipeline: str = "fused",
+    jobs: int | None = None,
+    io_jobs: int = 2,
+    speed_engine: str = "auto",
+    encoder: str | None = None,
+    adaptive_speed: bool = False,
+    preview_interval: float | None = None,
+    manifest_path: str | None = None,
+    dedup_path: str | None = None,
+    trip_gap_minutes: float | None = None,
+    composite: str | None = None,
+    min_free_gb: float = 1.0,
+    space_wait_minutes: float | None = 60.0,
 ):
     """
     USBドライブからTSファイルを処理し、指定された出力ディレクトリに保存します。
+    日付 × カメラごとのジョブは互いに独立しているため並列に処理します。
 
     :param monitor_volume_path: 外部デバイスがマウントされているディレクトリ
     :param usb_name: USBドライブの名前
     :param movie_target_path: USBドライブ内の動画ファイルが格納されているディレクトリ
     :param output_dir: 出力ファイルを保存するディレクトリ
+    :param pipeline: "fused"（集約と速度変更を1回のffmpegで実行）または "staged"（集約ファイルを経由）
+    :param jobs: 同時に実行するジョブ数（Noneの場合はCPU数）
+    :param io_jobs: SDカードから同時に読み出す数（エンコードは jobs の数だけ並列に実行する）
+    :param speed_engine: 速度変更の方式 "auto" / "keyframe" / "reencode"
+    :param encoder: 使用する動画エンコーダ（Noneの場合は自動選択）
+    :param adaptive_speed: True の場合、動きの少ない区間ほど速くし、駐車中の区間は出力しない（合成ジョブを除く）
+    :param preview_interval: 指定した場合、同じデコードからプロキシ動画と、この秒数ごとのサムネイルの
+        スプライト・索引を output_dir/previews/<出力名>/ に書き出す（合成ジョブを除く）
+    :param manifest_path: 取り込みマニフェストのパス（Noneの場合は output_dir/ingest_manifest.sqlite3）
+    :param dedup_path: 内容の重複を判定する索引のパス（Noneの場合は output_dir/dedup_index.sqlite3）
+    :param trip_gap_minutes: 指定した場合、日付ではなくこの分数以上の空白で区切ったトリップ単位で処理する
+    :param composite: 指定した場合、フロントとリアを1本の動画に合成する ("hstack" または "pip")
+    :param min_free_gb: 出力ディスクに常に残しておく空き容量 (GB)
+    :param space_wait_minutes: 空き容量が足りないジョブを待たせる最大時間 (分、None なら無期限、0 なら待たずにスキップ)
     """
     sd_card_path = os.path.join(monitor_volume_path, usb_name, movie_target_path)
     if not os.path.exists(sd_card_path):
@@ -34,19 +92,251 @@ def process_ts_files(
 
     os.makedirs(output_dir, exist_ok=True)
 
-    # フロントカメラのTSファイルを集約・速度変更
-    aggregate_and_speed_up(
-        front_videos_path, output_dir, camera="front", speed_factor=10.0
+    # ffprobe の結果は計画・GOP判定・レンダリングで共有する
+    probe_cache = use_shared_cache(os.path.join(output_dir, "probe_cache.json"))
+
+    # 中断後の再実行で処理済みのセグメントをスキップするためのマニフェスト
+    manifest = IngestManifest(
+        manifest_path or os.path.join(output_dir, "ingest_manifest.sqlite3")
+    )
+
+    # フロント・リアカメラのジョブをまとめて並列に集約・速度変更
+    if trip_gap_minutes is None:
+        front_jobs = plan_ingest_jobs(front_videos_path, output_dir, camera="front")
+        rear_jobs = plan_ingest_jobs(rear_videos_path, output_dir, camera="rear")
+    else:
+        max_gap = timedelta(minutes=trip_gap_minutes)
+        front_jobs = plan_trip_jobs(
+            front_videos_path, output_dir, "front", max_gap, probe_cache, manifest
+        )
+        rear_jobs = plan_trip_jobs(
+            rear_videos_path, output_dir, "rear", max_gap, probe_cache, manifest
+        )
+
+    # 別名でコピーされるなどして再び現れた取り込み済みのセグメントは、ffmpeg を起動する前に除く
+    dedup = DedupIndex(dedup_path or os.path.join(output_dir, "dedup_index.sqlite3"))
+    front_jobs = skip_duplicate_segments(front_jobs, dedup, manifest)
+    rear_jobs = skip_duplicate_segments(rear_jobs, dedup, manifest)
+    if composite:
+        ingest_jobs = plan_composite_jobs(front_jobs, rear_jobs)
+    else:
+        ingest_jobs = front_jobs + rear_jobs
+
+    # 出力ディスクの空き容量に収まるジョブから開始し、収まらないジョブは空くまで待たせる
+    scheduler = JobScheduler(
+        max_workers=jobs,
+        io_slots=io_jobs,
+        disk_path=output_dir,
+        reserve_bytes=int(min_free_gb * 1e9),
+        space_timeout=(
+            space_wait_minutes * 60 if space_wait_minutes is not None else None
+        ),
+        # Ctrl-C で実行中の ffmpeg を止め、途中までの出力を削除させる
+        on_interrupt=shutdown_ffmpeg_runs,
+        on_start=resume_ffmpeg_runs,
+    )
+    speed_factor = 10.0
+    try:
+        scheduler.run(
+            ingest_jobs,
+            lambda job: run_ingest_job(
+                job,
+                scheduler,
+                speed_factor=speed_factor,
+                pipeline=pipeline,
+                speed_engine=speed_engine,
+                encoder=encoder,
+                adaptive_speed=adaptive_speed,
+                preview_interval=preview_interval,
+                manifest=manifest,
+                dedup=dedup,
+                composite_layout=composite or "hstack",
+            ),
+            size_of=lambda job: job.required_bytes(pipeline, speed_factor),
+        )
+    finally:
+        manifest.close()
+        dedup.close()
+
+
+def plan_ingest_jobs(input_dir: str, output_dir: str, camera: str) -> list[IngestJob]:
+    """
+    指定された入力ディレクトリ内のTSファイルを日付ごとにまとめ、ジョブの一覧を作成します。
+
+    :param input_dir: 入力TSファイルが格納されているディレクトリ
+    :param output_dir: 出力ファイルを保存するディレクトリ
+    :param camera: カメラの種類（例: "front", "rear"）
+    """
+    # ディレクトリを1回だけ走査し、日付ごと・開始時刻順にまとめる
+    catalog = build_catalog(input_dir, camera=camera)
+    if not catalog:
+        logger.warning(f"No .ts files found in {input_dir}")
+        return []
+
+    return [
+        IngestJob(
+            date=day.strftime("%Y%m%d"),
+            camera=camera,
+            source_files=[segment.path for segment in segments],
+            output_dir=output_dir,
+            segments=segments,
+        )
+        for (day, _), segments in catalog.items()
+    ]
+
+
+def plan_trip_jobs(
+    input_dir: str,
+    output_dir: str,
+    camera: str,
+    max_gap: timedelta,
+    probe_cache: ProbeCache | None = None,
+    manifest: IngestManifest | None = None,
+) -> list[IngestJob]:
+    """
+    指定された入力ディレクトリ内のTSファイルを、録画の空白時間でトリップに分けてジョブにします。
+    日付をまたぐ走行は1つのジョブ、同じ日の別々の走行は別のジョブになります。
+    セグメントの長さは probe_cache に保存し、次回以降は ffprobe を実行しません。
+    トリップのセグメントがマニフェストに記録済みなら、記録された出力の名前 (開始時刻) を使うため、
+    前回の削除が途中で止まって先頭のセグメントが消えていても同じ出力に追記します。
+
+    :param input_dir: 入力TSファイルが格納されているディレクトリ
+    :param output_dir: 出力ファイルを保存するディレクトリ
+    :param camera: カメラの種類（例: "front", "rear"）
+    :param max_gap: これより長い空白があればトリップを区切る
+    :param probe_cache: ffprobe 結果のキャッシュ
+    :param manifest: 取り込みのマニフェスト
+    """
+    catalog = build_catalog(input_dir, camera=camera)
+    if not catalog:
+        logger.warning(f"No .ts files found in {input_dir}")
+        return []
+
+    # 日付をまたいで連続させるため、カメラ単位で全セグメントを時刻順に並べる
+    segments = sorted(
+        (segment for day_segments in catalog.values() for segment in day_segments),
+        key=lambda segment: segment.start,
     )
+    durations = {
+        path: info["duration"]
+        for path, info in probe_files(
+            [segment.path for segment in segments], probe_cache
+        ).items()
+    }
+
+    jobs = []
+    for trip in split_trips(segments, durations, max_gap):
+        trip_start = _recorded_trip_start(trip, camera, manifest) or trip[0].start
+        jobs.append(
+            IngestJob(
+                date=trip_start.strftime("%Y%m%d"),
+                camera=camera,
+                source_files=[segment.path for segment in trip],
+                output_dir=output_dir,
+                segments=trip,
+                trip_start=trip_start,
+            )
+        )
+    logger.info(f"Split {len(segments)} {camera} segments into {len(jobs)} trips")
+    return jobs
+
 
-    # リアカメラのTSファイルを集約・速度変更
-    aggregate_and_speed_up(
-        rear_videos_path, output_dir, camera="rear", speed_factor=10.0
+def _recorded_trip_start(
+    trip: list, camera: str, manifest: IngestManifest | None
+) -> datetime | None:
+    """トリップのセグメントが記録されている出力 (カメラ別または合成) の開始時刻"""
+    if manifest is None:
+        return None
+    recorded = manifest.lookup([segment.path for segment in trip])
+    for _, output in recorded.values():
+        trip_start = trip_start_of(output, (camera, "composite"))
+        if trip_start is not None:
+            return trip_start
+    return None
+
+
+def plan_composite_jobs(
+    front_jobs: list[IngestJob], rear_jobs: list[IngestJob]
+) -> list[IngestJob]:
+    """
+    フロントとリアのジョブから、録画開始時刻が一致するセグメントの組を取り出して
+    フロントのジョブ（日付またはトリップ）単位の合成ジョブにします。
+    対になるセグメントが無いものは、元のカメラ別のジョブとして残します。
+
+    :param front_jobs: フロントカメラのジョブ
+    :param rear_jobs: リアカメラのジョブ
+    """
+    by_start = lambda segment: segment.start
+    pairs = pair_segments(
+        sorted((s for job in front_jobs for s in job.segments), key=by_start),
+        sorted((s for job in rear_jobs for s in job.segments), key=by_start),
     )
+    rear_by_front = {front.path: rear for front, rear in pairs}
+    paired_rear = {rear.path for _, rear in pairs}
+
+    jobs = []
+    for job in front_jobs:
+        paired = [s for s in job.segments if s.path in rear_by_front]
+        if paired:
+            jobs.append(
+                replace(
+                    job,
+                    camera="composite",
+                    source_files=[s.path for s in paired],
+                    segments=paired,
+                    rear_segments=[rear_by_front[s.path] for s in paired],
+                )
+            )
+        jobs += _without_segments(job, rear_by_front)
+    for job in rear_jobs:
+        jobs += _without_segments(job, paired_rear)
+
+    logger.info(
+        f"Paired {len(pairs)} front/rear segments into "
+        f"{sum(job.is_composite for job in jobs)} composite jobs"
+    )
+    return jobs
+
+
+def skip_duplicate_segments(
+    jobs: list[IngestJob], dedup: DedupIndex, manifest: IngestManifest | None = None
+) -> list[IngestJob]:
+    """
+    取り込み済みのセグメントと内容が同じセグメントをジョブから除き、ソースファイルを削除します。
+    マニフェストに記録済みのセグメントは run_ingest_job で扱うため、ここでは調べません。
+    """
+    remaining_jobs = []
+    for job in jobs:
+        recorded = manifest.lookup(job.source_files) if manifest else {}
+        duplicates = dedup.find_duplicates(
+            KIND_SEGMENT, [f for f in job.source_files if f not in recorded]
+        )
+        if duplicates:
+            logger.info(
+                f"[{job.name}] Skipping {len(duplicates)} segments whose content "
+                f"was already ingested"
+            )
+            _delete_source_files(list(duplicates))
+        remaining_jobs += _without_segments(job, duplicates)
+    return remaining_jobs
+
+
+def _without_segments(job: IngestJob, excluded) -> list[IngestJob]:
+    """excluded に含まれるセグメントを除いたジョブ（残りが無ければ空リスト）"""
+    remaining = [s for s in job.segments if s.path not in excluded]
+    if not remaining:
+        return []
+    return [replace(job, source_files=[s.path for s in remaining], segments=remaining)]
 
 
 def aggregate_and_speed_up(
-    input_dir: str, output_dir: str, camera: str, speed_factor: float = 10.0
+    input_dir: str,
+    output_dir: str,
+    camera: str,
+    speed_factor: float = 10.0,
+    pipeline: str = "fused",
+    jobs: int | None = 1,
+    speed_engine: str = "auto",
 ):
     """
     指定された入力ディレクトリ内のTSファイルを集約し、速度を変更して出力ディレクトリに保存します。
@@ -55,78 +345,345 @@ def aggregate_and_speed_up(
     :param output_dir: 出力ファイルを保存するディレクトリ
     :param camera: カメラの種類（例: "front", "rear"）
     :param speed_factor: 速度変更の倍率（デフォルトは10.0）
+    :param pipeline: "fused" または "staged"
+    :param jobs: 同時に実行するジョブ数
+    :param speed_engine: 速度変更の方式 "auto" / "keyframe" / "reencode"
     """
-    if not os.path.exists(input_dir):
-        logger.warning(f"Input directory does not exist: {input_dir}")
-        return
+    scheduler = JobScheduler(
+        max_workers=jobs,
+        on_interrupt=shutdown_ffmpeg_runs,
+        on_start=resume_ffmpeg_runs,
+    )
+    scheduler.run(
+        plan_ingest_jobs(input_dir, output_dir, camera),
+        lambda job: run_ingest_job(
+            job,
+            scheduler,
+            speed_factor=speed_factor,
+            pipeline=pipeline,
+            speed_engine=speed_engine,
+        ),
+    )
 
-    ts_files = [
-        os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".ts")
-    ]
 
-    if not ts_files:
-        logger.warning(f"No .ts files found in {input_dir}")
-        return
+def run_ingest_job(
+    job: IngestJob,
+    scheduler: JobScheduler,
+    speed_factor: float = 10.0,
+    pipeline: str = "fused",
+    speed_engine: str = "auto",
+    encoder: str | None = None,
+    adaptive_speed: bool = False,
+    preview_interval: float | None = None,
+    manifest: IngestManifest | None = None,
+    dedup: DedupIndex | None = None,
+    composite_layout: str = "hstack",
+) -> bool:
+    """
+    1つのジョブ（日付 × カメラ）を集約・速度変更し、成功したらソースファイルを削除します。
+    ジョブごとに入出力ファイルが分かれているため、並列に実行しても安全です。
+    マニフェストがある場合、取り込み済みのセグメントはスキップし、
+    既存の出力ファイルには新しいセグメントの分だけを追記します。
+    合成ジョブは pipeline に関わらず1回のffmpegで合成・速度変更します。
 
-    # 日付ごとにTSファイルをグループ化
-    grouped_files = {}
-    for ts_file in ts_files:
-        try:
-            movie = MovieFilename(ts_file)
-            date = movie.date
-            if date not in grouped_files:
-                grouped_files[date] = []
-            grouped_files[date].append(ts_file)
-        except MovieFilename.MovieFilenameError as e:
-            logger.error(f"Skipping file due to error: {e}")
-
-    for date, files in grouped_files.items():
-        sorted_files = sorted(files)
-
-        # ファイル名のルール: yyyymmdd_front.ts または yyyymmdd_rear.ts
-        aggregated_output_file = os.path.join(output_dir, f"{date}_{camera}.ts")
+    :return: 出力ファイルの作成に成功した場合 True
+    """
+    if job.is_composite:
+        return run_composite_job(
+            job,
+            scheduler,
+            speed_factor=speed_factor,
+            layout=composite_layout,
+            speed_engine=speed_engine,
+            encoder=encoder,
+            manifest=manifest,
+            dedup=dedup,
+        )
+
+    date = job.date
+    output_file = job.output_file
+    source_files = job.source_files
+
+    # マニフェストで取り込み済みのセグメントを除外（前回の削除前に中断した分は削除だけ行う）
+    recorded = (
+        _complete_pending_output(job, source_files, manifest, dedup) if manifest else {}
+    )
+    done_files = [
+        f for f in source_files if recorded.get(f, (None, None))[0] == STAGE_DONE
+    ]
+    if done_files:
         logger.info(
-            f"Aggregating {len(sorted_files)} files for date {date} into {aggregated_output_file}"
+            f"[{job.name}] Skipping {len(done_files)} segments already in the output"
         )
+        _delete_source_files(done_files)
+    sorted_files = [f for f in source_files if f not in done_files]
+    if not sorted_files:
+        return True
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            logger.info(f"Copying files to temporary directory: {temp_dir}")
-            # 一時ディレクトリにファイルをコピー
-            for file in sorted_files:
-                shutil.copy(file, temp_dir)
+    _remove_stale_intermediates(job)
+    preview = (
+        PreviewOutputs(
+            os.path.join(job.output_dir, "previews"),
+            job.name,
+            sorted_files,
+            preview_interval,
+        )
+        if preview_interval
+        else None
+    )
 
-            temp_files = [
-                os.path.join(temp_dir, os.path.basename(f)) for f in sorted_files
-            ]
+    # 既存の出力がある場合は新しいセグメント分だけを別ファイルに作り、後で追記する
+    appending = os.path.exists(output_file)
+    piece_file = job.part_file if appending else job.speedup_file
+    if appending:
+        logger.info(
+            f"[{job.name}] {output_file} exists; appending {len(sorted_files)} new segments"
+        )
 
-            # 一時ディレクトリ内のTSファイルを集約
-            aggregate_ts_files(temp_files, aggregated_output_file)
+    if pipeline == "fused":
+        # 集約と速度変更を1回のffmpegで実行し、中間ファイルを作らない
+        logger.info(
+            f"[{job.name}] Aggregating and speeding up {len(sorted_files)} files into {piece_file}"
+        )
+        # SDカードの読み出し中だけ io_slot を取り、エンコードは --jobs の数だけ並列に進める
+        checksums = concat_and_speed_up_ts_files(
+            sorted_files,
+            piece_file,
+            speed_factor=speed_factor,
+            engine=speed_engine,
+            encoder=encoder,
+            adaptive=adaptive_speed,
+            preview=preview,
+            read_slot=scheduler.io_slot,
+        )
+        if checksums is None:
+            logger.error(
+                f"[{job.name}] Fused pipeline failed for date {date}. Source files are kept."
+            )
+            return False
+    else:
+        aggregated_file = job.aggregated_file
+        already_aggregated = os.path.exists(aggregated_file) and all(
+            recorded.get(f) == (STAGE_AGGREGATED, os.path.abspath(aggregated_file))
+            for f in sorted_files
+        )
+        if already_aggregated:
+            # 前回、集約後・速度変更前に中断した場合は集約をやり直さない。
+            # チェックサムは集約時にマニフェストへ記録したものを引き継ぐ
+            logger.info(f"[{job.name}] Resuming from existing {aggregated_file}")
+            checksums = manifest.checksums(sorted_files)
+        else:
+            logger.info(
+                f"[{job.name}] Aggregating {len(sorted_files)} files for date {date} into {aggregated_file}"
+            )
+            # SDカード上のTSファイルを一時コピーせず、そのままffmpegへストリーミングして集約
+            checksums = stream_aggregate_ts_files(
+                sorted_files, aggregated_file, read_slot=scheduler.io_slot
+            )
+            if checksums is None:
+                logger.error(
+                    f"[{job.name}] Aggregation failed for date {date}. Source files are kept."
+                )
+                return False
+            if manifest:
+                manifest.record(
+                    sorted_files, aggregated_file, STAGE_AGGREGATED, checksums
+                )
 
-        # 速度変更後のファイル名
-        speedup_output_file = os.path.join(output_dir, f"{date}_{camera}_speedup.ts")
-        logger.info(f"Speeding up {aggregated_output_file} to {speedup_output_file}")
+        logger.info(f"[{job.name}] Speeding up {aggregated_file} to {piece_file}")
         speed_up_ts_file(
-            aggregated_output_file, speedup_output_file, speed_factor=speed_factor
-        )
-
-        # 速度変更が成功した場合、元の集約ファイルを削除し、速度変更ファイルにリネーム
-        if os.path.exists(speedup_output_file):
-            os.remove(aggregated_output_file)
-            os.rename(speedup_output_file, aggregated_output_file)
-            logger.info(f"Successfully created speedup file: {aggregated_output_file}")
-
-            # 処理が成功したら、元のソース `.ts` ファイルを削除
-            logger.info(f"Deleting source .ts files for date {date}")
-            for file in sorted_files:
-                try:
-                    os.remove(file)
-                    logger.debug(f"Deleted file: {file}")
-                except Exception as e:
-                    logger.error(f"Failed to delete file {file}: {e}")
-        else:
+            aggregated_file,
+            piece_file,
+            speed_factor=speed_factor,
+            engine=speed_engine,
+            encoder=encoder,
+            adaptive=adaptive_speed,
+            preview=preview,
+        )
+        if not os.path.exists(piece_file):
+            logger.error(
+                f"[{job.name}] Speed-up failed for {aggregated_file}. Aggregated file not deleted."
+            )
+            return False
+        os.remove(aggregated_file)
+    logger.debug(f"[{job.name}] Verified {len(checksums)} segments for date {date}")
+
+    if not os.path.exists(piece_file):
+        logger.error(f"[{job.name}] Speed-up failed: {piece_file} was not created.")
+        return False
+
+    return _finalize_output(
+        job, piece_file, appending, sorted_files, checksums, manifest, dedup
+    )
+
+
+def run_composite_job(
+    job: IngestJob,
+    scheduler: JobScheduler,
+    speed_factor: float = 10.0,
+    layout: str = "hstack",
+    speed_engine: str = "auto",
+    encoder: str | None = None,
+    manifest: IngestManifest | None = None,
+    dedup: DedupIndex | None = None,
+) -> bool:
+    """
+    フロントとリアのセグメントを1本の動画に合成・速度変更し、成功したら両方のソースファイルを削除します。
+    取り込み済みの組のスキップと既存の出力への追記は run_ingest_job と同じです。
+
+    :return: 出力ファイルの作成に成功した場合 True
+    """
+    pairs = list(zip(job.segments, job.rear_segments))
+    all_files = [s.path for pair in pairs for s in pair]
+    recorded = (
+        _complete_pending_output(job, all_files, manifest, dedup) if manifest else {}
+    )
+    is_done = lambda s: recorded.get(s.path, (None, None))[0] == STAGE_DONE
+
+    done_pairs = [pair for pair in pairs if all(map(is_done, pair))]
+    if done_pairs:
+        logger.info(
+            f"[{job.name}] Skipping {len(done_pairs)} segment pairs already in the output"
+        )
+        _delete_source_files([s.path for pair in done_pairs for s in pair])
+    pairs = [pair for pair in pairs if pair not in done_pairs]
+    if not pairs:
+        return True
+
+    # 残りの組だけのジョブにして、オフセットも残りの先頭の組から求める
+    job = replace(
+        job,
+        source_files=[front.path for front, _ in pairs],
+        segments=[front for front, _ in pairs],
+        rear_segments=[rear for _, rear in pairs],
+    )
+    front_files = job.source_files
+    rear_files = [rear.path for rear in job.rear_segments]
+
+    _remove_stale_intermediates(job)
+    appending = os.path.exists(job.output_file)
+    piece_file = job.part_file if appending else job.speedup_file
+    logger.info(
+        f"[{job.name}] Compositing {len(pairs)} front/rear segment pairs ({layout}) into {piece_file}"
+    )
+    checksums = composite_and_speed_up_ts_files(
+        front_files,
+        rear_files,
+        piece_file,
+        layout=layout,
+        speed_factor=speed_factor,
+        rear_offset=job.rear_offset,
+        engine=speed_engine,
+        encoder=encoder,
+        read_slot=scheduler.io_slot,
+    )
+    if checksums is None:
+        logger.error(
+            f"[{job.name}] Composite failed for date {job.date}. Source files are kept."
+        )
+        return False
+
+    return _finalize_output(
+        job,
+        piece_file,
+        appending,
+        front_files + rear_files,
+        checksums,
+        manifest,
+        dedup,
+    )
+
+
+def _finalize_output(
+    job: IngestJob,
+    piece_file: str,
+    appending: bool,
+    source_files: list[str],
+    checksums: dict,
+    manifest: IngestManifest | None,
+    dedup: DedupIndex | None = None,
+) -> bool:
+    """
+    作成した速度変更済みファイルを出力ファイルにし（既存の出力があれば追記し）、
+    マニフェストと重複判定の索引に記録してからソースファイルを削除します。
+    """
+    output_file = job.output_file
+    if appending:
+        # 既存の出力 + 新しい分を concat demuxer で連結し、出力を置き換える。
+        # バイト列の連結ではタイムスタンプが巻き戻るため、demuxer に詰め直させる
+        if not aggregate_ts_files([output_file, piece_file], job.speedup_file):
             logger.error(
-                f"Speed-up failed for {aggregated_output_file}. Original aggregated file not deleted."
+                f"[{job.name}] Failed to append {piece_file} to {output_file}. Both are kept."
             )
+            return False
+        os.remove(piece_file)
+
+    # 置き換えの前に pending を記録しておき、置き換えと done の記録の間で中断しても
+    # 次回に同じ映像を追記し直さないようにする (_complete_pending_output)
+    if manifest:
+        manifest.record(source_files, output_file, STAGE_PENDING, checksums)
+    # 速度変更済みファイルで出力ファイルを置き換え
+    os.replace(job.speedup_file, output_file)
+    logger.info(f"[{job.name}] Successfully created speedup file: {output_file}")
+    if manifest:
+        manifest.record(source_files, output_file, STAGE_DONE, checksums)
+    if dedup:
+        dedup.record(KIND_SEGMENT, source_files, checksums)
+
+    # 処理が成功したら、このジョブのソース `.ts` ファイルだけを削除
+    logger.info(f"[{job.name}] Deleting source .ts files for date {job.date}")
+    _delete_source_files(source_files)
+    return True
+
+
+def _complete_pending_output(
+    job: IngestJob,
+    source_files: list[str],
+    manifest: IngestManifest,
+    dedup: DedupIndex | None = None,
+) -> dict:
+    """
+    前回、_finalize_output で出力の置き換えの前後に中断したセグメントを done にします。
+    os.replace は不可分なので、速度変更済みファイルが残っていれば置き換えはまだであり、ここで済ませます。
+
+    :return: 更新後の manifest.lookup(source_files)
+    """
+    recorded = manifest.lookup(source_files)
+    pending_entry = (STAGE_PENDING, os.path.abspath(job.output_file))
+    pending = [f for f in source_files if recorded.get(f) == pending_entry]
+    if not pending:
+        return recorded
+
+    if os.path.exists(job.speedup_file):
+        logger.info(
+            f"[{job.name}] Completing the interrupted replacement of {job.output_file}"
+        )
+        os.replace(job.speedup_file, job.output_file)
+    checksums = manifest.checksums(pending)
+    manifest.record(pending, job.output_file, STAGE_DONE, checksums)
+    if dedup:
+        dedup.record(KIND_SEGMENT, pending, checksums)
+    return manifest.lookup(source_files)
+
+
+def _remove_stale_intermediates(job: IngestJob):
+    """
+    前回中断したときに残った速度変更途中のファイルを、処理を始める前に削除して容量を空ける。
+    集約ファイルは staged パイプラインの再開に使うため残す。
+    """
+    for path in (job.speedup_file, job.part_file):
+        if os.path.exists(path):
+            logger.info(f"[{job.name}] Removing stale intermediate file {path}")
+            os.remove(path)
+
+
+def _delete_source_files(files: list[str]):
+    for file in files:
+        try:
+            os.remove(file)
+            logger.debug(f"Deleted file: {file}")
+        except Exception as e:
+            logger.error(f"Failed to delete file {file}: {e}")
 
 
 def main():
@@ -157,11 +714,210 @@ def main():
         type=str,
         help="Directory where the processed video files will be saved.",
     )
+    parser.add_argument(
+        "--pipeline",
+        default="fused",
+        choices=["fused", "staged"],
+        help="'fused' concatenates and speeds up in one ffmpeg pass; "
+        "'staged' writes the aggregated file first.",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=None,
+        type=int,
+        help="Number of (date, camera) jobs to process in parallel "
+        "(default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--io_jobs",
+        default=2,
+        type=int,
+        help="Maximum number of reads from the USB drive at the same time "
+        "(a slot is held per chunk read, not for the whole encode).",
+    )
+    parser.add_argument(
+        "--speed_engine",
+        default="auto",
+        choices=["auto", "keyframe", "reencode"],
+        help="'keyframe' decodes keyframes only; 'auto' does so only when the "
+        "speed factor is an exact multiple of the GOP size; 'reencode' decodes every frame.",
+    )
+    parser.add_argument(
+        "--encoder",
+        default="auto",
+        type=str,
+        help="Video encoder to use (e.g. libx264, h264_vaapi, h264_videotoolbox). "
+        "'auto' picks the fastest one available.",
+    )
+    parser.add_argument(
+        "--adaptive_speed",
+        action="store_true",
+        help="Speed up low-motion footage (traffic jams) further and drop parked, "
+        "static spans, based on a quick keyframe motion analysis.",
+    )
+    parser.add_argument(
+        "--previews",
+        action="store_true",
+        help="Also write a small proxy video, thumbnail sprites and a JSON index "
+        "to <output_dir>/previews/<output name>/ from the same decode.",
+    )
+    parser.add_argument(
+        "--preview_interval",
+        default=10.0,
+        type=float,
+        help="Seconds of footage between thumbnails (with --previews).",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        type=str,
+        help="Path of the ingest manifest used to resume interrupted runs "
+        "(default: <output_dir>/ingest_manifest.sqlite3).",
+    )
+    parser.add_argument(
+        "--dedup_index",
+        default=None,
+        type=str,
+        help="Path of the index used to skip segments whose content was already "
+        "ingested (default: <output_dir>/dedup_index.sqlite3).",
+    )
+    parser.add_argument(
+        "--trip_gap_minutes",
+        default=None,
+        type=float,
+        help="Split footage into trips at recording gaps longer than this many "
+        "minutes instead of by calendar date (outputs are named yyyymmdd_hhmmss_<camera>.ts).",
+    )
+    parser.add_argument(
+        "--composite",
+        default=None,
+        choices=COMPOSITE_LAYOUTS,
+        help="Render front and rear footage recorded at the same time into one video: "
+        "'hstack' places them side by side, 'pip' insets the rear camera "
+        "(outputs are named <date>_composite.ts).",
+    )
+    parser.add_argument(
+        "--min_free_gb",
+        default=1.0,
+        type=float,
+        help="Free space to always keep on the output disk; jobs whose estimated "
+        "size does not fit wait until space frees up.",
+    )
+    parser.add_argument(
+        "--space_wait_minutes",
+        default=60.0,
+        type=float,
+        help="How long a job may wait for free space before it is skipped "
+        "(its source files are kept for the next run). 0 skips jobs that do not "
+        "fit right away; a negative value waits indefinitely.",
+    )
+    parser.add_argument(
+        "--ffmpeg_timeout_minutes",
+        default=None,
+        type=float,
+        help="Stop an ffmpeg run that takes longer than this (default: no limit). "
+        "Its partial output is removed and the sources stay on the card.",
+    )
+    parser.add_argument(
+        "--ffmpeg_stall_seconds",
+        default=FFMPEG_STALL_SECONDS,
+        type=float,
+        help="Stop an ffmpeg run that reports no progress for this long (0: never).",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        default=None,
+        type=str,
+        help="JSON-lines file to append per-stage metrics to "
+        "(default: <output_dir>/metrics.jsonl).",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        default=None,
+        type=int,
+        help="Serve Prometheus-format metrics on this local port.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and ingest every time the USB drive is mounted.",
+    )
+    parser.add_argument(
+        "--settle_seconds",
+        default=5.0,
+        type=float,
+        help="Seconds without mount events before the volume is considered ready.",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        default=2.0,
+        type=float,
+        help="Seconds between volume checks when inotify is unavailable.",
+    )
+    parser.add_argument(
+        "--polling",
+        action="store_true",
+        help="Use polling instead of inotify/FSEvents.",
+    )
 
     args = parser.parse_args()
-    process_ts_files(
-        args.monitor_volume_path, args.usb_name, args.movie_target_path, args.output_dir
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    metrics.configure(
+        args.metrics_file or os.path.join(args.output_dir, "metrics.jsonl"),
+        args.metrics_port,
+    )
+
+    set_ffmpeg_timeouts(
+        args.ffmpeg_timeout_minutes * 60 if args.ffmpeg_timeout_minutes else None,
+        args.ffmpeg_stall_seconds or None,
+    )
+
+    # 起動時に一度だけエンコーダを検出・選択する（結果はキャッシュされる）
+    encoder = select_encoder(args.encoder)
+    logger.info(f"Using video encoder: {encoder}")
+
+    def ingest(_volume_path: str = None):
+        process_ts_files(
+            args.monitor_volume_path,
+            args.usb_name,
+            args.movie_target_path,
+            args.output_dir,
+            pipeline=args.pipeline,
+            jobs=args.jobs,
+            io_jobs=args.io_jobs,
+            speed_engine=args.speed_engine,
+            encoder=encoder,
+            adaptive_speed=args.adaptive_speed,
+            preview_interval=args.preview_interval if args.previews else None,
+            manifest_path=args.manifest,
+            dedup_path=args.dedup_index,
+            trip_gap_minutes=args.trip_gap_minutes,
+            composite=args.composite,
+            min_free_gb=args.min_free_gb,
+            space_wait_minutes=(
+                None if args.space_wait_minutes < 0 else args.space_wait_minutes
+            ),
+        )
+
+    if not args.watch:
+        # Ctrl-C では JobScheduler が実行中の ffmpeg を止めてから KeyboardInterrupt を送出する
+        ingest()
+        return
+
+    # USBドライブがマウントされるたびに取り込みを実行する
+    watcher = VolumeWatcher(
+        args.monitor_volume_path,
+        args.usb_name,
+        on_mount=ingest,
+        settle_seconds=args.settle_seconds,
+        poll_interval=args.poll_interval,
+        use_polling=args.polling,
     )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logger.info("Device monitor terminated by user.")
 
 
 if __name__ == "__main__":
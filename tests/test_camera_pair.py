@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from model.camera_pair import pair_segments
+from model.segment_catalog import Segment
+
+
+def _segments(camera_type: str, *times: str) -> list[Segment]:
+    segments = []
+    for t in times:
+        start = datetime.strptime(f"20240101{t}", "%Y%m%d%H%M%S")
+        name = f"{start:%Y%m%d_%H%M%S}_{camera_type}.ts"
+        segments.append(Segment(name, start, camera_type, 0, 0))
+    return segments
+
+
+def _names(pairs) -> list[tuple[str, str]]:
+    return [(front.path, rear.path) for front, rear in pairs]
+
+
+def test_front_without_rear_is_skipped():
+    front = _segments("0", "120000", "120100", "120200")
+    rear = _segments("1", "120000", "120200")
+
+    assert _names(pair_segments(front, rear)) == [
+        ("20240101_120000_0.ts", "20240101_120000_1.ts"),
+        ("20240101_120200_0.ts", "20240101_120200_1.ts"),
+    ]
+
+
+def test_skewed_start_is_paired_within_tolerance():
+    front = _segments("0", "120000", "120100")
+    # リアの録画開始が 2 秒遅れた組は対応付け、3 秒ずれた組は別の録画とみなす
+    rear = _segments("1", "120002", "120103")
+
+    assert _names(pair_segments(front, rear)) == [
+        ("20240101_120000_0.ts", "20240101_120002_1.ts"),
+    ]
+
+
+def test_unpaired_tail_is_dropped():
+    front = _segments("0", "120000")
+    rear = _segments("1", "115800", "120001", "120100", "120200")
+
+    assert _names(pair_segments(front, rear)) == [
+        ("20240101_120000_0.ts", "20240101_120001_1.ts"),
+    ]
+    assert pair_segments(rear, []) == []
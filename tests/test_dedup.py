@@ -0,0 +1,63 @@
+import monitor_device
+from lib.dedup import KIND_SEGMENT, SAMPLE_BLOCK_SIZE, DedupIndex, full_hash
+from lib.manifest import IngestManifest
+from model.ingest_job import IngestJob
+from model.segment_catalog import build_catalog
+
+
+def _job(card):
+    ((day, camera), segments), *_ = build_catalog(str(card), camera="front").items()
+    return IngestJob(
+        date=day.strftime("%Y%m%d"),
+        camera=camera,
+        source_files=[s.path for s in segments],
+        output_dir=str(card.parent / "out"),
+        segments=segments,
+    )
+
+
+def _ingested(tmp_path, content: bytes):
+    """取り込み済み (元のファイルは削除済みで、チェックサムだけが残る) のセグメントを記録する"""
+    original = tmp_path / "ingested" / "20231231_120000_0.ts"
+    original.parent.mkdir()
+    original.write_bytes(content)
+    dedup = DedupIndex(str(tmp_path / "dedup_index.sqlite3"))
+    dedup.record(KIND_SEGMENT, [str(original)], {str(original): full_hash(original)})
+    original.unlink()
+    return dedup
+
+
+def test_copy_of_an_ingested_segment_is_deleted(tmp_path):
+    content = bytes(range(256)) * 1024
+    dedup = _ingested(tmp_path, content)
+    card = tmp_path / "card"
+    card.mkdir()
+    (card / "20240101_120000_0.ts").write_bytes(content)
+    (card / "20240101_120100_0.ts").write_bytes(b"new footage")
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+
+    (job,) = monitor_device.skip_duplicate_segments([_job(card)], dedup, manifest)
+
+    assert job.source_files == [str(card / "20240101_120100_0.ts")]
+    assert not (card / "20240101_120000_0.ts").exists()
+
+
+def test_same_size_segment_with_different_content_is_kept(tmp_path):
+    # 先頭・中央・末尾の標本ブロックは同じで、その間だけが違う
+    size = 8 * SAMPLE_BLOCK_SIZE
+    content = bytearray(size)
+    dedup = _ingested(tmp_path, bytes(content))
+    content[SAMPLE_BLOCK_SIZE + 1] = 1
+    card = tmp_path / "card"
+    card.mkdir()
+    (card / "20240101_120000_0.ts").write_bytes(bytes(content))
+    (card / "20240101_120100_0.ts").write_bytes(b"x" * size)
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+
+    (job,) = monitor_device.skip_duplicate_segments([_job(card)], dedup, manifest)
+
+    assert job.source_files == [
+        str(card / "20240101_120000_0.ts"),
+        str(card / "20240101_120100_0.ts"),
+    ]
+    assert (card / "20240101_120000_0.ts").exists()
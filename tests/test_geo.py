@@ -0,0 +1,93 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from lib import geo
+from lib.geo import GPS_TRACK_DTYPE, reverse_geocode_track, sample_overlay_frames
+from lib.geocode_cache import GeocodeCache
+
+
+def _ffmpeg_reads_mpegts() -> bool:
+    if shutil.which("ffmpeg") is None:
+        return False
+    probe = subprocess.run(
+        "ffmpeg -loglevel error -f lavfi -i color=size=16x16:duration=0.2 "
+        "-c:v mpeg2video -f mpegts - | ffmpeg -loglevel error -f mpegts -i - -f null -",
+        shell=True,
+        capture_output=True,
+    )
+    return probe.returncode == 0
+
+
+@pytest.mark.skipif(
+    not _ffmpeg_reads_mpegts(), reason="ffmpeg cannot read MPEG-TS here"
+)
+def test_overlay_frames_are_cropped_keyframes_at_their_timestamps(
+    tmp_path, monkeypatch
+):
+    path = tmp_path / "20240101_120000_0.ts"
+    # 白い映像の左下 (オーバーレイの領域) だけを黒く塗る。キーフレームは 1.5 秒ごと
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi"]
+        + ["-i", "color=c=white:size=160x90:rate=10:duration=7"]
+        + ["-vf", "drawbox=x=0:y=72:w=56:h=18:color=black:t=fill"]
+        + ["-c:v", "mpeg2video", "-g", "15", "-bf", "0", "-f", "mpegts", str(path)],
+        check=True,
+    )
+    probed = []
+
+    def probe_media(ts_file):
+        probed.append(ts_file)
+        return {"width": 160, "height": 90}
+
+    monkeypatch.setattr(geo, "probe_media", probe_media)
+
+    samples = list(sample_overlay_frames(str(path), interval=2.0))
+
+    assert probed == [str(path)]
+    # 2 秒ごとではなく、2 秒以上離れた最初のキーフレームの時刻になる
+    assert [t for t, _ in samples] == pytest.approx([0.0, 3.0, 6.0], abs=0.15)
+    for _, frame in samples:
+        assert frame.shape == (18, 56)
+        assert frame.max() < 32
+
+
+def test_overlay_frames_need_a_probe(monkeypatch):
+    monkeypatch.setattr(geo, "probe_media", lambda ts_file: None)
+
+    assert list(sample_overlay_frames("missing.ts")) == []
+
+
+def test_reverse_geocode_track_looks_up_each_cell_once(tmp_path, monkeypatch):
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.sqlite3"))
+    # 事前にキャッシュした地点は問い合わせない
+    cache.put(cache.key(35.0, 139.0), "cached")
+    lookups = []
+
+    def lookup_address(latitude, longitude, gazetteer):
+        lookups.append((latitude, longitude))
+        return f"{latitude:.1f},{longitude:.1f}"
+
+    monkeypatch.setattr(geo, "_lookup_address", lookup_address)
+    track = np.array(
+        [
+            (0.0, 35.0, 139.0),
+            (10.0, 35.5, 139.5),
+            # 前の点と同じセルに入る
+            (20.0, 35.5000001, 139.5000001),
+            (30.0, 36.0, 140.0),
+        ],
+        dtype=GPS_TRACK_DTYPE,
+    )
+
+    addresses = reverse_geocode_track(track, cache)
+
+    assert addresses == ["cached", "35.5,139.5", "35.5,139.5", "36.0,140.0"]
+    assert lookups == [(35.5, 139.5), (36.0, 140.0)]
+    # 問い合わせた結果はキャッシュに残り、次は問い合わせない
+    lookups.clear()
+    assert reverse_geocode_track(track, cache) == addresses
+    assert lookups == []
+    cache.close()
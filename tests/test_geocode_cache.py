@@ -0,0 +1,31 @@
+from lib.geocode_cache import GeocodeCache
+
+
+def test_put_evicts_least_recently_used_in_batches(tmp_path):
+    db_path = str(tmp_path / "geocode_cache.sqlite3")
+    cache = GeocodeCache(db_path, max_entries=10)
+    for i in range(10):
+        cache.put(f"cell{i}", f"address {i}")
+    # 読んだエントリは最近使われたものとして残る
+    assert cache.get("cell0") == (True, "address 0")
+    # 上書きは件数を増やさない
+    cache.put("cell5", "address 5b")
+    assert cache._count == 10
+
+    cache.put("cell10", "address 10")
+
+    # 上限を超えた分に加えて max_entries の 1 割を古い順に削除する
+    assert cache._count == 9
+    assert cache.get("cell1") == (False, None)
+    assert cache.get("cell2") == (False, None)
+    assert cache.get("cell0") == (True, "address 0")
+    assert cache.get("cell5") == (True, "address 5b")
+    assert cache.get("cell10") == (True, "address 10")
+    cache.close()
+
+    # 開き直したときは件数を数え直す
+    cache = GeocodeCache(db_path, max_entries=10)
+    assert cache._count == 9
+    cache.put("cell11", None)
+    assert cache.get("cell11") == (True, None)
+    cache.close()
@@ -0,0 +1,33 @@
+from lib.manifest import STAGE_AGGREGATED, STAGE_DONE, IngestManifest
+
+
+def test_checksums_recorded_at_aggregation_survive_a_restart(tmp_path):
+    segment = tmp_path / "20240101_000000_0.ts"
+    segment.write_bytes(b"segment")
+    db_path = str(tmp_path / "ingest_manifest.sqlite3")
+    aggregated = str(tmp_path / "20240101_aggregated.ts")
+
+    manifest = IngestManifest(db_path)
+    manifest.record([str(segment)], aggregated, STAGE_AGGREGATED, {str(segment): "abc"})
+    manifest.close()
+
+    manifest = IngestManifest(db_path)
+    assert manifest.checksums([str(segment)]) == {str(segment): "abc"}
+    # 最終出力への記録でも同じチェックサムが残る
+    manifest.record(
+        [str(segment)],
+        str(tmp_path / "out.ts"),
+        STAGE_DONE,
+        manifest.checksums([str(segment)]),
+    )
+    assert manifest.lookup([str(segment)])[str(segment)][0] == STAGE_DONE
+    assert manifest.checksums([str(segment)]) == {str(segment): "abc"}
+
+
+def test_checksums_skip_segments_without_one(tmp_path):
+    segment = tmp_path / "20240101_000000_0.ts"
+    segment.write_bytes(b"segment")
+    manifest = IngestManifest(str(tmp_path / "ingest_manifest.sqlite3"))
+    manifest.record([str(segment)], str(tmp_path / "out.ts"), STAGE_AGGREGATED)
+    assert manifest.checksums([str(segment)]) == {}
+    assert manifest.checksums([str(tmp_path / "missing.ts")]) == {}
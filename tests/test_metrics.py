@@ -0,0 +1,35 @@
+import json
+
+from lib.metrics import MetricsRecorder
+
+
+def test_render_prometheus_exposition_format(tmp_path):
+    jsonl_path = tmp_path / "metrics.jsonl"
+    recorder = MetricsRecorder(str(jsonl_path))
+    recorder.record("concat", seconds=1.5, bytes_in=100, status="ok")
+    recorder.record("concat", seconds=0.5, bytes_in=50, status="error")
+    recorder.record("speed_up", seconds=3.0, fps=120.0)
+    recorder.progress("speed_up", {"fps": "90.5", "speed": " 12.5x"})
+
+    # メトリクスごとに TYPE 行が1つあり、stage ごとの値がラベル付きで続く
+    assert recorder.render_prometheus() == (
+        "# TYPE drive_recorder_bytes_in_total counter\n"
+        'drive_recorder_bytes_in_total{stage="concat"} 150\n'
+        "# TYPE drive_recorder_errors_total counter\n"
+        'drive_recorder_errors_total{stage="concat"} 1\n'
+        "# TYPE drive_recorder_runs_total counter\n"
+        'drive_recorder_runs_total{stage="concat"} 2\n'
+        'drive_recorder_runs_total{stage="speed_up"} 1\n'
+        "# TYPE drive_recorder_seconds_total counter\n"
+        'drive_recorder_seconds_total{stage="concat"} 2.0\n'
+        'drive_recorder_seconds_total{stage="speed_up"} 3.0\n'
+        "# TYPE drive_recorder_fps gauge\n"
+        'drive_recorder_fps{stage="speed_up"} 120.0\n'
+        "# TYPE drive_recorder_progress_fps gauge\n"
+        'drive_recorder_progress_fps{stage="speed_up"} 90.5\n'
+        "# TYPE drive_recorder_progress_speed gauge\n"
+        'drive_recorder_progress_speed{stage="speed_up"} 12.5\n'
+    )
+    # JSON Lines には1件ずつ記録される
+    events = [json.loads(line) for line in jsonl_path.read_text().splitlines()]
+    assert [event["stage"] for event in events] == ["concat", "concat", "speed_up"]
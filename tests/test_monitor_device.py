@@ -0,0 +1,164 @@
+from datetime import timedelta
+
+import monitor_device
+from lib.manifest import STAGE_DONE, STAGE_PENDING, IngestManifest
+from lib.probe import ProbeCache
+from lib.scheduler import JobScheduler
+from model.segment_catalog import build_catalog
+from monitor_device import plan_trip_jobs, run_ingest_job
+
+
+def _card(tmp_path, names):
+    card = tmp_path / "card"
+    card.mkdir()
+    for name in names:
+        (card / name).write_bytes(name.encode())
+    return card
+
+
+def _day_job(card, output_dir):
+    ((day, camera), segments), *_ = build_catalog(str(card), camera="front").items()
+    return monitor_device.IngestJob(
+        date=day.strftime("%Y%m%d"),
+        camera=camera,
+        source_files=[s.path for s in segments],
+        output_dir=str(output_dir),
+        segments=segments,
+    )
+
+
+def _crash_during_finalize(tmp_path, replaced: bool):
+    card = _card(tmp_path, ["20240101_120000_0.ts", "20240101_120100_0.ts"])
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    job = _day_job(card, output_dir)
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    checksums = {path: f"sha-{i}" for i, path in enumerate(job.source_files)}
+    # _finalize_output が pending を記録した後に落ちた状態を作る
+    manifest.record(job.source_files, job.output_file, STAGE_PENDING, checksums)
+    if replaced:
+        (output_dir / f"{job.name}.ts").write_bytes(b"old+new")
+    else:
+        (output_dir / f"{job.name}.ts").write_bytes(b"old")
+        (output_dir / f"{job.name}_speedup.ts").write_bytes(b"old+new")
+    return job, manifest, checksums
+
+
+def _resume(job, manifest, monkeypatch) -> dict:
+    # 再開では ffmpeg を起動しない (呼ばれたら TypeError になる)
+    monkeypatch.setattr(monitor_device, "concat_and_speed_up_ts_files", None)
+    deleted = {}
+    monkeypatch.setattr(
+        monitor_device,
+        "_delete_source_files",
+        lambda files: deleted.update(manifest.lookup(files)),
+    )
+    assert run_ingest_job(job, JobScheduler(max_workers=1), manifest=manifest)
+    return deleted
+
+
+def test_resume_after_replace_does_not_append_again(tmp_path, monkeypatch):
+    job, manifest, checksums = _crash_during_finalize(tmp_path, replaced=True)
+
+    deleted = _resume(job, manifest, monkeypatch)
+
+    with open(job.output_file, "rb") as f:
+        assert f.read() == b"old+new"
+    assert set(deleted) == set(job.source_files)
+    assert {stage for stage, _ in deleted.values()} == {STAGE_DONE}
+    assert manifest.checksums(job.source_files) == checksums
+
+
+def test_resume_before_replace_finishes_the_replacement(tmp_path, monkeypatch):
+    job, manifest, checksums = _crash_during_finalize(tmp_path, replaced=False)
+
+    deleted = _resume(job, manifest, monkeypatch)
+
+    with open(job.output_file, "rb") as f:
+        assert f.read() == b"old+new"
+    assert not (tmp_path / "out" / f"{job.name}_speedup.ts").exists()
+    assert {stage for stage, _ in deleted.values()} == {STAGE_DONE}
+    assert manifest.checksums(job.source_files) == checksums
+
+
+def test_append_concatenates_with_the_concat_demuxer(tmp_path, monkeypatch):
+    card = _card(tmp_path, ["20240101_120000_0.ts"])
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    job = _day_job(card, output_dir)
+    (output_dir / f"{job.name}.ts").write_bytes(b"old")
+    (output_dir / f"{job.name}_part.ts").write_bytes(b"new")
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    calls = []
+
+    def aggregate(ts_files, output_file):
+        calls.append((ts_files, output_file))
+        with open(output_file, "wb") as out:
+            for path in ts_files:
+                with open(path, "rb") as f:
+                    out.write(f.read())
+        return True
+
+    monkeypatch.setattr(monitor_device, "aggregate_ts_files", aggregate)
+    stages = []
+    monkeypatch.setattr(
+        monitor_device,
+        "_delete_source_files",
+        lambda files: stages.append(manifest.lookup(files)[files[0]][0]),
+    )
+
+    assert monitor_device._finalize_output(
+        job, job.part_file, True, job.source_files, {}, manifest
+    )
+
+    assert calls == [([job.output_file, job.part_file], job.speedup_file)]
+    with open(job.output_file, "rb") as f:
+        assert f.read() == b"oldnew"
+    assert not (output_dir / f"{job.name}_part.ts").exists()
+    assert stages == [STAGE_DONE]
+
+
+def test_failed_append_keeps_output_and_sources(tmp_path, monkeypatch):
+    card = _card(tmp_path, ["20240101_120000_0.ts"])
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    job = _day_job(card, output_dir)
+    (output_dir / f"{job.name}.ts").write_bytes(b"old")
+    (output_dir / f"{job.name}_part.ts").write_bytes(b"new")
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr(monitor_device, "aggregate_ts_files", lambda *args: False)
+
+    assert not monitor_device._finalize_output(
+        job, job.part_file, True, job.source_files, {}, manifest
+    )
+
+    assert (output_dir / f"{job.name}_part.ts").exists()
+    with open(job.output_file, "rb") as f:
+        assert f.read() == b"old"
+    assert manifest.lookup(job.source_files) == {}
+    assert (card / "20240101_120000_0.ts").exists()
+
+
+def test_resumed_trip_keeps_its_output_name(tmp_path):
+    names = ["20240101_235800_0.ts", "20240101_235900_0.ts", "20240102_000000_0.ts"]
+    card = _card(tmp_path, names)
+    output_dir = tmp_path / "out"
+    cache = ProbeCache(str(tmp_path / "probe_cache.json"))
+    for name in names:
+        cache.put(str(card / name), {"duration": 60.0})
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite3"))
+    (trip,) = plan_trip_jobs(
+        str(card), str(output_dir), "front", timedelta(minutes=5), cache, manifest
+    )
+    assert trip.name == "20240101_235800_front"
+
+    # 前回の削除が先頭のセグメントだけで止まった
+    manifest.record(trip.source_files, trip.output_file, STAGE_DONE)
+    (card / names[0]).unlink()
+    (resumed,) = plan_trip_jobs(
+        str(card), str(output_dir), "front", timedelta(minutes=5), cache, manifest
+    )
+
+    assert resumed.name == "20240101_235800_front"
+    assert resumed.output_file == trip.output_file
+    assert resumed.date == "20240101"
@@ -0,0 +1,137 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import ts_convertor
+
+from lib import motion
+from lib.motion import SpeedSpan, plan_speed_spans, select_expression, window_scores
+
+
+def test_window_scores_use_keyframe_timestamps():
+    # キーフレームの間隔が一定でなくても、差は実際の時刻の窓に入る
+    times = np.array([0.0, 1.0, 2.0, 12.5, 13.0])
+    diffs = np.array([0.1, 0.2, 0.3, 0.05])
+    assert window_scores(times, diffs, duration=20.0) == [0.2, 0.3]
+
+
+def test_spans_are_placed_by_segment_durations(monkeypatch):
+    files = [f"20240101_1200{i:02d}_0.ts" for i in range(3)]
+    # フレーム数に丸めると 1 フレーム未満の誤差がセグメントごとに積み重なる長さ
+    durations = {path: 60.0166 for path in files}
+    monkeypatch.setattr(
+        motion,
+        "probe_files",
+        lambda paths: {path: {"duration": durations[path]} for path in paths},
+    )
+    moving = (np.arange(61.0), np.full(60, 0.1))
+    monkeypatch.setattr(motion, "score_files", lambda paths: {p: moving for p in paths})
+
+    kept, spans = plan_speed_spans(files)
+
+    assert kept == files
+    assert spans == [SpeedSpan(0.0, 1)]
+    monkeypatch.setattr(
+        motion,
+        "score_files",
+        lambda paths: {
+            p: (moving if i != 1 else (np.arange(61.0), np.zeros(60)))
+            for i, p in enumerate(paths)
+        },
+    )
+    kept, spans = plan_speed_spans(files)
+    # 静止したセグメントは前後1窓を残して落ち、境界はセグメントの長さを足した秒になる
+    assert [round(span.start, 4) for span in spans] == [0.0, 70.0166, 120.0166]
+    assert [span.multiplier for span in spans] == [1, 0, 1]
+
+
+def test_select_expression_matches_on_timestamps():
+    spans = [SpeedSpan(0.0, 1), SpeedSpan(70.0166, 0), SpeedSpan(110.0166, 2)]
+    assert select_expression(spans, 10) == (
+        "gte(t\\,0.000)*lt(t\\,70.017)*not(mod(n\\,10))"
+        "+gte(t\\,110.017)*not(mod(n\\,20))"
+    )
+
+
+def _ffmpeg_reads_mpegts() -> bool:
+    if shutil.which("ffmpeg") is None:
+        return False
+    probe = subprocess.run(
+        "ffmpeg -loglevel error -f lavfi -i color=size=16x16:duration=0.2 "
+        "-c:v mpeg2video -f mpegts - | ffmpeg -loglevel error -f mpegts -i - -f null -",
+        shell=True,
+        capture_output=True,
+    )
+    return probe.returncode == 0
+
+
+def _color_segment(path, color: str, seconds: float = 2.0, fps: int = 10):
+    # セグメントごとに PTS が (ドライブレコーダーと同じく) 1.4 秒付近から始まり直す
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"color=c={color}:size=64x48:rate={fps}:duration={seconds}",
+            "-c:v",
+            "mpeg2video",
+            "-g",
+            str(fps),
+            "-f",
+            "mpegts",
+            str(path),
+        ],
+        check=True,
+    )
+
+
+def _frame_colors(path) -> list[str]:
+    raw = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", str(path), "-vf", "scale=1:1"]
+        + ["-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    pixels = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+    return [("red", "green", "blue")[int(np.argmax(pixel))] for pixel in pixels]
+
+
+@pytest.mark.skipif(
+    not _ffmpeg_reads_mpegts(), reason="ffmpeg cannot read MPEG-TS here"
+)
+def test_adaptive_spans_select_frames_of_later_segments(tmp_path, monkeypatch):
+    colors = ["red", "lime", "blue"]
+    files = []
+    for i, color in enumerate(colors):
+        path = tmp_path / f"20240101_12000{i * 2}_0.ts"
+        _color_segment(path, color)
+        files.append(str(path))
+    # 2本目 (2〜4秒) だけを 2 フレームに1枚、3本目は全フレームを残す
+    spans = [SpeedSpan(0.0, 0), SpeedSpan(2.0, 2), SpeedSpan(4.0, 1)]
+    monkeypatch.setattr(
+        ts_convertor,
+        "_plan_adaptive_speed",
+        lambda ts_files, speed_factor, keyframe_step: (
+            ts_files,
+            select_expression(spans, 1),
+            10,
+        ),
+    )
+    output = tmp_path / "out.ts"
+
+    checksums = ts_convertor.concat_and_speed_up_ts_files(
+        files,
+        str(output),
+        speed_factor=1,
+        engine="reencode",
+        encoder="mpeg2video",
+        adaptive=True,
+    )
+
+    assert checksums is not None
+    assert _frame_colors(output) == ["green"] * 10 + ["blue"] * 20
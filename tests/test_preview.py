@@ -0,0 +1,130 @@
+import json
+import os
+
+from lib import preview
+from lib.preview import PreviewOutputs
+
+
+def _segments(tmp_path, names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"")
+        paths.append(str(path))
+    return paths
+
+
+def _encode(outputs: PreviewOutputs, sprites: int = 1):
+    # ffmpeg の代わりに、出力引数で決まる名前でスプライトを置く
+    outputs.output_args("[proxy]", "[sprite]")
+    for i in range(1, sprites + 1):
+        with open(outputs.sprite_pattern % i, "wb"):
+            pass
+
+
+def test_each_append_writes_a_new_numbered_piece(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        preview,
+        "probe_files",
+        lambda paths: {
+            p: {"duration": 60.0, "width": 1280, "height": 720} for p in paths
+        },
+    )
+    first = _segments(tmp_path, ["20240101_120000_0.ts", "20240101_120100_0.ts"])
+    second = _segments(tmp_path, ["20240101_130000_0.ts"])
+    preview_dir = str(tmp_path / "previews")
+
+    outputs = PreviewOutputs(preview_dir, "20240101_front", first, interval=10)
+    _encode(outputs)
+    outputs.write_index()
+    # 追記: 同じ出力名で開き直すと次の番号になる
+    appended = PreviewOutputs(preview_dir, "20240101_front", second, interval=10)
+    assert appended.piece == 1
+    assert appended.proxy_file.endswith("proxy_001.mp4")
+    _encode(appended)
+    appended.write_index()
+
+    with open(appended.index_path) as f:
+        index = json.load(f)
+    assert [piece["proxy"] for piece in index["pieces"]] == [
+        "proxy_000.mp4",
+        "proxy_001.mp4",
+    ]
+    assert [piece["sprites"] for piece in index["pieces"]] == [
+        ["thumbs_000_001.jpg"],
+        ["thumbs_001_001.jpg"],
+    ]
+    assert index["pieces"][1]["segments"] == ["20240101_130000_0.ts"]
+    # 1本目の 12 枚に 2本目の 6 枚が続く
+    assert len(index["thumbnails"]) == 18
+    assert index["thumbnails"][-1]["time"] == "2024-01-01T13:00:50"
+
+
+def test_index_places_thumbnails_on_sprite_tiles(tmp_path, monkeypatch):
+    durations = {"20240101_120000_0.ts": 95.0, "20240101_120135_0.ts": 1000.0}
+    monkeypatch.setattr(
+        preview,
+        "probe_files",
+        lambda paths: {
+            p: {
+                "duration": durations[os.path.basename(p)],
+                "width": 1280,
+                "height": 720,
+            }
+            for p in paths
+        },
+    )
+    files = _segments(tmp_path, list(durations))
+    outputs = PreviewOutputs(str(tmp_path / "previews"), "20240101_front", files, 10)
+    _encode(outputs, sprites=2)
+
+    outputs.write_index()
+
+    with open(outputs.index_path) as f:
+        index = json.load(f)
+    assert index["thumbnail_size"] == [160, 90]
+    assert (index["columns"], index["rows"], index["interval"]) == (10, 10, 10)
+    thumbnails = index["thumbnails"]
+    # 合計 1095 秒を 10 秒ごと
+    assert len(thumbnails) == 110
+    assert thumbnails[9] == {
+        "sprite": "thumbs_000_001.jpg",
+        "x": 1440,
+        "y": 0,
+        "segment": "20240101_120000_0.ts",
+        "offset": 90.0,
+        "time": "2024-01-01T12:01:30",
+    }
+    # 2 行目の先頭は 2 本目のセグメントの 5 秒目
+    assert thumbnails[10] == {
+        "sprite": "thumbs_000_001.jpg",
+        "x": 0,
+        "y": 90,
+        "segment": "20240101_120135_0.ts",
+        "offset": 5.0,
+        "time": "2024-01-01T12:01:40",
+    }
+    # 101 枚目から 2 枚目のスプライトの左上に戻る
+    assert [(t["sprite"], t["x"], t["y"]) for t in thumbnails[99:101]] == [
+        ("thumbs_000_001.jpg", 1440, 810),
+        ("thumbs_000_002.jpg", 0, 0),
+    ]
+    assert thumbnails[100]["offset"] == 905.0
+
+
+def test_thumbnails_are_limited_to_the_written_sprites(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        preview, "probe_files", lambda paths: {p: {"duration": 3600.0} for p in paths}
+    )
+    files = _segments(tmp_path, ["20240101_120000_0.ts"])
+    outputs = PreviewOutputs(str(tmp_path / "previews"), "20240101_front", files, 10)
+    _encode(outputs, sprites=1)
+
+    outputs.write_index()
+
+    with open(outputs.index_path) as f:
+        index = json.load(f)
+    # スプライト 1 枚に入る 100 枚まで。大きさが分からなければ y は決まらない
+    assert len(index["thumbnails"]) == 100
+    assert index["thumbnail_size"] == [160, None]
+    assert index["thumbnails"][-1]["y"] is None
@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+
+from lib import probe
+from lib.probe import PROBE_SCHEMA_VERSION, ProbeCache, _covers, probe_files
+
+
+@pytest.mark.parametrize(
+    "info, keyframe_packets, expected",
+    [
+        # キーフレームを調べないなら何でもよい
+        ({"duration": 60.0}, 0, True),
+        ({"duration": 60.0}, 600, False),
+        # 多く読んだ結果は少ない要求を満たすが、逆は満たさない
+        ({"keyframe_packets": 600}, 300, True),
+        ({"keyframe_packets": 300}, 600, False),
+        # ファイル全体を読んだ結果はどの要求も満たす
+        ({"keyframe_packets": None}, 600, True),
+        ({"keyframe_packets": 600}, None, False),
+        ({"keyframe_packets": None}, None, True),
+    ],
+)
+def test_covers(info, keyframe_packets, expected):
+    assert _covers(info, keyframe_packets) == expected
+
+
+def _probe_counter(monkeypatch) -> list:
+    probed = []
+
+    def run_ffprobe(path, keyframe_packets=0):
+        probed.append(path)
+        return {"duration": 60.0, "keyframe_packets": keyframe_packets}
+
+    monkeypatch.setattr(probe, "_run_ffprobe", run_ffprobe)
+    return probed
+
+
+def test_changed_file_is_probed_again(tmp_path, monkeypatch):
+    probed = _probe_counter(monkeypatch)
+    video = tmp_path / "20240101_120000_0.ts"
+    video.write_bytes(b"x" * 10)
+    cache_path = str(tmp_path / "probe_cache.json")
+
+    probe_files([str(video)], ProbeCache(cache_path))
+    # 保存したキャッシュを読み直しても ffprobe は起動しない
+    probe_files([str(video)], ProbeCache(cache_path))
+    assert probed == [str(video)]
+
+    # 追記でサイズが変わった
+    video.write_bytes(b"x" * 20)
+    probe_files([str(video)], ProbeCache(cache_path))
+    assert len(probed) == 2
+
+    # サイズは同じで更新時刻だけが変わった
+    stat = os.stat(video)
+    os.utime(video, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    probe_files([str(video)], ProbeCache(cache_path))
+    assert len(probed) == 3
+
+    # キャッシュより多くのキーフレームが必要になった
+    probe_files([str(video)], ProbeCache(cache_path), keyframe_packets=600)
+    assert len(probed) == 4
+
+
+def test_entries_of_an_older_schema_are_ignored(tmp_path):
+    video = tmp_path / "20240101_120000_0.ts"
+    video.write_bytes(b"x")
+    cache_path = tmp_path / "probe_cache.json"
+    cache = ProbeCache(str(cache_path))
+    cache.put(str(video), {"duration": 60.0})
+    cache.save()
+
+    entries = json.loads(cache_path.read_text())
+    entry = entries[os.path.abspath(video)]
+    assert entry["identity"]["version"] == PROBE_SCHEMA_VERSION
+    assert ProbeCache(str(cache_path)).get(str(video)) == {"duration": 60.0}
+
+    entry["identity"]["version"] = PROBE_SCHEMA_VERSION - 1
+    cache_path.write_text(json.dumps(entries))
+    assert ProbeCache(str(cache_path)).get(str(video)) is None
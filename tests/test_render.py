@@ -0,0 +1,36 @@
+import ffmpeg
+import pytest
+
+from lib import render
+from lib.render import RenderGraph, render_zoomed_video
+
+
+def test_graph_splits_one_decode_into_every_output(monkeypatch):
+    monkeypatch.setattr(
+        render, "probe_media", lambda path: {"width": 1920, "height": 1080}
+    )
+
+    command = (
+        RenderGraph(["a.ts", "b.ts"])
+        .speed_up(10)
+        .add_output("timelapse.mp4")
+        .add_output("zoomed.mp4", zoom_factor=0.5)
+        .compile()
+    )
+
+    assert command.count("-i") == 2
+    graph = command[command.index("-filter_complex") + 1]
+    assert "concat=a=0:n=2:v=1" in graph
+    assert "setpts=PTS/10" in graph
+    assert "split=2" in graph
+    # 中央の半分を切り抜く
+    assert "crop=960:540:480:270" in graph
+    assert "timelapse.mp4" in command and "zoomed.mp4" in command
+
+
+def test_failed_render_raises_ffmpeg_error(tmp_path, monkeypatch):
+    # 解像度が分からずズームできない
+    monkeypatch.setattr(render, "probe_media", lambda path: None)
+
+    with pytest.raises(ffmpeg.Error):
+        render_zoomed_video(str(tmp_path / "in.ts"), str(tmp_path / "out.mp4"))
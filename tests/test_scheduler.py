@@ -0,0 +1,122 @@
+import os
+import shutil
+import signal
+import threading
+import time
+
+import pytest
+
+import ts_convertor
+from lib.scheduler import JobScheduler
+
+
+def _interrupt_after(seconds: float) -> threading.Timer:
+    timer = threading.Timer(seconds, os.kill, (os.getpid(), signal.SIGINT))
+    timer.start()
+    return timer
+
+
+def test_sigint_cancels_queued_jobs_and_stops_running_ones():
+    started = []
+    stop = threading.Event()
+
+    def job(n):
+        started.append(n)
+        # 実行中の ffmpeg の代わり。on_interrupt で止まる
+        stop.wait(5)
+        return True
+
+    scheduler = JobScheduler(max_workers=2, on_interrupt=stop.set)
+    _interrupt_after(0.3)
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(list(range(8)), job)
+
+    assert time.monotonic() - start < 2
+    assert stop.is_set()
+    assert len(started) <= scheduler.max_workers
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_sigint_stops_running_ffmpeg():
+    results = []
+
+    def job(n):
+        result = ts_convertor.run_ffmpeg(
+            ["ffmpeg", "-re", "-f", "lavfi", "-i", "testsrc", "-f", "null", "-"]
+        )
+        results.append(result)
+        return result["returncode"] == 0
+
+    scheduler = JobScheduler(
+        max_workers=2,
+        on_interrupt=ts_convertor.shutdown_ffmpeg_runs,
+        on_start=ts_convertor.resume_ffmpeg_runs,
+    )
+    _interrupt_after(1.0)
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(list(range(8)), job)
+
+    assert time.monotonic() - start < ts_convertor.FFMPEG_KILL_GRACE_SECONDS
+    # 実行中だったジョブは取り消された結果を受け取り、キューのジョブは始まらない
+    deadline = time.monotonic() + 5
+    while len(results) < scheduler.max_workers and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert results and all(r["stopped"] == "cancelled" for r in results)
+    assert len(results) <= scheduler.max_workers
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_run_after_an_interrupt_starts_ffmpeg_again():
+    ts_convertor.shutdown_ffmpeg_runs()
+    scheduler = JobScheduler(
+        max_workers=1,
+        on_interrupt=ts_convertor.shutdown_ffmpeg_runs,
+        on_start=ts_convertor.resume_ffmpeg_runs,
+    )
+
+    results = scheduler.run(
+        [0], lambda n: ts_convertor.run_ffmpeg(["ffmpeg", "-version"])
+    )
+
+    assert results[0][1]["stopped"] is None
+    assert results[0][1]["returncode"] == 0
+
+
+def _space_scheduler(tmp_path, monkeypatch, free_bytes, **kwargs):
+    usage = shutil.disk_usage(tmp_path)
+    monkeypatch.setattr(
+        shutil, "disk_usage", lambda path: usage._replace(free=free_bytes)
+    )
+    return JobScheduler(max_workers=2, disk_path=str(tmp_path), **kwargs)
+
+
+def test_job_waiting_for_space_does_not_block_smaller_jobs(tmp_path, monkeypatch):
+    scheduler = _space_scheduler(
+        tmp_path, monkeypatch, 100, space_timeout=0.5, poll_interval=0.1
+    )
+    started = []
+
+    def job(size):
+        started.append(size)
+        time.sleep(0.05)
+        return True
+
+    results = scheduler.run([1000, 60, 60, 60], job, size_of=lambda size: size)
+
+    # 収まらないジョブがワーカーを塞がないので、小さいジョブは全部実行される
+    assert started == [60, 60, 60]
+    assert dict(results)[1000] is None
+    assert scheduler._reserved_bytes == 0
+
+
+def test_zero_space_timeout_skips_without_waiting(tmp_path, monkeypatch):
+    scheduler = _space_scheduler(
+        tmp_path, monkeypatch, 100, space_timeout=0, poll_interval=30
+    )
+    start = time.monotonic()
+    results = scheduler.run([1000], lambda size: True, size_of=lambda size: size)
+
+    assert results == [(1000, None)]
+    assert time.monotonic() - start < 1
@@ -0,0 +1,30 @@
+from datetime import date, datetime
+
+from model.movie_filename import MovieFilename
+from model.segment_catalog import build_catalog
+
+
+def test_catalog_and_movie_filename_agree_on_names(tmp_path):
+    names = [
+        "20240101_120000_0.ts",
+        "20240101_115900_0_extra.TS",
+        "20240101_120000_1.ts",
+        "20240101_1200_0.ts",  # 時刻の桁が足りない
+        "20240101_120000_0.mp4",
+        "notes.txt",
+    ]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+
+    catalog = build_catalog(str(tmp_path))
+
+    front = catalog[(date(2024, 1, 1), "0")]
+    assert [s.start for s in front] == [
+        datetime(2024, 1, 1, 11, 59),
+        datetime(2024, 1, 1, 12, 0),
+    ]
+    assert [s.camera_type for s in catalog[(date(2024, 1, 1), "1")]] == ["1"]
+    for segment in front:
+        movie = MovieFilename(segment.path)
+        assert movie.is_file_type("ts") and movie.is_front_camera()
+        assert movie.datetime == segment.start.strftime("%Y%m%d_%H%M%S")
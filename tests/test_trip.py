@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from model.segment_catalog import Segment
+from model.trip import split_trips
+
+
+def _segment(start: str) -> Segment:
+    start = datetime.strptime(start, "%Y%m%d_%H%M%S")
+    return Segment(f"{start:%Y%m%d_%H%M%S}_0.ts", start, "0", 0, 0)
+
+
+def _trip_names(trips) -> list[list[str]]:
+    return [[segment.path for segment in trip] for trip in trips]
+
+
+def test_trip_crossing_midnight_is_one_trip():
+    segments = [
+        _segment("20240101_235800"),
+        _segment("20240101_235900"),
+        _segment("20240102_000000"),
+        _segment("20240102_000100"),
+    ]
+    durations = {segment.path: 60.0 for segment in segments}
+
+    assert len(split_trips(segments, durations)) == 1
+
+
+def test_gap_of_exactly_max_gap_does_not_split():
+    segments = [
+        _segment("20240101_120000"),
+        # 前のセグメントの終わり (12:01) からちょうど 10 分
+        _segment("20240101_121100"),
+        # 前のセグメントの終わり (12:12) から 10 分 1 秒
+        _segment("20240101_122201"),
+    ]
+    durations = {segment.path: 60.0 for segment in segments}
+
+    assert _trip_names(split_trips(segments, durations)) == [
+        ["20240101_120000_0.ts", "20240101_121100_0.ts"],
+        ["20240101_122201_0.ts"],
+    ]
+
+
+def test_missing_duration_falls_back_to_default():
+    segments = [_segment("20240101_120000"), _segment("20240101_121030")]
+
+    # 長さが分からなければ 60 秒とみなすので、空白は 9 分 30 秒
+    assert len(split_trips(segments, {})) == 1
+    # probe に失敗して None が入っていても既定の長さを使う
+    assert len(split_trips(segments, {segments[0].path: None})) == 1
+    # 実際の長さが分かれば、それで空白を測る
+    assert len(split_trips(segments, {segments[0].path: 20.0})) == 2
@@ -0,0 +1,272 @@
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import ts_convertor
+from ts_convertor import choose_keyframe_step
+
+from lib import metrics
+from lib.metrics import MetricsRecorder
+
+
+@pytest.mark.parametrize(
+    "gop_size, speed_factor, exact, expected",
+    [
+        # GOP の倍数ならキーフレームだけで正確な倍率になる
+        (10, 10.0, True, 1),
+        (15, 30.0, True, 2),
+        # 倍数でなければ auto はフルデコードに戻し、keyframe は近い step を使う
+        (12, 30.0, True, None),
+        (12, 30.0, False, 2),
+        # GOP が倍率より長いと、キーフレームだけでは倍率が大きくなりすぎる
+        (30, 10.0, True, None),
+        (30, 10.0, False, None),
+        # GOP が分からない
+        (None, 10.0, False, None),
+    ],
+)
+def test_choose_keyframe_step(gop_size, speed_factor, exact, expected):
+    assert choose_keyframe_step(gop_size, speed_factor, exact) == expected
+
+
+@pytest.mark.parametrize(
+    "engine, gop_size, expected",
+    [("auto", 10, 1), ("auto", 4, None), ("keyframe", 4, 2), ("reencode", 10, None)],
+)
+def test_speed_engine_picks_keyframe_step(monkeypatch, engine, gop_size, expected):
+    monkeypatch.setattr(ts_convertor, "probe_gop_size", lambda path: gop_size)
+
+    assert ts_convertor._resolve_keyframe_step(engine, "in.ts", 10.0) == expected
+
+
+def test_hstack_composite_graph():
+    graph = ts_convertor._build_composite_graph(
+        "hstack", {"width": 1920, "height": 1080}, rear_offset=1.5
+    )
+
+    # 後から録画を始めたリアを遅らせ、フロントの高さに揃えて横に並べる
+    assert graph == (
+        "[0:v]setpts=PTS-STARTPTS[front];"
+        "[1:v]setpts=PTS-STARTPTS+1.5/TB,scale=-2:1080[rear];"
+        "[front][rear]hstack=inputs=2:shortest=1[stacked]"
+    )
+
+
+def test_pip_composite_graph():
+    graph = ts_convertor._build_composite_graph(
+        "pip", {"width": 1280, "height": 720}, rear_offset=-0.5
+    )
+
+    # リアは幅の 30% (偶数) に縮小して右下に重ねる
+    assert graph == (
+        "[0:v]setpts=PTS-STARTPTS+0.5/TB[front];"
+        "[1:v]setpts=PTS-STARTPTS,scale=384:-2[rear];"
+        "[front][rear]overlay=W-w-16:H-h-16:shortest=1[stacked]"
+    )
+    assert ts_convertor._build_composite_graph("grid", {"width": 1280}) is None
+
+
+def _ffmpeg_result(returncode: int = 0) -> dict:
+    return {
+        "returncode": returncode,
+        "stopped": None,
+        "stderr": "" if returncode == 0 else "Invalid data found",
+        "progress": {},
+        "fed": [],
+        "elapsed": 0.1,
+    }
+
+
+def test_concat_list_quotes_absolute_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = ["20240101_120000_0.ts", "my drive/it's 12.ts"]
+    (tmp_path / "my drive").mkdir()
+    for name in names:
+        (tmp_path / name).write_bytes(b"x")
+    lists = []
+
+    def run_ffmpeg(command, **kwargs):
+        list_file = command[command.index("-i") + 1]
+        with open(list_file) as f:
+            lists.append((list_file, f.read()))
+        return _ffmpeg_result()
+
+    monkeypatch.setattr(ts_convertor, "run_ffmpeg", run_ffmpeg)
+
+    assert ts_convertor.aggregate_ts_files(names, "out.ts")
+
+    list_file, content = lists[0]
+    # 相対パスはリストの場所ではなく作業ディレクトリから解決し、' はエスケープする
+    assert content == (
+        f"file '{tmp_path}/20240101_120000_0.ts'\n"
+        f"file '{tmp_path}/my drive/it'\\''s 12.ts'\n"
+    )
+    assert not os.path.exists(list_file)
+
+
+def test_failed_concat_removes_partial_output(tmp_path, monkeypatch):
+    segment = tmp_path / "20240101_120000_0.ts"
+    segment.write_bytes(b"x")
+    output = tmp_path / "out.ts"
+
+    def run_ffmpeg(command, **kwargs):
+        output.write_bytes(b"partial")
+        return _ffmpeg_result(returncode=1)
+
+    monkeypatch.setattr(ts_convertor, "run_ffmpeg", run_ffmpeg)
+
+    assert not ts_convertor.aggregate_ts_files([str(segment)], str(output))
+    assert not output.exists()
+    assert not ts_convertor.aggregate_ts_files([], str(output))
+
+
+def test_stream_segments_hash_in_the_same_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(ts_convertor, "STREAM_CHUNK_SIZE", 4)
+    contents = [b"first segment", b"second"]
+    files = []
+    for i, content in enumerate(contents):
+        path = tmp_path / f"20240101_12000{i}_0.ts"
+        path.write_bytes(content)
+        files.append(str(path))
+    reads = []
+
+    @contextlib.contextmanager
+    def read_slot():
+        reads.append(1)
+        yield
+
+    sink = io.BytesIO()
+    checksums = ts_convertor._stream_segments(files, sink, read_slot=read_slot)
+
+    assert sink.getvalue() == b"".join(contents)
+    assert checksums == {
+        path: hashlib.sha256(content).hexdigest()
+        for path, content in zip(files, contents)
+    }
+    # 4 バイトずつ読み、ファイルの終わりを確かめる読み出しも1回ずつある
+    assert len(reads) == 4 + 1 + 2 + 1
+
+    with pytest.raises(IOError, match="Checksum mismatch"):
+        ts_convertor._stream_segments(
+            files, io.BytesIO(), expected_checksums={files[1]: "0" * 64}
+        )
+
+
+def test_failed_stream_aggregation_removes_partial_output(tmp_path, monkeypatch):
+    segment = tmp_path / "20240101_120000_0.ts"
+    segment.write_bytes(b"x")
+    output = tmp_path / "out.ts"
+
+    def run_streaming_ffmpeg(command, ts_files, *args, **kwargs):
+        output.write_bytes(b"partial")
+        return None
+
+    monkeypatch.setattr(ts_convertor, "_run_streaming_ffmpeg", run_streaming_ffmpeg)
+
+    assert ts_convertor.stream_aggregate_ts_files([str(segment)], str(output)) is None
+    assert not output.exists()
+
+
+def _ffmpeg_reads_mpegts() -> bool:
+    if shutil.which("ffmpeg") is None:
+        return False
+    probe = subprocess.run(
+        "ffmpeg -loglevel error -f lavfi -i color=size=16x16:duration=0.2 "
+        "-c:v mpeg2video -f mpegts - | ffmpeg -loglevel error -f mpegts -i - -f null -",
+        shell=True,
+        capture_output=True,
+    )
+    return probe.returncode == 0
+
+
+def _frame_count(path) -> int:
+    raw = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", str(path), "-vf", "scale=1:1"]
+        + ["-f", "rawvideo", "-pix_fmt", "gray", "-"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    return len(raw)
+
+
+@pytest.mark.skipif(
+    not _ffmpeg_reads_mpegts(), reason="ffmpeg cannot read MPEG-TS here"
+)
+def test_streamed_and_concat_aggregation_agree(tmp_path):
+    files = []
+    for i, name in enumerate(["20240101_120000_0.ts", "it's a 20240101_120100_0.ts"]):
+        path = tmp_path / name
+        subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-f", "lavfi"]
+            + ["-i", f"testsrc=size=64x48:rate=10:duration={i + 1}"]
+            + ["-c:v", "mpeg2video", "-f", "mpegts", str(path)],
+            check=True,
+        )
+        files.append(str(path))
+    streamed = tmp_path / "streamed.ts"
+    concatenated = tmp_path / "concat.ts"
+
+    checksums = ts_convertor.stream_aggregate_ts_files(files, str(streamed))
+    assert ts_convertor.aggregate_ts_files(files, str(concatenated))
+
+    assert checksums == {
+        path: hashlib.sha256(open(path, "rb").read()).hexdigest() for path in files
+    }
+    # 1 秒 + 2 秒の 30 フレームが、どちらの方法でも1本につながる
+    assert _frame_count(streamed) == _frame_count(concatenated) == 30
+
+
+def test_fused_pipeline_runs_one_ffmpeg_on_the_streamed_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(ts_convertor, "available_encoders", lambda: ["libx264"])
+    monkeypatch.setattr(ts_convertor, "probe_gop_size", lambda path: 10)
+    recorder = MetricsRecorder()
+    monkeypatch.setattr(metrics, "_recorder", recorder)
+    files = []
+    for i in range(2):
+        path = tmp_path / f"20240101_12000{i}_0.ts"
+        path.write_bytes(b"x" * 100)
+        files.append(str(path))
+    output = tmp_path / "20240101_front_speedup.ts"
+    runs = []
+
+    def run_streaming_ffmpeg(command, ts_files, expected_checksums, **kwargs):
+        runs.append((command, ts_files, kwargs["stage"]))
+        output.write_bytes(b"y" * 20)
+        result = _ffmpeg_result()
+        result.update(
+            checksums={path: "sha" for path in ts_files},
+            progress={"frame": "12", "drop_frames": "108"},
+        )
+        return result
+
+    monkeypatch.setattr(ts_convertor, "_run_streaming_ffmpeg", run_streaming_ffmpeg)
+
+    checksums = ts_convertor.concat_and_speed_up_ts_files(
+        files, str(output), speed_factor=10.0
+    )
+
+    # 中間ファイルを作らず、1回の ffmpeg で標準入力から結合と速度変更を行う
+    assert checksums == {path: "sha" for path in files}
+    assert len(runs) == 1
+    command, streamed, stage = runs[0]
+    assert streamed == files
+    assert stage == "concat_speed_up"
+    assert command[command.index("-i") - 2 : command.index("-i") + 2] == [
+        "-f",
+        "mpegts",
+        "-i",
+        "pipe:0",
+    ]
+    # GOP と倍率が同じなのでキーフレームだけをデコードする
+    assert "nokey" in command
+    assert "[0:v]setpts=PTS/10.0[v]" in command[command.index("-filter_complex") + 1]
+    assert command[-1] == str(output)
+    # 処理量は入力バイト数とデコードしたフレーム数で記録する
+    exposition = recorder.render_prometheus()
+    assert 'drive_recorder_bytes_in_total{stage="concat_speed_up"} 200' in exposition
+    assert 'drive_recorder_frames_total{stage="concat_speed_up"} 120' in exposition
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from lib import upload_queue
+from lib.quota import UPLOAD_QUOTA_COST, QuotaTracker
+from lib.upload_queue import UploadQueue
+
+
+def _videos(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        paths.append(path)
+    return paths
+
+
+def _queue(tmp_path, videos, upload, budget=3 * UPLOAD_QUOTA_COST, **kwargs):
+    quota = QuotaTracker(str(tmp_path / "quota_state.json"), budget)
+    queue = UploadQueue(
+        str(tmp_path),
+        list_files=lambda: [str(v) for v in videos if v.exists()],
+        upload=upload,
+        quota=quota,
+        min_age_seconds=0,
+        poll_interval=0.05,
+        use_polling=True,
+        **kwargs,
+    )
+    return queue, quota
+
+
+def _run_until(queue, condition, timeout: float = 5.0):
+    stop = threading.Event()
+    thread = threading.Thread(target=queue.run, args=(stop,), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    # 条件を満たした後に余計なアップロードが起きないことも確かめる
+    time.sleep(0.2)
+    stop.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def _quota_exceeded() -> HttpError:
+    content = {"error": {"errors": [{"reason": "quotaExceeded"}]}}
+    return HttpError(Response({"status": 403}), json.dumps(content).encode())
+
+
+def test_failure_before_insert_does_not_spend_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_queue, "BACKOFF_BASE_SECONDS", 0.01)
+    attempts = []
+
+    def upload(video_file, on_insert):
+        attempts.append(video_file)
+        raise ConnectionError("network is unreachable")
+
+    videos = _videos(tmp_path, "20240101_front.ts")
+    queue, quota = _queue(tmp_path, videos, upload)
+    _run_until(queue, lambda: len(attempts) >= 5)
+
+    assert len(attempts) >= 5
+    assert quota.remaining() == quota.daily_budget
+
+
+def test_accepted_insert_spends_quota_even_if_the_upload_fails(tmp_path):
+    def upload(video_file, on_insert):
+        on_insert()
+        raise ConnectionError("connection reset while sending a chunk")
+
+    videos = _videos(tmp_path, "20240101_front.ts")
+    queue, quota = _queue(tmp_path, videos, upload)
+    _run_until(queue, lambda: quota.remaining() < quota.daily_budget)
+
+    # 失敗したファイルはバックオフ中なので、もう一度は予約しない
+    assert quota.remaining() == quota.daily_budget - UPLOAD_QUOTA_COST
+    # 再起動しても消費量は残る
+    restarted = QuotaTracker(quota.state_path, quota.daily_budget)
+    assert restarted.remaining() == quota.remaining()
+
+
+def test_quota_exceeded_pauses_the_queue(tmp_path):
+    attempts = []
+
+    def upload(video_file, on_insert):
+        attempts.append(video_file)
+        on_insert()
+        raise _quota_exceeded()
+
+    videos = _videos(tmp_path, "20240101_front.ts", "20240101_rear.ts")
+    queue, quota = _queue(tmp_path, videos, upload)
+    _run_until(queue, lambda: attempts)
+
+    # 2本目は (バックオフではなく) リセットまで止まるので試さない
+    assert len(attempts) == 1
+    assert quota.remaining() == 0
+
+
+def test_reservation_of_a_running_upload_does_not_pause_the_queue(tmp_path):
+    release = threading.Event()
+    uploaded = []
+
+    def upload(video_file, on_insert):
+        # 1本目は重複としてアップロードせずに終わり、予約を返す
+        release.wait(5)
+        uploaded.append(video_file)
+        os.remove(video_file)
+
+    videos = _videos(tmp_path, "20240101_front.ts", "20240101_rear.ts")
+    queue, quota = _queue(tmp_path, videos, upload, budget=UPLOAD_QUOTA_COST, workers=2)
+    threading.Timer(0.3, release.set).start()
+    _run_until(queue, lambda: len(uploaded) == 2)
+
+    assert sorted(uploaded) == sorted(str(v) for v in videos)
+    assert quota.remaining() == UPLOAD_QUOTA_COST
+
+
+def test_interrupted_uploads_are_resumed_first(tmp_path):
+    uploaded = []
+
+    def upload(video_file, on_insert):
+        uploaded.append(video_file)
+        os.remove(video_file)
+
+    staged = tmp_path / "uploading"
+    staged.mkdir()
+    old, new = _videos(tmp_path, "20240101_front.ts", "uploading/20240102_front.ts")
+    # 中断したアップロードの方が新しくても先にする
+    queue, _ = _queue(
+        tmp_path,
+        [old, new],
+        upload,
+        resume_first=lambda video_file: "/uploading/" in video_file,
+    )
+    _run_until(queue, lambda: len(uploaded) == 2)
+
+    assert uploaded == [str(new), str(old)]
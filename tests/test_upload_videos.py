@@ -0,0 +1,57 @@
+import os
+
+import upload_videos
+
+
+def test_output_appended_during_upload_is_not_archived(tmp_path, monkeypatch):
+    output_dir = tmp_path / "output"
+    archive_dir = tmp_path / "archive"
+    output_dir.mkdir()
+    video_file = output_dir / "20240101_front.ts"
+    video_file.write_bytes(b"first trip")
+    uploaded = []
+
+    def upload(youtube, path, title, description, **kwargs):
+        uploaded.append(open(path, "rb").read())
+        # アップロード中に取り込みが同じ出力へ追記する (_finalize_output の os.replace)
+        appended = output_dir / "20240101_front_speedup.ts"
+        appended.write_bytes(b"first trip + second trip")
+        os.replace(appended, video_file)
+        return "video123"
+
+    monkeypatch.setattr(upload_videos, "upload_video_to_youtube", upload)
+    upload_videos.upload_and_archive(str(video_file), None, str(archive_dir))
+
+    assert uploaded == [b"first trip"]
+    assert (archive_dir / "20240101_front.ts").read_bytes() == b"first trip"
+    # 追記された出力は残り、次のアップロード対象になる
+    assert upload_videos.list_upload_candidates(str(output_dir)) == [str(video_file)]
+
+
+def test_interrupted_upload_is_listed_from_the_staging_directory(tmp_path):
+    staged = tmp_path / upload_videos.UPLOADING_DIR / "20240101_rear.ts"
+    staged.parent.mkdir()
+    staged.write_bytes(b"rear")
+
+    assert upload_videos.list_upload_candidates(str(tmp_path)) == [str(staged)]
+    assert upload_videos.stage_for_upload(str(staged)) == str(staged)
+
+
+def test_archive_does_not_overwrite_an_existing_file(tmp_path):
+    archive_dir = tmp_path / "archive"
+    archive_dir.mkdir()
+    (archive_dir / "20240101_front.ts").write_bytes(b"first upload")
+    (archive_dir / "20240101_front_1.ts").write_bytes(b"second upload")
+
+    archived = upload_videos.archive_path_for(
+        str(archive_dir), str(tmp_path / "uploading" / "20240101_front.ts")
+    )
+
+    assert archived == str(archive_dir / "20240101_front_2.ts")
+
+
+def test_staged_files_are_resumed_first(tmp_path):
+    staged = os.path.join(str(tmp_path), upload_videos.UPLOADING_DIR, "a.ts")
+
+    assert upload_videos.is_staged(staged)
+    assert not upload_videos.is_staged(str(tmp_path / "a.ts"))
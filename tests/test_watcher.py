@@ -0,0 +1,115 @@
+import shutil
+import threading
+import time
+
+from lib.watcher import VolumeWatcher
+
+
+def _wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def _mount(volume):
+    volume.mkdir(parents=True, exist_ok=True)
+    (volume / "DCIM").mkdir(exist_ok=True)
+
+
+def _start(watcher):
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,), daemon=True)
+    thread.start()
+    return stop, thread
+
+
+def _exercise_mount_cycle(tmp_path, use_polling):
+    mounted = []
+    volume = tmp_path / "media" / "DRIVE"
+    watcher = VolumeWatcher(
+        str(tmp_path / "media"),
+        "DRIVE",
+        mounted.append,
+        settle_seconds=0.2,
+        poll_interval=0.1,
+        use_polling=use_polling,
+    )
+    (tmp_path / "media").mkdir(exist_ok=True)
+    stop, thread = _start(watcher)
+    try:
+        _mount(volume)
+        assert _wait_until(lambda: mounted == [str(volume)])
+        assert watcher.use_polling == use_polling
+
+        shutil.rmtree(volume)
+        assert _wait_until(lambda: not watcher._mounted)
+        _mount(volume)
+        assert _wait_until(lambda: len(mounted) == 2)
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_mount_and_remount_with_inotify(tmp_path):
+    _exercise_mount_cycle(tmp_path, use_polling=False)
+
+
+def test_mount_and_remount_with_polling(tmp_path):
+    _exercise_mount_cycle(tmp_path, use_polling=True)
+
+
+def test_missing_mount_directory_falls_back_to_polling(tmp_path):
+    mounted = []
+    volume = tmp_path / "media" / "DRIVE"
+    watcher = VolumeWatcher(
+        str(tmp_path / "media"),
+        "DRIVE",
+        mounted.append,
+        settle_seconds=0.2,
+        poll_interval=0.1,
+    )
+    stop, thread = _start(watcher)
+    try:
+        assert _wait_until(lambda: watcher.use_polling)
+        # 監視ディレクトリが後から作られても、ポーリングでマウントを見つける
+        _mount(volume)
+        assert _wait_until(lambda: mounted == [str(volume)])
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+
+def test_burst_of_events_is_debounced(tmp_path):
+    watcher = VolumeWatcher(
+        str(tmp_path), "DRIVE", lambda path: None, settle_seconds=0.3
+    )
+    stop = threading.Event()
+
+    def burst():
+        # マウント直後のように 0.1 秒おきにイベントが続く
+        for _ in range(5):
+            watcher._changed.set()
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=burst)
+    start = time.monotonic()
+    thread.start()
+    assert watcher._wait_for_change(stop)
+    elapsed = time.monotonic() - start
+    thread.join()
+
+    # 最後のイベントから settle_seconds 経つまで判定しない
+    assert elapsed >= 0.4 + watcher.settle_seconds
+
+
+def test_stop_event_ends_the_wait(tmp_path):
+    watcher = VolumeWatcher(
+        str(tmp_path), "DRIVE", lambda path: None, poll_interval=0.1
+    )
+    stop = threading.Event()
+    stop.set()
+    assert watcher._wait_for_change(stop) is False
@@ -0,0 +1,166 @@
+import json
+import re
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+import pytest
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from lib.upload_state import UploadStateStore
+from youtube_uploader import upload_video_to_youtube
+
+CHUNKSIZE = 256 * 1024
+
+
+class FakeUploadServer(ThreadingHTTPServer):
+    """
+    YouTube の再開可能アップロードのエンドポイントを真似るサーバー。
+    drop_from_chunk 番目 (1始まり) 以降のチャンクは、受信・保存したうえで応答せずに接続を切る
+    (応答が失われた中断を再現する)。expired_path へのリクエストには 404 を返す。
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeUploadHandler)
+        self.received = bytearray()
+        self.chunk_starts = []
+        self.sessions_started = 0
+        self.drop_from_chunk = None
+        self.expired_path = None
+
+    @property
+    def root_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class FakeUploadHandler(BaseHTTPRequestHandler):
+    # httplib2 は切断されたリクエストを1回だけ送り直すが、チャンクのストリームは読み終わっているため
+    # 本文が届かない。実際のサーバーと同じく、待たずにタイムアウトさせる
+    timeout = 1
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, status: int, headers: dict = None, body: bytes = b""):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _progress_reply(self, total: int):
+        received = len(self.server.received)
+        if received == total:
+            self._reply(200, body=json.dumps({"id": "video123"}).encode())
+        elif received:
+            self._reply(308, {"Range": f"bytes=0-{received - 1}"})
+        else:
+            self._reply(308)
+
+    def do_POST(self):
+        self._body()
+        self.server.sessions_started += 1
+        self.server.received = bytearray()
+        self._reply(200, {"Location": f"{self.server.root_url}session/1"})
+
+    def do_PUT(self):
+        body = self._body()
+        if self.path == self.server.expired_path:
+            self._reply(404)
+            return
+        content_range = self.headers["Content-Range"]
+        query = re.fullmatch(r"bytes \*/(\d+)", content_range)
+        if query:
+            self._progress_reply(int(query.group(1)))
+            return
+        start, _, total = map(
+            int, re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", content_range).groups()
+        )
+        assert start <= len(self.server.received), "gap in the uploaded bytes"
+        self.server.chunk_starts.append(start)
+        self.server.received[start:] = body
+        drop_from = self.server.drop_from_chunk
+        if drop_from is not None and len(self.server.chunk_starts) >= drop_from:
+            # 受信したが応答は返さない
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self._progress_reply(total)
+
+
+@pytest.fixture
+def server():
+    server = FakeUploadServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def youtube(server):
+    document = json.loads(get_static_doc("youtube", "v3"))
+    document["rootUrl"] = server.root_url
+    return build_from_document(json.dumps(document), http=httplib2.Http())
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    path = tmp_path / "20240101_front.ts"
+    path.write_bytes(bytes(range(256)) * (5 * CHUNKSIZE // 256 + 100))
+    return str(path)
+
+
+def _upload(youtube, video_file, state_store):
+    return upload_video_to_youtube(
+        youtube,
+        video_file,
+        "title",
+        "description",
+        chunksize=CHUNKSIZE,
+        state_store=state_store,
+    )
+
+
+def test_interrupted_upload_resumes_from_the_server_offset(
+    server, youtube, video_file, tmp_path
+):
+    state_store = UploadStateStore(str(tmp_path / "upload_state.json"))
+    original = open(video_file, "rb").read()
+
+    # 2チャンク目は保存されるが応答が返らない。状態ファイルには1チャンク目までしか残らない
+    server.drop_from_chunk = 2
+    with pytest.raises(Exception):
+        _upload(youtube, video_file, state_store)
+    saved = state_store.get(video_file)
+    assert saved["progress"] == CHUNKSIZE
+    assert len(server.received) > saved["progress"]
+
+    # 再起動後: 保存済みのセッションに問い合わせ、サーバーが受信した位置から続ける
+    server.drop_from_chunk = None
+    resumed_from = len(server.received)
+    starts_before = len(server.chunk_starts)
+    state_store = UploadStateStore(str(tmp_path / "upload_state.json"))
+    assert _upload(youtube, video_file, state_store) == "video123"
+
+    assert server.sessions_started == 1
+    assert server.chunk_starts[starts_before] == resumed_from
+    assert bytes(server.received) == original
+    assert state_store.get(video_file) is None
+
+
+def test_expired_session_restarts_the_upload(server, youtube, video_file, tmp_path):
+    state_store = UploadStateStore(str(tmp_path / "upload_state.json"))
+    state_store.update(video_file, f"{server.root_url}session/old", CHUNKSIZE)
+    server.expired_path = "/session/old"
+
+    assert _upload(youtube, video_file, state_store) == "video123"
+    assert server.sessions_started == 1
+    assert server.chunk_starts[0] == 0
+    assert bytes(server.received) == open(video_file, "rb").read()
@@ -1,25 +1,172 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import os
+import tempfile
+import threading
+import time
 from loguru import logger
 import subprocess
 
+from lib import metrics
+from lib.motion import plan_speed_spans, select_expression
+from lib.preview import PreviewOutputs
+from lib.probe import KEYFRAME_PROBE_PACKETS, probe_media
 
-def aggregate_ts_files(ts_files: list, output_file: str):
+# Size of one read from the SD card (large, to keep the number of seeks low)
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Only the tail of ffmpeg's stderr is kept for the error log, so memory stays
+# bounded however much a long run prints.
+FFMPEG_STDERR_TAIL = 64 * 1024
+# An ffmpeg run that prints no progress for this long is considered hung.
+FFMPEG_STALL_SECONDS = 600.0
+# Seconds ffmpeg gets to exit after SIGTERM before it is killed.
+FFMPEG_KILL_GRACE_SECONDS = 10.0
+
+# Video encoder profiles, in order of preference (fastest first).
+# "global_args" go before the input, "filter" is appended to the video filter
+# chain and "args" are the output options for the encoder.
+ENCODER_PROFILES = {
+    # macOS
+    "h264_videotoolbox": {"args": ["-c:v", "h264_videotoolbox", "-realtime", "1"]},
+    # Linux: Intel/AMD via VA-API
+    "h264_vaapi": {
+        "global_args": ["-vaapi_device", "/dev/dri/renderD128"],
+        "filter": "format=nv12,hwupload",
+        "args": ["-c:v", "h264_vaapi"],
+    },
+    # Intel Quick Sync
+    "h264_qsv": {"args": ["-c:v", "h264_qsv", "-preset", "veryfast"]},
+    # NVIDIA
+    "h264_nvenc": {"args": ["-c:v", "h264_nvenc", "-preset", "p1"]},
+    # Software
+    "libx264": {"args": ["-c:v", "libx264", "-preset", "ultrafast"]},
+    "libx265": {"args": ["-c:v", "libx265", "-preset", "ultrafast"]},
+}
+SOFTWARE_ENCODERS = ("libx264", "libx265")
+
+# Layouts for composite_and_speed_up_ts_files
+COMPOSITE_LAYOUTS = ("hstack", "pip")
+# Width of the rear inset relative to the front frame in the "pip" layout
+PIP_SCALE = 0.3
+PIP_MARGIN = 16
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders() -> tuple:
+    """
+    Returns the encoders from ENCODER_PROFILES that this machine can use.
+    `ffmpeg -encoders` only lists what ffmpeg was built with, so hardware
+    encoders are additionally checked with a one-frame test encode.
+    The result is cached for the lifetime of the process.
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except Exception as e:
+        logger.error(f"Could not list ffmpeg encoders: {e}")
+        return ()
+
+    built = {
+        parts[1]
+        for parts in (line.split() for line in result.stdout.splitlines())
+        if len(parts) >= 2 and parts[0].startswith("V")
+    }
+    usable = tuple(
+        name
+        for name in ENCODER_PROFILES
+        if name in built and (name in SOFTWARE_ENCODERS or _encoder_works(name))
+    )
+    logger.info(f"Available video encoders: {', '.join(usable) or 'none'}")
+    return usable
+
+
+def _encoder_works(encoder: str) -> bool:
+    """Encodes a single black frame to check that the hardware is really there."""
+    profile = ENCODER_PROFILES[encoder]
+    video_filter = ",".join(filter(None, ["format=yuv420p", profile.get("filter")]))
+    command = (
+        ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+        + profile.get("global_args", [])
+        + ["-f", "lavfi", "-i", "color=black:size=256x256:duration=0.1"]
+        + ["-frames:v", "1", "-vf", video_filter]
+        + profile["args"]
+        + ["-f", "null", "-"]
+    )
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30
+        )
+    except Exception:
+        return False
+    return result.returncode == 0
+
+
+def select_encoder(preferred: str | None = None) -> str:
+    """
+    Picks the video encoder to use.
+
+    :param preferred: Encoder requested by the user (e.g. "libx264"). "auto" or
+                      None picks the fastest available one.
+    """
+    encoders = available_encoders()
+    if preferred and preferred != "auto":
+        if preferred in encoders:
+            return preferred
+        logger.warning(
+            f"Requested encoder {preferred} is not available; selecting automatically."
+        )
+    if encoders:
+        return encoders[0]
+    # Let ffmpeg report the problem rather than failing before it runs
+    logger.warning("No usable video encoder detected; defaulting to libx264.")
+    return "libx264"
+
+
+def _encoder_global_args(encoder: str) -> list:
+    """Options that have to be placed before the input (e.g. the VA-API device)."""
+    return list(ENCODER_PROFILES.get(encoder, {}).get("global_args", []))
+
+
+def aggregate_ts_files(ts_files: list, output_file: str) -> bool:
+    """
+    Concatenates TS files with ffmpeg's concat demuxer.
+    The list file is created per call in the private temp directory, so any
+    number of aggregations can run at once, from threads or from processes
+    started in the same working directory.
+
+    :param ts_files: Ordered list of TS files to concatenate.
+    :param output_file: Path to the aggregated TS file.
+    :return: True if the output was created.
+    """
     if not ts_files:
         logger.warning("No TS files to aggregate.")
-        return
+        return False
 
-    # Create a temporary file list for ffmpeg
-    list_file_path = "file_list.txt"
-    with open(list_file_path, "w") as f_list:
+    # Create a temporary file list for ffmpeg. Paths in the list are resolved
+    # relative to the list file, so they must be absolute.
+    with tempfile.NamedTemporaryFile(
+        "w", prefix="concat_", suffix=".txt", delete=False
+    ) as f_list:
+        list_file_path = f_list.name
         for ts_file in ts_files:
             # ffmpeg requires paths to be properly escaped
-            escaped_path = ts_file.replace("'", r"'\''")
+            escaped_path = os.path.abspath(ts_file).replace("'", r"'\''")
             f_list.write(f"file '{escaped_path}'\n")
 
     try:
         # Use ffmpeg to concatenate ts files
         command = [
             "ffmpeg",
+            "-nostdin",
+            "-y",
             "-f",
             "concat",
             "-safe",
@@ -31,77 +178,712 @@ def aggregate_ts_files(ts_files: list, output_file: str):
             output_file,
         ]
         logger.info(f"Running command: {' '.join(command)}")
-        result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
+        with metrics.stage("concat", output=output_file) as fields:
+            result = run_ffmpeg(command, stage="concat")
+            _record_file_sizes(fields, ts_files, output_file, result["returncode"])
 
-        if result.returncode != 0:
-            logger.error(f"ffmpeg failed with error: {result.stderr}")
-        else:
-            logger.info(f"Successfully created {output_file}")
+        if result["returncode"] != 0:
+            logger.error(f"ffmpeg failed with error: {_ffmpeg_failure(result)}")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            return False
+        logger.info(f"Successfully created {output_file}")
+        return True
     except Exception as e:
         logger.error(f"Exception during ffmpeg execution: {e}")
+        return False
     finally:
         # Clean up the temporary file list
         if os.path.exists(list_file_path):
             os.remove(list_file_path)
 
 
-def speed_up_ts_file(
-    input_file: str,
-    output_file: str,
-    speed_factor: float = 10.0,
-    disable_audio: bool = True,
+def _record_file_sizes(
+    fields: dict, inputs: list, output_file: str, returncode: int | None
+):
+    """Adds the input and output sizes to the metrics of a stage run with run_ffmpeg."""
+    fields["status"] = "ok" if returncode == 0 else "error"
+    fields["bytes_in"] = sum(os.path.getsize(f) for f in inputs if os.path.exists(f))
+    if os.path.exists(output_file):
+        fields["bytes_out"] = os.path.getsize(output_file)
+
+
+class _FFmpegStalled(Exception):
+    pass
+
+
+# Limits applied to every ffmpeg run (see set_ffmpeg_timeouts)
+_ffmpeg_timeout = None
+_ffmpeg_stall_seconds = FFMPEG_STALL_SECONDS
+_loop = None
+_loop_lock = threading.Lock()
+_active_runs = set()
+_shutting_down = False
+
+
+def set_ffmpeg_timeouts(
+    timeout: float | None = None, stall_seconds: float | None = FFMPEG_STALL_SECONDS
 ):
     """
-    Speeds up a TS file by the given speed factor, utilizing hardware acceleration.
-    Optionally disables audio to speed up the process.
+    Sets the default limits of every ffmpeg run in this process.
 
-    :param input_file: Path to the input TS file.
-    :param output_file: Path to the output speedup TS file.
-    :param speed_factor: Factor by which to speed up the video.
-    :param disable_audio: If True, audio stream will be disabled to speed up processing.
+    :param timeout: Maximum wall time of one ffmpeg run in seconds (None: no limit).
+    :param stall_seconds: Stop ffmpeg when it reports no progress for this
+        many seconds (None: never).
     """
-    if not os.path.exists(input_file):
-        logger.error(f"Input file does not exist: {input_file}")
-        return
+    global _ffmpeg_timeout, _ffmpeg_stall_seconds
+    _ffmpeg_timeout = timeout
+    _ffmpeg_stall_seconds = stall_seconds
+
+
+def ffmpeg_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop that supervises the ffmpeg processes started from
+    synchronous code, starting it on a daemon thread on first use. All worker
+    threads share this one loop; asyncio code (e.g. ingest and upload loops
+    running side by side) can schedule its own coroutines on it with
+    asyncio.run_coroutine_threadsafe, or await run_ffmpeg_async directly.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="ffmpeg-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def _in_thread(function) -> asyncio.Future:
+    """
+    Runs a blocking callable on a thread of its own. The loop's default
+    executor is bounded, and a feeder waiting there for a free thread would
+    stall the ffmpeg that reads from it.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        try:
+            result, error = function(), None
+        except Exception as e:
+            result, error = None, e
+        loop.call_soon_threadsafe(settle, result, error)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+async def _stop_process(process: asyncio.subprocess.Process):
+    """SIGTERM lets ffmpeg close its outputs; SIGKILL if it does not exit in time."""
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), FFMPEG_KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def run_ffmpeg_async(
+    command: list,
+    stage: str = "ffmpeg",
+    timeout: float | None = None,
+    stall_seconds: float | None = None,
+    stdin: int | None = None,
+    pass_fds: tuple = (),
+    feeders: list = (),
+) -> dict:
+    """
+    Runs ffmpeg without blocking the event loop. `-progress` output is parsed
+    line by line as it arrives, each block updating the live fps/speed metrics
+    of the given stage, and only the last FFMPEG_STDERR_TAIL bytes of stderr
+    are kept.
+
+    ffmpeg is stopped (SIGTERM, then SIGKILL after FFMPEG_KILL_GRACE_SECONDS)
+    when it runs longer than timeout, reports no progress for stall_seconds,
+    or the awaiting task is cancelled. Cancellation is re-raised once the
+    process has exited.
+
+    :param timeout: Maximum wall time in seconds; None uses the process default
+        (set_ffmpeg_timeouts).
+    :param stall_seconds: Seconds without progress before ffmpeg is considered
+        hung; None uses the process default.
+    :param stdin: File descriptor to use as ffmpeg's stdin (default: /dev/null).
+    :param pass_fds: Further descriptors the command reads as `pipe:<fd>`.
+        stdin and pass_fds are closed in this process once ffmpeg has started.
+    :param feeders: Blocking callables run on their own threads while ffmpeg
+        runs, e.g. writing segments into its input pipes.
+    :return: dict with "returncode" (None when ffmpeg was stopped), "stopped"
+        (why it was stopped, or None), "stderr" (tail), "progress" (last
+        progress block), "fed" (feeder results, None for one that raised or
+        did not finish) and "elapsed".
+    :raises OSError: When ffmpeg cannot be started.
+    """
+    timeout = _ffmpeg_timeout if timeout is None else timeout
+    stall_seconds = _ffmpeg_stall_seconds if stall_seconds is None else stall_seconds
+    command = command[:1] + ["-nostats", "-progress", "pipe:1"] + command[1:]
+    start_time = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=subprocess.DEVNULL if stdin is None else stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+        )
+    finally:
+        # The child holds its own copies
+        for fd in ([] if stdin is None else [stdin]) + list(pass_fds):
+            os.close(fd)
+
+    feeding = [_in_thread(feeder) for feeder in feeders]
+    stderr_tail = bytearray()
+    progress = {}
+
+    async def read_progress():
+        nonlocal progress
+        block = {}
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), stall_seconds)
+            except asyncio.TimeoutError:
+                raise _FFmpegStalled from None
+            if not line:
+                return
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if not key:
+                continue
+            block[key] = value
+            if key == "progress":
+                progress = block
+                metrics.progress(stage, progress)
+                block = {}
+
+    async def read_stderr():
+        while chunk := await process.stderr.read(FFMPEG_STDERR_TAIL):
+            stderr_tail.extend(chunk)
+            del stderr_tail[:-FFMPEG_STDERR_TAIL]
+
+    readers = [
+        asyncio.ensure_future(reader) for reader in (read_progress(), read_stderr())
+    ]
+    stopped = None
+    try:
+        await asyncio.wait_for(asyncio.gather(*readers, process.wait()), timeout)
+    except asyncio.TimeoutError:
+        stopped = f"timed out after {timeout:g} seconds"
+    except _FFmpegStalled:
+        stopped = f"no progress for {stall_seconds:g} seconds"
+    finally:
+        # Also runs on cancellation: never leave ffmpeg behind
+        if process.returncode is None:
+            await _stop_process(process)
+        for reader in readers:
+            reader.cancel()
+    if stopped:
+        logger.error(f"Stopped ffmpeg ({stage}): {stopped}")
+
+    # ffmpeg has exited, so the feeders are done or about to fail on the
+    # closed pipe; one stuck on a hung card is given up on.
+    if feeding:
+        await asyncio.wait(feeding, timeout=FFMPEG_KILL_GRACE_SECONDS)
+    fed = [f.result() if f.done() and f.exception() is None else None for f in feeding]
+    return {
+        "returncode": None if stopped else process.returncode,
+        "stopped": stopped,
+        "stderr": stderr_tail.decode(errors="replace"),
+        "progress": progress,
+        "fed": fed,
+        "elapsed": time.perf_counter() - start_time,
+    }
+
+
+def run_ffmpeg(command: list, **kwargs) -> dict:
+    """
+    Runs run_ffmpeg_async on the shared loop (ffmpeg_event_loop) and waits for
+    the result; see run_ffmpeg_async for the arguments. A run cancelled by
+    shutdown_ffmpeg_runs returns with "stopped" set. If the calling thread is
+    interrupted, ffmpeg is stopped before the exception propagates.
+    """
+    finished = threading.Event()
+
+    async def supervised():
+        current = asyncio.current_task()
+        _active_runs.add(current)
+        try:
+            return await run_ffmpeg_async(command, **kwargs)
+        finally:
+            _active_runs.discard(current)
+            finished.set()
+
+    cancelled = {
+        "returncode": None,
+        "stopped": "cancelled",
+        "stderr": "",
+        "progress": {},
+        "fed": [],
+        "elapsed": 0.0,
+    }
+    if _shutting_down:
+        return cancelled
+    future = asyncio.run_coroutine_threadsafe(supervised(), ffmpeg_event_loop())
+    try:
+        return future.result()
+    except concurrent.futures.CancelledError:
+        return cancelled
+    except BaseException:
+        future.cancel()
+        finished.wait(FFMPEG_KILL_GRACE_SECONDS + 5)
+        raise
+
+
+def shutdown_ffmpeg_runs(timeout: float = FFMPEG_KILL_GRACE_SECONDS + 5) -> int:
+    """
+    Stops every ffmpeg started through run_ffmpeg and refuses new ones, so
+    that no ffmpeg outlives the process. Their callers see a failed run and
+    remove the partial outputs.
+
+    :return: Number of runs that were cancelled.
+    """
+    global _shutting_down
+    _shutting_down = True
+    if _loop is None:
+        return 0
+
+    async def cancel_all():
+        runs = list(_active_runs)
+        for run in runs:
+            run.cancel()
+        await asyncio.gather(*runs, return_exceptions=True)
+        return len(runs)
+
+    try:
+        return asyncio.run_coroutine_threadsafe(cancel_all(), _loop).result(timeout)
+    except concurrent.futures.TimeoutError:
+        logger.warning("Timed out waiting for ffmpeg processes to stop.")
+        return 0
+
+
+def resume_ffmpeg_runs():
+    """
+    Accepts new ffmpeg runs again after shutdown_ffmpeg_runs. Called when a
+    scheduler run starts, so an interrupted run does not cancel the next one.
+    """
+    global _shutting_down
+    _shutting_down = False
+
+
+def _ffmpeg_failure(result: dict) -> str:
+    if result["stopped"]:
+        return f"{result['stopped']}; last output: {result['stderr'].strip()[-2000:]}"
+    return result["stderr"]
+
+
+def _stream_segments(
+    ts_files: list, sink, expected_checksums: dict = None, read_slot=None
+) -> dict:
+    """
+    Writes each segment to sink exactly once, hashing the bytes in the same pass.
+    Raises IOError when a segment is truncated, changes while being read, or
+    does not match its expected checksum.
+
+    :param read_slot: Optional context manager factory held around each read
+        from the source only, not while waiting for ffmpeg to take the data.
+    """
+    read_slot = read_slot or contextlib.nullcontext
+    checksums = {}
+    buffer = bytearray(STREAM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    for ts_file in ts_files:
+        stat_before = os.stat(ts_file)
+        digest = hashlib.sha256()
+        read_size = 0
+        with open(ts_file, "rb", buffering=0) as src:
+            while True:
+                with read_slot():
+                    n = src.readinto(buffer)
+                if not n:
+                    break
+                chunk = view[:n]
+                digest.update(chunk)
+                sink.write(chunk)
+                read_size += n
+        stat_after = os.stat(ts_file)
+
+        if read_size != stat_before.st_size or (
+            stat_after.st_size,
+            stat_after.st_mtime_ns,
+        ) != (stat_before.st_size, stat_before.st_mtime_ns):
+            raise IOError(
+                f"Segment changed or was truncated while reading: {ts_file} "
+                f"(read {read_size} of {stat_before.st_size} bytes)"
+            )
+
+        checksum = digest.hexdigest()
+        if expected_checksums and expected_checksums.get(ts_file) not in (
+            None,
+            checksum,
+        ):
+            raise IOError(f"Checksum mismatch for {ts_file}")
+        checksums[ts_file] = checksum
+    return checksums
+
+
+def _run_streaming_ffmpeg(
+    command: list,
+    ts_files: list,
+    expected_checksums: dict = None,
+    extra_inputs: list = None,
+    stage: str = "ffmpeg",
+    read_slot=None,
+) -> dict | None:
+    """
+    Runs an ffmpeg command that reads MPEG-TS from stdin through run_ffmpeg,
+    feeding it the given segments from a writer thread. Each progress block
+    updates the live fps/speed metrics of the given stage.
+
+    :param extra_inputs: Optional list of (read_fd, write_fd, ts_files) from
+        os.pipe(). Each is fed from its own writer thread; the command must
+        read it as `pipe:<read_fd>`. This function takes ownership of the fds.
+    :param read_slot: Optional context manager factory (e.g.
+        JobScheduler.io_slot) held around every chunk read from the source,
+        so concurrent card reads are limited while the encodes still run in
+        parallel. The total wait is recorded as the stage's io_wait.
+    :return: dict with "checksums", "progress" (last progress block) and
+             "elapsed" on success, None on failure.
+    """
+    read_fd, write_fd = os.pipe()
+    inputs = [(read_fd, write_fd, ts_files)] + (extra_inputs or [])
+    segment_count = sum(len(files) for _, _, files in inputs)
+    logger.info(f"Running command: {' '.join(command)} ({segment_count} segments)")
+
+    waits = []
+
+    @contextlib.contextmanager
+    def timed_read_slot():
+        start = time.perf_counter()
+        with read_slot():
+            waits.append(time.perf_counter() - start)
+            yield
+
+    def feed(fd, files):
+        sink = open(fd, "wb", buffering=0)
+        try:
+            return _stream_segments(
+                files, sink, expected_checksums, timed_read_slot if read_slot else None
+            )
+        except BrokenPipeError:
+            logger.error("ffmpeg closed its input before all segments were written.")
+        except Exception as e:
+            logger.error(f"Exception while streaming segments to ffmpeg: {e}")
+        finally:
+            sink.close()
+        return None
+
+    start_time = time.perf_counter()
+    try:
+        result = run_ffmpeg(
+            command,
+            stage=stage,
+            stdin=read_fd,
+            pass_fds=tuple(fd for fd, _, _ in inputs[1:]),
+            feeders=[functools.partial(feed, fd, files) for _, fd, files in inputs],
+        )
+    except OSError as e:
+        # ffmpeg never started, so the write ends were not handed to a feeder
+        for _, fd, _ in inputs:
+            os.close(fd)
+        logger.error(f"Could not start ffmpeg: {e}")
+        metrics.record(stage, status="error", seconds=time.perf_counter() - start_time)
+        return None
+    if read_slot:
+        metrics.record("io_wait", during=stage, seconds=sum(waits))
+
+    if result["returncode"] != 0 or None in result["fed"]:
+        logger.error(f"ffmpeg failed with error: {_ffmpeg_failure(result)}")
+        metrics.record(stage, status="error", seconds=result["elapsed"])
+        return None
+
+    checksums = {}
+    for fed in result["fed"]:
+        checksums.update(fed)
+    return {
+        "checksums": checksums,
+        "progress": result["progress"],
+        "elapsed": result["elapsed"],
+    }
+
 
+def _log_throughput(result: dict, output_file: str, stage: str = "ffmpeg"):
+    """
+    Logs the ffmpeg throughput (input bytes and frames per second) and
+    records the same values as the metrics of `stage`.
+    """
+    elapsed = max(result["elapsed"], 1e-6)
+    bytes_in = sum(os.path.getsize(f) for f in result["checksums"])
+    bytes_out = os.path.getsize(output_file) if os.path.exists(output_file) else 0
+    progress = result["progress"]
+    # Output frames + dropped frames = decoded frames
+    frames = (
+        int(progress.get("frame", 0) or 0)
+        + int(progress.get("drop_frames", 0) or 0)
+        - int(progress.get("dup_frames", 0) or 0)
+    )
+    logger.info(
+        f"Processed {bytes_in / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({bytes_in / elapsed / 1e6:.1f} MB/s in, "
+        f"{frames / elapsed:.1f} frames/s, {bytes_out / 1e6:.1f} MB out, "
+        f"speed={progress.get('speed', 'N/A')})"
+    )
+    metrics.record(
+        stage,
+        status="ok",
+        output=output_file,
+        segments=len(result["checksums"]),
+        seconds=elapsed,
+        bytes_in=bytes_in,
+        bytes_out=bytes_out,
+        frames=frames,
+        fps=frames / elapsed,
+        speed=metrics.parse_speed(progress.get("speed")),
+    )
+
+
+def stream_aggregate_ts_files(
+    ts_files: list, output_file: str, expected_checksums: dict = None, read_slot=None
+) -> dict | None:
+    """
+    Concatenates TS files by piping them straight from the source into ffmpeg.
+    MPEG-TS can be joined at the byte level, so the segments are read in place
+    (no temporary copy) and each byte is read from the card only once.
+    The sha256 of every segment is computed in the same pass.
+
+    :param ts_files: Ordered list of TS files to concatenate.
+    :param output_file: Path to the aggregated TS file.
+    :param expected_checksums: Optional mapping of path -> sha256 to verify against.
+    :param read_slot: Optional context manager factory limiting concurrent
+        source reads (see _run_streaming_ffmpeg).
+    :return: Mapping of path -> sha256 on success, None on failure.
+    """
+    if not ts_files:
+        logger.warning("No TS files to aggregate.")
+        return None
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "mpegts",
+        "-i",
+        "pipe:0",
+        "-c",
+        "copy",  # Copy codecs since we're just concatenating
+        output_file,
+    ]
+    result = _run_streaming_ffmpeg(
+        command, ts_files, expected_checksums, stage="concat", read_slot=read_slot
+    )
+    if result is None:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return None
+
+    logger.info(f"Successfully created {output_file}")
+    _log_throughput(result, output_file, stage="concat")
+    return result["checksums"]
+
+
+def probe_gop_size(
+    input_file: str, max_packets: int = KEYFRAME_PROBE_PACKETS
+) -> int | None:
+    """
+    Estimates the GOP size (frames between keyframes) of the first video stream
+    by reading the packet flags of the first few hundred packets. Results go
+    through the shared probe cache, so each input is only inspected once.
+
+    :return: The most common keyframe interval, or None if it cannot be determined.
+    """
+    info = probe_media(input_file, keyframe_packets=max_packets)
+    if info is None:
+        logger.warning(f"Could not probe GOP size of {input_file}")
+        return None
+    return info.get("gop")
+
+
+def choose_keyframe_step(
+    gop_size: int | None, speed_factor: float, exact: bool = True
+) -> int | None:
+    """
+    Decides how many keyframes to advance per output frame when speeding up
+    with keyframes only. Keeping every `step`-th keyframe of a stream with the
+    given GOP size drops `gop_size * step - 1` of every `gop_size * step` frames.
+
+    :param exact: If True, only accept a step whose effective factor equals speed_factor.
+    :return: The keyframe step, or None when a full decode is required.
+    """
+    if not gop_size or gop_size > speed_factor:
+        return None
+    ratio = speed_factor / gop_size
+    step = max(1, round(ratio))
+    if exact and abs(ratio - step) > 1e-6:
+        return None
+    return step
+
+
+def _resolve_keyframe_step(
+    engine: str, probe_file: str, speed_factor: float
+) -> int | None:
+    """
+    Picks the speed-up engine for the given input.
+
+    "reencode" always decodes every frame. "keyframe" decodes keyframes only
+    whenever the GOP is short enough (the duration is exact, the frame spacing
+    may be approximate). "auto" uses keyframes only when the factor is an exact
+    multiple of the GOP size and falls back to a full re-encode otherwise.
+    """
+    if engine == "reencode":
+        return None
+
+    gop_size = probe_gop_size(probe_file)
+    step = choose_keyframe_step(gop_size, speed_factor, exact=(engine == "auto"))
+    if step is None:
+        logger.info(
+            f"Keyframe-only speed-up not applicable (GOP={gop_size}, "
+            f"factor={speed_factor}); falling back to full re-encode."
+        )
+    else:
+        logger.info(
+            f"Using keyframe-only speed-up (GOP={gop_size}, keeping 1 of every {step} keyframes)"
+        )
+    return step
+
+
+def _plan_adaptive_speed(
+    ts_files: list, speed_factor: float, keyframe_step: int | None
+) -> tuple | None:
+    """
+    Scores the motion of each input (lib.motion) and builds a select
+    expression that keeps driving footage at speed_factor, speeds up slow
+    spans further and drops static (parked) spans. Inputs that are static
+    from start to end are left out of the stream altogether.
+
+    :return: (files to stream, select expression, output fps), or None to
+        fall back to the fixed speed-up.
+    """
+    info = probe_media(ts_files[0])
+    fps = (info or {}).get("fps")
+    if not fps:
+        logger.warning(
+            f"Cannot read the frame rate of {ts_files[0]}; using a fixed speed-up"
+        )
+        return None
+    # Spans are matched on frame timestamps, so only the decimation step
+    # depends on whether every frame or only keyframes are decoded
+    base_step = max(1, round(speed_factor)) if keyframe_step is None else keyframe_step
+
+    plan = plan_speed_spans(ts_files)
+    if plan is None:
+        return None
+    files, spans = plan
+    return files, select_expression(spans, base_step), fps
+
+
+def _atempo_chain(speed_factor: float) -> str:
+    """
+    atempo supports a max of 2.0 per filter, so chain multiple filters.
+    """
+    atempo_filters = []
+    remaining_speed = speed_factor
+    while remaining_speed > 2.0:
+        atempo_filters.append("atempo=2.0")
+        remaining_speed /= 2.0
+    atempo_filters.append(f"atempo={remaining_speed}")
+    return ",".join(atempo_filters)
+
+
+def _build_speed_up_args(
+    speed_factor: float,
+    disable_audio: bool,
+    keyframe_step: int | None = None,
+    encoder: str = "libx264",
+    input_graph: str | None = None,
+    select_expr: str | None = None,
+    output_fps: float | None = None,
+    preview: PreviewOutputs | None = None,
+) -> list:
+    """
+    Builds the filter graph and encoder arguments shared by the speed-up paths.
+    When keyframe_step is given the input must be opened with `-skip_frame nokey`
+    so that only keyframes are decoded. The encoder's global arguments
+    (_encoder_global_args) must be placed before the input.
+
+    :param input_graph: Optional filter graph that produces the video to speed
+        up as `[stacked]` (used by the composite layouts); defaults to `[0:v]`.
+    :param select_expr: Optional per-frame select expression from
+        _plan_adaptive_speed; the kept frames are played back at output_fps.
+        Audio is always dropped in this mode.
+    :param preview: Optional PreviewOutputs; the decoded video is split so the
+        thumbnails (`[sprite]`) and the proxy of the sped-up video (`[proxy]`)
+        come from the same decode. The caller appends
+        preview.output_args("[proxy]", "[sprite]") after the main output file.
+    """
     # Calculate setpts value for video
     setpts = f"PTS/{speed_factor}"
+    if select_expr is not None:
+        # The spans are seconds from the start of the joined stream, but MPEG-TS
+        # timestamps start wherever the camera's clock was, so rebase them first
+        video_filter = (
+            f"setpts=PTS-STARTPTS,select={select_expr},setpts=N/({output_fps}*TB)"
+        )
+        if not disable_audio:
+            logger.warning("Audio is dropped by the adaptive speed-up")
+            disable_audio = True
+    elif keyframe_step is None or keyframe_step == 1:
+        video_filter = f"setpts={setpts}"
+    else:
+        video_filter = f"select=not(mod(n\\,{keyframe_step})),setpts={setpts}"
+
+    profile = ENCODER_PROFILES.get(encoder, {"args": ["-c:v", encoder]})
 
     # Prepare audio filters if audio is to be processed
     if not disable_audio:
-        # Calculate atempo filters for audio
-        # atempo supports a max of 2.0 per filter, so chain multiple filters
-        atempo_filters = []
-        remaining_speed = speed_factor
-        while remaining_speed > 2.0:
-            atempo_filters.append("atempo=2.0")
-            remaining_speed /= 2.0
-        atempo_filters.append(f"atempo={remaining_speed}")
-        atempo_filter = ",".join(atempo_filters)
-        audio_filter = f"[0:a]{atempo_filter}[a]"
+        audio_filter = f"[0:a]{_atempo_chain(speed_factor)}[a]"
     else:
         audio_filter = ""
 
-    # Choose codec: use hardware acceleration if available
-    # For macOS, use 'h264_videotoolbox'
-    video_codec = "h264_videotoolbox"
-
-    # Set encoding preset to 'ultrafast' for maximum speed
-    preset = "ultrafast"
-
     # Build filter_complex
-    if disable_audio:
-        filter_complex = f"[0:v]setpts={setpts}[v]"
+    source = "[stacked]" if input_graph else "[0:v]"
+    filter_complex = f"{input_graph};" if input_graph else ""
+    if preview is not None:
+        # The encoder's upload filter only applies to the main output
+        filter_complex += (
+            f"{source}split=2[main][thumbs];"
+            f"[thumbs]{preview.thumbnail_filter()}[sprite];"
+            f"[main]{video_filter},split=2[sped][proxy_in];"
+            f"[proxy_in]{preview.proxy_filter()}[proxy];"
+            f"[sped]{profile.get('filter') or 'null'}[v]"
+        )
     else:
-        filter_complex = f"[0:v]setpts={setpts}[v];{audio_filter}"
+        if profile.get("filter"):
+            video_filter += f",{profile['filter']}"
+        filter_complex += f"{source}{video_filter}[v]"
+    if not disable_audio:
+        filter_complex += f";{audio_filter}"
 
-    # Build the ffmpeg command
-    command = [
-        "ffmpeg",
-        "-i",
-        input_file,
+    args = [
         "-filter_complex",
         filter_complex,
         "-map",
@@ -110,38 +892,303 @@ def speed_up_ts_file(
     ]
 
     if not disable_audio:
-        command += ["-map", "[a]"]
+        args += ["-map", "[a]"]
+    if select_expr is not None:
+        # Otherwise the muxer may resample the retimed frames to its default rate
+        args += ["-r", f"{output_fps:g}"]
 
-    command += [
-        "-c:v",
-        video_codec,  # Use hardware acceleration for video
-        "-preset",
-        preset,  # Set encoding preset to ultrafast
-    ]
+    # Encoder-specific options (hardware acceleration / fastest preset)
+    args += profile["args"]
 
     if not disable_audio:
-        command += [
+        args += [
             "-c:a",
             "aac",  # Encode audio with AAC
             "-b:a",
             "64k",  # Set low bitrate for faster encoding
         ]
+    else:
+        # Disable audio
+        args += ["-an"]
 
+    return args
+
+
+def concat_and_speed_up_ts_files(
+    ts_files: list,
+    output_file: str,
+    speed_factor: float = 10.0,
+    disable_audio: bool = True,
+    expected_checksums: dict = None,
+    engine: str = "auto",
+    encoder: str | None = None,
+    adaptive: bool = False,
+    preview: PreviewOutputs | None = None,
+    read_slot=None,
+) -> dict | None:
+    """
+    Concatenates and speeds up TS files in a single ffmpeg invocation.
+    The segments are streamed into ffmpeg's stdin and fed directly into the
+    setpts filter graph, so no full-length intermediate file is written and
+    the footage is decoded only once. Throughput (bytes and frames per second)
+    is logged from ffmpeg's progress output.
+
+    :param ts_files: Ordered list of TS files to concatenate.
+    :param output_file: Path to the output speedup TS file.
+    :param speed_factor: Factor by which to speed up the video.
+    :param disable_audio: If True, audio stream will be disabled to speed up processing.
+    :param expected_checksums: Optional mapping of path -> sha256 to verify against.
+    :param engine: "auto", "keyframe" or "reencode" (see _resolve_keyframe_step).
+    :param encoder: Video encoder name; None selects the fastest available one.
+    :param adaptive: If True, vary the speed with the amount of motion and
+        skip static segments (see _plan_adaptive_speed).
+    :param preview: Optional PreviewOutputs written from the same decode.
+    :param read_slot: Optional context manager factory limiting concurrent
+        source reads (see _run_streaming_ffmpeg).
+    :return: Mapping of path -> sha256 of the streamed segments on success
+        (segments skipped as static are not included), None on failure.
+    """
+    if not ts_files:
+        logger.warning("No TS files to aggregate.")
+        return None
+
+    encoder = select_encoder(encoder)
+    # The first segment is representative of the card's GOP structure
+    keyframe_step = _resolve_keyframe_step(engine, ts_files[0], speed_factor)
+    plan = (
+        _plan_adaptive_speed(ts_files, speed_factor, keyframe_step)
+        if adaptive
+        else None
+    )
+    streamed_files, select_expr, output_fps = plan or (ts_files, None, None)
+
+    command = ["ffmpeg", "-y", "-loglevel", "error"] + _encoder_global_args(encoder)
+    if keyframe_step is not None:
+        command += ["-skip_frame", "nokey"]
+    command += ["-f", "mpegts", "-i", "pipe:0"]
+    command += _build_speed_up_args(
+        speed_factor,
+        disable_audio,
+        keyframe_step,
+        encoder,
+        select_expr=select_expr,
+        output_fps=output_fps,
+        preview=preview,
+    )
     command += [output_file]
+    if preview is not None:
+        command += preview.output_args("[proxy]", "[sprite]")
 
-    if disable_audio:
-        # Disable audio
-        command.insert(-1, "-an")
+    result = _run_streaming_ffmpeg(
+        command,
+        streamed_files,
+        expected_checksums,
+        stage="concat_speed_up",
+        read_slot=read_slot,
+    )
+    if result is None:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return None
+
+    logger.info(f"Successfully created speedup file: {output_file}")
+    if preview is not None:
+        preview.write_index(streamed_files)
+    _log_throughput(result, output_file, stage="concat_speed_up")
+    return result["checksums"]
+
+
+def _build_composite_graph(
+    layout: str, front_info: dict, rear_offset: float = 0.0
+) -> str | None:
+    """
+    Builds the filter graph that combines the front ([0:v]) and rear ([1:v])
+    streams into `[stacked]`. Both streams are rebased to start at zero, and
+    the one that started recording later is delayed by rear_offset seconds.
+    """
+    front_pts = "PTS-STARTPTS"
+    rear_pts = "PTS-STARTPTS"
+    if rear_offset > 0:
+        rear_pts += f"+{rear_offset}/TB"
+    elif rear_offset < 0:
+        front_pts += f"+{-rear_offset}/TB"
+
+    if layout == "hstack":
+        # hstack needs equal heights, so scale the rear frame to the front's height
+        rear_filter = f"scale=-2:{front_info['height']}"
+        combine = "hstack=inputs=2:shortest=1"
+    elif layout == "pip":
+        inset_width = int(front_info["width"] * PIP_SCALE) // 2 * 2
+        rear_filter = f"scale={inset_width}:-2"
+        combine = f"overlay=W-w-{PIP_MARGIN}:H-h-{PIP_MARGIN}:shortest=1"
+    else:
+        logger.error(f"Unknown composite layout: {layout}")
+        return None
+
+    return (
+        f"[0:v]setpts={front_pts}[front];"
+        f"[1:v]setpts={rear_pts},{rear_filter}[rear];"
+        f"[front][rear]{combine}[stacked]"
+    )
+
+
+def composite_and_speed_up_ts_files(
+    front_files: list,
+    rear_files: list,
+    output_file: str,
+    layout: str = "hstack",
+    speed_factor: float = 10.0,
+    disable_audio: bool = True,
+    rear_offset: float = 0.0,
+    expected_checksums: dict = None,
+    engine: str = "auto",
+    encoder: str | None = None,
+    read_slot=None,
+) -> dict | None:
+    """
+    Renders the front and rear footage of one job into a single sped-up video,
+    either side by side ("hstack") or with the rear camera as an inset in the
+    bottom-right corner ("pip"). The front segments are streamed into ffmpeg's
+    stdin and the rear segments into a second pipe, and the two are combined
+    before setpts, so both cameras are decoded and encoded in one pass.
+
+    :param front_files: Ordered list of front TS files.
+    :param rear_files: Ordered list of rear TS files covering the same time span.
+    :param output_file: Path to the output composite TS file.
+    :param layout: "hstack" or "pip".
+    :param rear_offset: Seconds the rear recording starts after the front one
+        (negative if it starts earlier), from the segment timestamps.
+    :param engine: "auto", "keyframe" or "reencode" (see _resolve_keyframe_step).
+    :param encoder: Video encoder name; None selects the fastest available one.
+    :param read_slot: Optional context manager factory limiting concurrent
+        source reads (see _run_streaming_ffmpeg).
+    :return: Mapping of path -> sha256 for both cameras on success, None on failure.
+    """
+    if not front_files or not rear_files:
+        logger.warning("Composite output needs both front and rear TS files.")
+        return None
+
+    front_info = probe_media(front_files[0])
+    if not front_info or not front_info.get("height"):
+        logger.error(f"Could not read the resolution of {front_files[0]}")
+        return None
+    input_graph = _build_composite_graph(layout, front_info, rear_offset)
+    if input_graph is None:
+        return None
+
+    encoder = select_encoder(encoder)
+    keyframe_step = _resolve_keyframe_step(engine, front_files[0], speed_factor)
+    # Keyframe-only decoding keeps the cameras in step only if their GOPs match
+    if keyframe_step is not None and probe_gop_size(rear_files[0]) != probe_gop_size(
+        front_files[0]
+    ):
+        logger.info("Front and rear GOP sizes differ; decoding every frame.")
+        keyframe_step = None
+    skip_args = ["-skip_frame", "nokey"] if keyframe_step is not None else []
+
+    read_fd, write_fd = os.pipe()
+    command = ["ffmpeg", "-y", "-loglevel", "error"] + _encoder_global_args(encoder)
+    command += skip_args + ["-f", "mpegts", "-i", "pipe:0"]
+    command += skip_args + ["-f", "mpegts", "-i", f"pipe:{read_fd}"]
+    command += _build_speed_up_args(
+        speed_factor, disable_audio, keyframe_step, encoder, input_graph
+    )
+    command += [output_file]
+
+    result = _run_streaming_ffmpeg(
+        command,
+        front_files,
+        expected_checksums,
+        extra_inputs=[(read_fd, write_fd, rear_files)],
+        stage="composite",
+        read_slot=read_slot,
+    )
+    if result is None:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return None
+
+    logger.info(f"Successfully created composite file: {output_file}")
+    _log_throughput(result, output_file, stage="composite")
+    return result["checksums"]
+
+
+def speed_up_ts_file(
+    input_file: str,
+    output_file: str,
+    speed_factor: float = 10.0,
+    disable_audio: bool = True,
+    engine: str = "auto",
+    encoder: str | None = None,
+    adaptive: bool = False,
+    preview: PreviewOutputs | None = None,
+):
+    """
+    Speeds up a TS file by the given speed factor, utilizing hardware acceleration
+    when available (see select_encoder).
+    Optionally disables audio to speed up the process.
+    When the GOP structure allows it, only keyframes are decoded so that the
+    frames dropped by the speed-up are never decoded in the first place.
+
+    :param input_file: Path to the input TS file.
+    :param output_file: Path to the output speedup TS file.
+    :param speed_factor: Factor by which to speed up the video.
+    :param disable_audio: If True, audio stream will be disabled to speed up processing.
+    :param engine: "auto", "keyframe" or "reencode" (see _resolve_keyframe_step).
+    :param encoder: Video encoder name; None selects the fastest available one.
+    :param adaptive: If True, vary the speed with the amount of motion
+        (see _plan_adaptive_speed).
+    :param preview: Optional PreviewOutputs written from the same decode; its
+        source_files are the segments the input was aggregated from.
+    """
+    if not os.path.exists(input_file):
+        logger.error(f"Input file does not exist: {input_file}")
+        return
+
+    encoder = select_encoder(encoder)
+    keyframe_step = _resolve_keyframe_step(engine, input_file, speed_factor)
+    plan = (
+        _plan_adaptive_speed([input_file], speed_factor, keyframe_step)
+        if adaptive
+        else None
+    )
+    _, select_expr, output_fps = plan or (None, None, None)
+
+    # Build the ffmpeg command
+    command = ["ffmpeg", "-nostdin", "-y"] + _encoder_global_args(encoder)
+    if keyframe_step is not None:
+        command += ["-skip_frame", "nokey"]
+    command += ["-i", input_file]
+    command += _build_speed_up_args(
+        speed_factor,
+        disable_audio,
+        keyframe_step,
+        encoder,
+        select_expr=select_expr,
+        output_fps=output_fps,
+        preview=preview,
+    )
+    command += [output_file]
+    if preview is not None:
+        command += preview.output_args("[proxy]", "[sprite]")
 
     try:
         logger.info(f"Running speed-up command: {' '.join(command)}")
-        result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
+        with metrics.stage("speed_up", output=output_file) as fields:
+            result = run_ffmpeg(command, stage="speed_up")
+            _record_file_sizes(fields, [input_file], output_file, result["returncode"])
 
-        if result.returncode != 0:
-            logger.error(f"ffmpeg speed-up failed with error: {result.stderr}")
+        if result["returncode"] != 0:
+            logger.error(
+                f"ffmpeg speed-up failed with error: {_ffmpeg_failure(result)}"
+            )
         else:
             logger.info(f"Successfully created speedup file: {output_file}")
+            if preview is not None:
+                preview.write_index()
+            return
     except Exception as e:
         logger.error(f"Exception during ffmpeg speed-up execution: {e}")
+    # A partial output would be mistaken for a result and keeps holding disk space
+    if os.path.exists(output_file):
+        os.remove(output_file)
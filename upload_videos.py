@@ -2,15 +2,94 @@
 
 import os
 import shutil
+from typing import Callable
 from loguru import logger
-from youtube_uploader import authenticate_youtube, upload_video_to_youtube
+from concurrent.futures import ThreadPoolExecutor
+from youtube_uploader import (
+    DEFAULT_CHUNKSIZE,
+    authenticate_youtube,
+    upload_video_to_youtube,
+)
+from lib import metrics
+from lib.dedup import KIND_UPLOAD, DedupIndex
+from lib.quota import DEFAULT_DAILY_BUDGET, UPLOAD_QUOTA_COST, QuotaTracker
+from lib.upload_queue import UPLOAD_ORDERS, UploadQueue
+from lib.upload_state import UploadStateStore
 from googleapiclient.errors import HttpError
 import argparse
 import schedule
 import time
 
 
-def upload_output_files(output_dir: str, youtube, archive_dir: str = "archive"):
+# 1本のアップロードで概ね使い切れる帯域 (Mbps)。これを基準に同時アップロード数を決める
+UPLOAD_MBPS_PER_WORKER = 20
+MAX_UPLOAD_WORKERS = 4
+# アップロード中のファイルを移しておく output_dir 内のディレクトリ
+UPLOADING_DIR = "uploading"
+
+
+def upload_workers_for_bandwidth(bandwidth_mbps: float | None) -> int:
+    """回線の上り帯域から同時アップロード数を決める（1〜MAX_UPLOAD_WORKERS）"""
+    if not bandwidth_mbps:
+        return 1
+    return max(
+        1, min(MAX_UPLOAD_WORKERS, int(bandwidth_mbps // UPLOAD_MBPS_PER_WORKER))
+    )
+
+
+def list_upload_candidates(output_dir: str) -> list[str]:
+    """
+    outputディレクトリ内のアップロード対象のファイル（処理中の中間ファイルを除く）を返します。
+    前回アップロード中に中断して uploading ディレクトリに残っているファイルも含めます。
+    """
+    candidates = []
+    for directory in (os.path.join(output_dir, UPLOADING_DIR), output_dir):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        candidates += [
+            os.path.join(directory, f)
+            for f in names
+            if f.endswith(".ts")
+            and not f.endswith("_speedup.ts")  # speedupファイルはリネーム済み
+            # 処理中の中間ファイルは対象外
+            and not f.endswith(("_aggregated.ts", "_part.ts"))
+        ]
+    return candidates
+
+
+def stage_for_upload(video_file: str) -> str:
+    """
+    アップロードする前に、ファイルを同じディスクの uploading ディレクトリへ rename する。
+    アップロード中に取り込みが同じ出力に追記しても、追記された出力は元のパスに新しく作られ、
+    アップロードしていない映像がアーカイブへ移動されることはない。
+
+    :return: 移動後のパス (既に uploading ディレクトリにあればそのまま)
+    :raises FileExistsError: 同じ名前のファイルがまだアップロード中の場合
+    """
+    if is_staged(video_file):
+        return video_file
+    directory = os.path.dirname(os.path.abspath(video_file))
+    staging_dir = os.path.join(directory, UPLOADING_DIR)
+    os.makedirs(staging_dir, exist_ok=True)
+    staged_file = os.path.join(staging_dir, os.path.basename(video_file))
+    if os.path.exists(staged_file):
+        # 先にそちらをアップロードし終えてから移す
+        raise FileExistsError(f"{staged_file} is still waiting to be uploaded")
+    os.rename(video_file, staged_file)
+    return staged_file
+
+
+def upload_output_files(
+    output_dir: str,
+    youtube,
+    archive_dir: str = "archive",
+    workers: int = 1,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    state_store: UploadStateStore | None = None,
+    dedup: DedupIndex | None = None,
+):
     """
     outputディレクトリ内のファイルをチェックし、存在する場合にYouTubeにアップロードします。
     アップロードが成功したファイルはarchiveディレクトリに移動します。
@@ -18,6 +97,10 @@ def upload_output_files(output_dir: str, youtube, archive_dir: str = "archive"):
     :param output_dir: 処理された動画ファイルが格納されているディレクトリ
     :param youtube: 認証済みのYouTubeサービスオブジェクト
     :param archive_dir: アップロード済みの動画ファイルを移動するディレクトリ
+    :param workers: 同時にアップロードするファイル数
+    :param chunksize: 再開可能アップロードのチャンクサイズ（バイト）
+    :param state_store: 中断したアップロードを再開するための状態ファイル
+    :param dedup: アップロード済みの動画と内容が同じファイルをアップロードせずに済ませるための索引
     """
     if not os.path.exists(output_dir):
         logger.error(f"Output directory does not exist: {output_dir}")
@@ -25,61 +108,194 @@ def upload_output_files(output_dir: str, youtube, archive_dir: str = "archive"):
 
     os.makedirs(archive_dir, exist_ok=True)
 
-    processed_files = [
-        os.path.join(output_dir, f)
-        for f in os.listdir(output_dir)
-        if f.endswith(".ts")
-        and not f.endswith("_speedup.ts")  # speedupファイルはリネーム済み
-    ]
+    processed_files = list_upload_candidates(output_dir)
 
     if not processed_files:
         logger.warning(f"No processed .ts files found in {output_dir} for uploading.")
         return
 
-    for video_file in processed_files:
-        if os.path.exists(video_file):
-            date_camera = os.path.splitext(os.path.basename(video_file))[
-                0
-            ]  # yyyymmdd_front または yyyymmdd_rear
-            title = f"{date_camera} - Speeded Up Video"
-            description = f"Speeded up video for {date_camera.split('_')[0]} from {date_camera.split('_')[1]} camera."
-            logger.info(f"Uploading {video_file} to YouTube with title '{title}'")
-            try:
-                video_id = upload_video_to_youtube(
-                    youtube, video_file, title, description
-                )
-                logger.info(f"Uploaded video to YouTube with ID: {video_id}")
-
-                # アップロードが成功したら、ファイルをarchiveディレクトリに移動
-                archived_file = os.path.join(archive_dir, os.path.basename(video_file))
-                shutil.move(video_file, archived_file)
-                logger.info(f"Moved uploaded video to archive: {archived_file}")
-
-            except HttpError as e:
-                if e.resp.status == 403:
-                    logger.error(
-                        "YouTube Data APIのクォータを超過しました。後ほど再試行してください。"
-                    )
-                else:
-                    logger.error(f"Failed to upload video to YouTube: {e}")
-            except Exception as e:
-                logger.error(f"An unexpected error occurred during upload: {e}")
+    with ThreadPoolExecutor(
+        max_workers=max(1, workers), thread_name_prefix="upload"
+    ) as executor:
+        for video_file in processed_files:
+            executor.submit(
+                upload_output_file,
+                video_file,
+                youtube,
+                archive_dir,
+                chunksize,
+                state_store,
+                dedup,
+            )
+
+
+def upload_output_file(
+    video_file: str,
+    youtube,
+    archive_dir: str,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    state_store: UploadStateStore | None = None,
+    dedup: DedupIndex | None = None,
+):
+    """
+    1つの動画ファイルをアップロードし、成功したらarchiveディレクトリに移動します。
+    """
+    if not os.path.exists(video_file):
+        logger.error(f"Processed video file does not exist: {video_file}")
+        return
+
+    try:
+        upload_and_archive(
+            video_file, youtube, archive_dir, chunksize, state_store, dedup
+        )
+    except HttpError as e:
+        if e.resp.status == 403:
+            logger.error(
+                "YouTube Data APIのクォータを超過しました。後ほど再試行してください。"
+            )
         else:
-            logger.error(f"Processed video file does not exist: {video_file}")
+            logger.error(f"Failed to upload video to YouTube: {e}")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during upload: {e}")
+
+
+def is_staged(video_file: str) -> bool:
+    """uploading ディレクトリにある (前回のアップロードが中断した) ファイルか"""
+    return (
+        os.path.basename(os.path.dirname(os.path.abspath(video_file))) == UPLOADING_DIR
+    )
+
+
+def archive_path_for(archive_dir: str, video_file: str) -> str:
+    """
+    archive ディレクトリでの移動先。同じ名前のファイル (追記した出力を再びアップロードした場合など)
+    があれば上書きせず、_1, _2, ... を付けた名前にする。
+    """
+    name, ext = os.path.splitext(os.path.basename(video_file))
+    archived_file = os.path.join(archive_dir, f"{name}{ext}")
+    number = 1
+    while os.path.exists(archived_file):
+        archived_file = os.path.join(archive_dir, f"{name}_{number}{ext}")
+        number += 1
+    return archived_file
+
+
+def upload_and_archive(
+    video_file: str,
+    youtube,
+    archive_dir: str,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    state_store: UploadStateStore | None = None,
+    dedup: DedupIndex | None = None,
+    on_insert: Callable[[], None] | None = None,
+):
+    """
+    1つの動画ファイルをアップロードしてarchiveディレクトリに移動します。
+    アップロード済みの動画と内容が同じ場合は、アップロードせずに移動だけ行います。
+    ファイルは先に uploading ディレクトリへ移し (stage_for_upload)、そのパスをアップロード・移動します。
+    失敗した場合は例外 (HttpError など) をそのまま送出します。
+
+    :param on_insert: videos.insert が受け付けられたとき (クォータを消費したとき) に呼ぶ関数
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    video_file = stage_for_upload(video_file)
+    original = dedup.find_duplicate(KIND_UPLOAD, video_file) if dedup else None
+    if original:
+        archived_file = archive_path_for(archive_dir, video_file)
+        shutil.move(video_file, archived_file)
+        logger.info(
+            f"Skipped uploading {video_file}: same content as {original} "
+            f"(moved to {archived_file})"
+        )
+        return
+
+    date_camera = os.path.splitext(os.path.basename(video_file))[
+        0
+    ]  # yyyymmdd_front, yyyymmdd_rear, yyyymmdd_composite または yyyymmdd_hhmmss_front (トリップ単位)
+    camera = date_camera.rsplit("_", 1)[-1]
+    if camera == "composite":
+        camera = "front and rear"
+    title = f"{date_camera} - Speeded Up Video"
+    description = (
+        f"Speeded up video for {date_camera.split('_')[0]} from {camera} camera."
+    )
+    logger.info(f"Uploading {video_file} to YouTube with title '{title}'")
+    start = time.perf_counter()
+    with metrics.stage(
+        "upload", output=video_file, bytes_in=os.path.getsize(video_file)
+    ) as fields:
+        video_id = upload_video_to_youtube(
+            youtube,
+            video_file,
+            title,
+            description,
+            chunksize=chunksize,
+            state_store=state_store,
+            on_session_started=on_insert,
+        )
+        logger.info(f"Uploaded video to YouTube with ID: {video_id}")
+        fields["mbps"] = fields["bytes_in"] * 8 / 1e6 / (time.perf_counter() - start)
+
+        # アップロードが成功したら、ファイルをarchiveディレクトリに移動
+        archived_file = archive_path_for(archive_dir, video_file)
+        shutil.move(video_file, archived_file)
+        logger.info(f"Moved uploaded video to archive: {archived_file}")
+        if dedup:
+            dedup.record(KIND_UPLOAD, [archived_file])
 
 
-def scheduled_upload_task(output_dir: str, youtube, archive_dir: str = "archive"):
+def upload_queue_for(
+    output_dir: str,
+    youtube,
+    archive_dir: str = "archive",
+    quota: QuotaTracker | None = None,
+    order: str = "oldest",
+    workers: int = 1,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    state_store: UploadStateStore | None = None,
+    dedup: DedupIndex | None = None,
+) -> UploadQueue:
+    """
+    outputディレクトリを監視し、出力が確定したらすぐにアップロードするキューを作ります。
+    中断したセッションの再開はクォータを消費しないため、コストを0として数えます。
+    アップロード済みの動画との重複はワーカーで判定し (ファイル全体のハッシュが必要なことがあるため)、
+    アップロードしなかった場合は予約したクォータが返されます。
+    """
+
+    def cost_of(video_file: str) -> int:
+        if state_store is not None and state_store.get(video_file):
+            return 0
+        return UPLOAD_QUOTA_COST
+
+    return UploadQueue(
+        output_dir,
+        list_files=lambda: list_upload_candidates(output_dir),
+        upload=lambda video_file, on_insert: upload_and_archive(
+            video_file, youtube, archive_dir, chunksize, state_store, dedup, on_insert
+        ),
+        quota=quota or QuotaTracker(),
+        cost_of=cost_of,
+        workers=workers,
+        order=order,
+        resume_first=is_staged,
+    )
+
+
+def scheduled_upload_task(
+    output_dir: str, youtube, archive_dir: str = "archive", **upload_options
+):
     """
     スケジュールされたタイミングでアップロードタスクを実行します。
     """
     logger.info("Scheduled upload task started.")
-    upload_output_files(output_dir, youtube, archive_dir)
+    upload_output_files(output_dir, youtube, archive_dir, **upload_options)
     logger.info("Scheduled upload task completed.")
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Upload processed video files to YouTube once a day."
+        description="Upload processed video files to YouTube once a day, "
+        "or as soon as they are ready with --daemon."
     )
     parser.add_argument(
         "--output_dir",
@@ -99,18 +315,120 @@ def main():
         type=str,
         help="Daily time to run the upload task (24-hour format, e.g., '02:00').",
     )
+    parser.add_argument(
+        "--upload_workers",
+        default=None,
+        type=int,
+        help="Number of files to upload concurrently "
+        "(default: derived from --upload_bandwidth_mbps).",
+    )
+    parser.add_argument(
+        "--upload_bandwidth_mbps",
+        default=None,
+        type=float,
+        help=f"Upstream bandwidth in Mbps; one upload worker per "
+        f"{UPLOAD_MBPS_PER_WORKER} Mbps (max {MAX_UPLOAD_WORKERS}).",
+    )
+    parser.add_argument(
+        "--chunk_size_mb",
+        default=DEFAULT_CHUNKSIZE // (1024 * 1024),
+        type=int,
+        help="Chunk size of resumable uploads in MiB.",
+    )
+    parser.add_argument(
+        "--upload_state",
+        default="upload_state.json",
+        type=str,
+        help="File that stores upload sessions so interrupted uploads can resume.",
+    )
+    parser.add_argument(
+        "--dedup_index",
+        default=None,
+        type=str,
+        help="Index of uploaded videos; outputs with the same content are archived "
+        "without uploading (default: <output_dir>/dedup_index.sqlite3).",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Watch --output_dir and upload each output as soon as it is finalized, "
+        "within the daily quota budget (instead of once a day at --upload_time).",
+    )
+    parser.add_argument(
+        "--upload_order",
+        default="oldest",
+        choices=UPLOAD_ORDERS,
+        help="Which files the daemon uploads first.",
+    )
+    parser.add_argument(
+        "--quota_budget",
+        default=DEFAULT_DAILY_BUDGET,
+        type=int,
+        help=f"YouTube Data API units the daemon may spend per day "
+        f"(one upload costs {UPLOAD_QUOTA_COST}).",
+    )
+    parser.add_argument(
+        "--quota_state",
+        default="quota_state.json",
+        type=str,
+        help="File that records the quota units spent today.",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        default=None,
+        type=str,
+        help="JSON-lines file to append upload metrics to "
+        "(default: <output_dir>/metrics.jsonl).",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        default=None,
+        type=int,
+        help="Serve Prometheus-format metrics on this local port.",
+    )
 
     args = parser.parse_args()
 
+    metrics.configure(
+        args.metrics_file or os.path.join(args.output_dir, "metrics.jsonl"),
+        args.metrics_port,
+    )
+
     # YouTube認証
     youtube = authenticate_youtube()
 
+    upload_options = {
+        "workers": args.upload_workers
+        or upload_workers_for_bandwidth(args.upload_bandwidth_mbps),
+        "chunksize": args.chunk_size_mb * 1024 * 1024,
+        "state_store": UploadStateStore(args.upload_state),
+        "dedup": DedupIndex(
+            args.dedup_index or os.path.join(args.output_dir, "dedup_index.sqlite3")
+        ),
+    }
+
+    if args.daemon:
+        queue = upload_queue_for(
+            args.output_dir,
+            youtube,
+            args.archive_dir,
+            quota=QuotaTracker(args.quota_state, args.quota_budget),
+            order=args.upload_order,
+            **upload_options,
+        )
+        try:
+            queue.run()
+        except KeyboardInterrupt:
+            logger.info("Upload daemon terminated by user.")
+        return
+
     # スケジュールの設定
     schedule.every().day.at(args.upload_time).do(
         scheduled_upload_task,
         output_dir=args.output_dir,
         youtube=youtube,
         archive_dir=args.archive_dir,
+        **upload_options,
     )
 
     logger.info(f"Scheduler started. Upload task will run daily at {args.upload_time}.")
@@ -1,41 +1,174 @@
 # youtube_uploader.py
 
+import json
 import os
 import pickle
+import threading
+import time
+from typing import Callable
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, build_http
 from loguru import logger
 
+from lib.upload_state import UploadStateStore
+
 # スコープの設定
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 
+# ディスカバリドキュメントのキャッシュ
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
+DISCOVERY_CACHE_PATH = os.path.join(".cache", "youtube.v3.discovery.json")
+DISCOVERY_CACHE_TTL = 7 * 24 * 60 * 60
 
-def authenticate_youtube():
+# 再開可能アップロードのチャンクサイズ (256KiBの倍数である必要がある)
+DEFAULT_CHUNKSIZE = 8 * 1024 * 1024
+
+_thread_local = threading.local()
+
+
+def _load_credentials():
+    """
+    token.json から認証情報を読み込む。アクセストークンの期限切れは問題にしない
+    (リクエスト時に AuthorizedHttp がリフレッシュトークンで自動更新する)。
+    リフレッシュできない場合のみ、ブラウザでの再認証を行う。
+    """
     creds = None
     # トークンファイルが存在する場合、それをロード
     if os.path.exists("token.json"):
         with open("token.json", "rb") as token:
             creds = pickle.load(token)
-    # 認証が無効な場合、再認証
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "client_secrets.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
+    # 認証が無効で、リフレッシュもできない場合は再認証
+    if not creds or not (creds.valid or creds.refresh_token):
+        flow = InstalledAppFlow.from_client_secrets_file("client_secrets.json", SCOPES)
+        creds = flow.run_local_server(port=0)
         # トークンを保存
         with open("token.json", "wb") as token:
             pickle.dump(creds, token)
-    return build("youtube", "v3", credentials=creds)
+    return creds
+
+
+def load_discovery_document(
+    cache_path: str = DISCOVERY_CACHE_PATH, ttl: float = DISCOVERY_CACHE_TTL
+) -> str:
+    """
+    YouTube Data API のディスカバリドキュメントを返す。
+    キャッシュが ttl 秒以内ならネットワークにアクセスせずにそれを使う。
+    取得に失敗した場合は古いキャッシュ、それも無ければライブラリ同梱のものを使う。
+    """
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < ttl:
+        with open(cache_path) as f:
+            return f.read()
+
+    try:
+        resp, content = build_http().request(DISCOVERY_URL)
+        if resp.status != 200:
+            raise HttpError(resp, content, uri=DISCOVERY_URL)
+        document = content.decode("utf-8")
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(document)
+        os.replace(tmp_path, cache_path)
+        return document
+    except Exception as e:
+        logger.warning(f"Could not refresh the discovery document: {e}")
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return f.read()
+    return get_static_doc("youtube", "v3")
+
+
+class _LazyService:
+    """
+    最初に属性へアクセスされるまで、サービスオブジェクトの構築を遅延する。
+    起動時にはネットワークにアクセスしないため、アップロードするまではオフラインでも動く。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._service = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._service is None:
+                self._service = self._factory()
+        return getattr(self._service, name)
+
+
+def authenticate_youtube():
+    creds = _load_credentials()
+    return _LazyService(
+        lambda: build_from_document(load_discovery_document(), credentials=creds)
+    )
+
+
+def _thread_http(youtube):
+    """
+    httplib2.Http はスレッドセーフではないため、アップロードするスレッドごとに
+    同じ認証情報を使う Http オブジェクトを作る。
+    """
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        # build_http は 308 (Resume Incomplete) をリダイレクトとして扱わない設定にする
+        http = build_http()
+        if isinstance(youtube._http, AuthorizedHttp):
+            http = AuthorizedHttp(youtube._http.credentials, http=http)
+        _thread_local.http = http
+    return http
+
+
+def query_upload_session(
+    http, resumable_uri: str, size: int
+) -> tuple[int, dict | None]:
+    """
+    再開可能アップロードのセッションに、サーバーが受信済みのバイト数を問い合わせる。
+    Content-Range: bytes */<サイズ> の空のPUTを送り、308 の Range ヘッダから読み取る。
+
+    :return: (受信済みのバイト数, アップロードが完了していれば動画リソース、未完了なら None)
+    :raises HttpError: セッションが無効 (期限切れなら 404/410) な場合
+    """
+    resp, content = http.request(
+        resumable_uri,
+        "PUT",
+        headers={"Content-Range": f"bytes */{size}", "Content-Length": "0"},
+    )
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=resumable_uri)
+    # Range: bytes=0-<最後に受信したバイト>。無ければまだ何も受信していない
+    received = resp.get("range", "")
+    if not received:
+        return 0, None
+    return int(received.rpartition("-")[2]) + 1, None
 
 
 def upload_video_to_youtube(
-    youtube, video_file, title, description, category_id=22, privacy_status="private"
+    youtube,
+    video_file,
+    title,
+    description,
+    category_id=22,
+    privacy_status="private",
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    state_store: UploadStateStore | None = None,
+    on_session_started: Callable[[], None] | None = None,
 ):
+    """
+    動画をチャンク単位で再開可能アップロードする。
+    state_store を渡すと、セッションURIと確認済みのバイト位置を保存し、
+    プロセスの再起動後も最後に確認されたバイト位置から再開する。
+    複数のスレッドから同時に呼び出してよい。
+
+    :param on_session_started: videos.insert が受け付けられ、新しいセッションが作られたときに
+        1回呼ぶ関数 (クォータの消費を確定する)。保存済みのセッションを再開する場合は呼ばない
+    """
     body = {
         "snippet": {
             "title": title,
@@ -46,17 +179,60 @@ def upload_video_to_youtube(
     }
 
     media = MediaFileUpload(
-        video_file, chunksize=-1, resumable=True, mimetype="video/*"
+        video_file, chunksize=chunksize, resumable=True, mimetype="video/*"
     )
 
     request = youtube.videos().insert(
         part="snippet,status", body=body, media_body=media
     )
+    http = _thread_http(youtube)
 
+    saved = state_store.get(video_file) if state_store else None
     response = None
+    if saved:
+        # 保存したバイト位置の後にサーバーが受信した分もあり得るので、実際の位置を問い合わせる
+        try:
+            progress, response = query_upload_session(
+                http, saved["resumable_uri"], media.size()
+            )
+        except HttpError as e:
+            if e.resp.status not in (404, 410):
+                raise
+            # セッションの有効期限切れ。最初からやり直す
+            logger.warning(f"Upload session expired for {video_file}; restarting")
+            state_store.forget(video_file)
+        else:
+            logger.info(
+                f"Resuming upload of {video_file} from byte {progress} "
+                f"of {media.size()}"
+            )
+            request.resumable_uri = saved["resumable_uri"]
+            request.resumable_progress = progress
+
+    # 再開したセッションのクォータは作成時に消費済み
+    started = request.resumable_uri is not None
     while response is None:
-        status, response = request.next_chunk()
+        try:
+            status, response = request.next_chunk(http=http, num_retries=3)
+        finally:
+            if not started and request.resumable_uri is not None:
+                started = True
+                if on_session_started:
+                    on_session_started()
+                # 最初のチャンクで失敗しても、次回は同じセッションを (クォータを使わずに) 再開する
+                if state_store:
+                    state_store.update(
+                        video_file, request.resumable_uri, request.resumable_progress
+                    )
         if status:
-            logger.info(f"Uploading... {int(status.progress() * 100)}%")
+            if state_store and request.resumable_uri:
+                state_store.update(
+                    video_file, request.resumable_uri, request.resumable_progress
+                )
+            logger.info(
+                f"Uploading {os.path.basename(video_file)}... {int(status.progress() * 100)}%"
+            )
+    if state_store:
+        state_store.forget(video_file)
     logger.info(f"Upload Complete! Video ID: {response.get('id')}")
     return response.get("id")